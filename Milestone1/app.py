@@ -1,7 +1,8 @@
 import streamlit as st
-import pandas as pd
 import os
 
+from storage import find_cleaned_dataset, load_cleaned_dataset
+
 # Page config
 st.set_page_config(
     page_title="FitPulse Health Anomaly Detection",
@@ -11,13 +12,13 @@ st.set_page_config(
 st.title("FitPulse Health Anomaly Detection")
 st.subheader("Milestone 1 – Cleaned Fitness Dataset Visualization")
 
-DATA_PATH = "data/cleaned_dataset.csv"
+DATA_PATH = find_cleaned_dataset("data")
 
 # Check file exists
 if not os.path.exists(DATA_PATH):
-    st.error("❌ cleaned_dataset.csv not found in data folder")
+    st.error("❌ No cleaned dataset (cleaned_dataset.csv or cleaned_dataset.parquet) in data folder")
 else:
-    df = pd.read_csv(DATA_PATH)
+    df = load_cleaned_dataset(DATA_PATH)
 
     st.markdown("## 📊 Dataset Preview")
     st.dataframe(df.head(20))
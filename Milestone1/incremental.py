@@ -0,0 +1,287 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+from preprocess import (
+    clean_heart_rate, clean_sleep, clean_steps, merge_metrics, resample_heart_rate,
+)
+from rollups import update_rollups
+from storage import (
+    COLUMNS, PARQUET_NAME, SAMPLES_COLUMN, load_cleaned_dataset, write_cleaned_dataset,
+)
+
+# Incremental ingestion into the partitioned Parquet store.
+#
+# Devices upload only their latest readings, so a daily run should cost
+# the size of that delta, not of the full history. The store keeps a
+# per-user watermark: the newest minute already written for that user.
+#
+# - Minutes after the watermark are new. They are aggregated and appended
+#   to their (user, day) partitions as new files. Only the watermark day's
+#   stored sleep is read back, when the delta has no sleep log for it.
+# - Minutes at or before the watermark are late. Their partitions are read
+#   back, the late readings are folded into the stored minute means using
+#   the per-minute sample counts, steps/sleep values from the delta replace
+#   the stored ones, and only those partitions are rewritten.
+#
+# Steps/sleep rows whose minute has no heart rate yet are kept as pending
+# rows in the store, so they still land if that heart rate arrives later.
+
+# Kept inside the store, so a full rebuild (which replaces the directory)
+# also resets the watermarks. Dataset discovery skips "_" files.
+STATE_NAME = "_ingest_state.json"
+PENDING_NAMES = {"steps": "_pending_steps.parquet", "sleep": "_pending_sleep.parquet"}
+
+
+# -------------------------------
+# Watermark state
+# -------------------------------
+def _state_path(base_path):
+    return os.path.join(base_path, PARQUET_NAME, STATE_NAME)
+
+
+def load_state(base_path):
+    path = _state_path(base_path)
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        state["watermarks"] = {
+            int(uid): pd.Timestamp(ts) for uid, ts in state["watermarks"].items()
+        }
+        return state
+
+    # First incremental run on a store built by a full run: derive the
+    # watermarks from what is already stored
+    watermarks = {}
+    store = os.path.join(base_path, PARQUET_NAME)
+    if os.path.exists(store):
+        stored = load_cleaned_dataset(store, columns=["Id", "timestamp"])
+        watermarks = stored.groupby("Id")["timestamp"].max().to_dict()
+    return {"batches": 0, "watermarks": watermarks}
+
+
+def save_state(base_path, state):
+    path = _state_path(base_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "batches": state["batches"],
+            "watermarks": {str(uid): ts.isoformat() for uid, ts in state["watermarks"].items()},
+        }, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _pending_path(base_path, metric):
+    return os.path.join(base_path, PARQUET_NAME, PENDING_NAMES[metric])
+
+
+def _with_pending(base_path, metric, delta):
+    path = _pending_path(base_path, metric)
+    if not os.path.exists(path):
+        return delta[["Id", "timestamp", metric]]
+    pending = pd.read_parquet(path)
+    if delta.empty:
+        return pending
+    # Delta rows come last, so they win over pending rows of the same minute
+    return pd.concat([pending, delta[["Id", "timestamp", metric]]], ignore_index=True)
+
+
+def _save_pending(base_path, metric, rows, written, watermarks):
+    # Steps match a minute, sleep logs match any minute of their day
+    unit = "D" if metric == "sleep" else "min"
+    rows = rows.drop_duplicates(["Id", "timestamp"], keep="last")
+    matched = pd.MultiIndex.from_arrays([rows["Id"], rows["timestamp"].dt.floor(unit)]).isin(
+        pd.MultiIndex.from_arrays([written["Id"], written["timestamp"].dt.floor(unit)])
+    )
+    if metric == "sleep":
+        # Minutes of the watermark's day may still arrive; keep its log
+        matched &= rows["timestamp"] < _watermark_of(rows, watermarks).dt.floor("D")
+    path = _pending_path(base_path, metric)
+    if matched.all():
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows[~matched].to_parquet(path, index=False)
+
+
+def _batch_name(state):
+    # Distinct from the part-<n> files of full and streaming runs
+    return f"incr{state['batches']}"
+
+
+def _watermark_of(frame, watermarks):
+    # Watermark per row; users never seen before get the earliest time
+    floor = pd.Timestamp("1970-01-01", tz="UTC")
+    return pd.to_datetime(frame["Id"].map(watermarks), utc=True).fillna(floor)
+
+
+# -------------------------------
+# Late data
+# -------------------------------
+def _fold_late_minutes(stored, late_hr, steps, sleep):
+    """Combine stored rows of the affected partitions with late data."""
+    keys = ["Id", "timestamp"]
+
+    # Weighted mean over stored and late readings of the same minute.
+    # Minutes written without a count (older stores) count as one reading.
+    parts = []
+    for frame in (stored, late_hr):
+        samples = frame[SAMPLES_COLUMN].fillna(1).astype("int64")
+        parts.append(pd.DataFrame({
+            "Id": frame["Id"],
+            "timestamp": frame["timestamp"],
+            "total": frame["heart_rate"].fillna(0) * samples.where(frame["heart_rate"].notna(), 0),
+            SAMPLES_COLUMN: samples.where(frame["heart_rate"].notna(), 0),
+        }))
+    combined = pd.concat(parts, ignore_index=True).groupby(keys, as_index=False).sum()
+    combined["heart_rate"] = combined["total"] / combined[SAMPLES_COLUMN].replace(0, np.nan)
+
+    # Stored steps/sleep, overridden by values in the delta
+    merged = combined.merge(stored[keys + ["steps", "sleep"]], on=keys, how="left")
+    for column, delta, unit in (("steps", steps, "min"), ("sleep", sleep, "D")):
+        latest = delta.groupby(["Id", delta["timestamp"].dt.floor(unit)])[column].last()
+        override = pd.MultiIndex.from_arrays(
+            [merged["Id"], merged["timestamp"].dt.floor(unit)]
+        ).map(latest.to_dict().get)
+        merged[column] = pd.Series(override, index=merged.index, dtype="float64").fillna(merged[column])
+
+    # A late minute new to its day takes the day's stored sleep
+    day = merged["timestamp"].dt.floor("D")
+    merged["sleep"] = merged.groupby(["Id", day])["sleep"].transform("max")
+    merged[["steps", "sleep"]] = merged[["steps", "sleep"]].fillna(0)
+
+    return merged[COLUMNS + [SAMPLES_COLUMN]]
+
+
+def _stored_sleep(store, appended, sleep, watermarks):
+    """Sleep of appended minutes, taking the stored day's when the delta has no log for it.
+
+    New minutes of a user's watermark day join a day already in the store.
+    Its sleep log may have come with an earlier (full) run and is then in
+    neither the delta nor the pending logs.
+    """
+    day = appended["timestamp"].dt.floor("D")
+    logged = pd.MultiIndex.from_arrays([appended["Id"], day]).isin(
+        pd.MultiIndex.from_arrays([sleep["Id"], sleep["timestamp"].dt.floor("D")])
+    )
+    shared = ~logged & (day == _watermark_of(appended, watermarks).dt.floor("D"))
+    if not shared.any() or not os.path.exists(store):
+        return appended["sleep"]
+
+    partitions = appended.loc[shared, ["Id"]].assign(day=day[shared]).drop_duplicates()
+    rows = _load_partitions(store, partitions)
+    day_sleep = rows.groupby(["Id", rows["timestamp"].dt.floor("D")])["sleep"].max()
+    keys = pd.MultiIndex.from_arrays([appended.loc[shared, "Id"], day[shared]])
+    sleep_values = appended["sleep"].astype("float64")
+    sleep_values[shared] = day_sleep.reindex(keys).fillna(0).to_numpy()
+    return sleep_values
+
+
+def _affected_partitions(frames):
+    keys = pd.concat(
+        [f[["Id"]].assign(day=f["timestamp"].dt.floor("D")) for f in frames if not f.empty],
+        ignore_index=True,
+    )
+    return keys.drop_duplicates()
+
+
+def _load_partitions(store, partitions):
+    loaded = []
+    for uid, days in partitions.groupby("Id")["day"]:
+        rows = load_cleaned_dataset(
+            store, columns=COLUMNS + [SAMPLES_COLUMN], user_ids=[uid],
+            start=days.min(), end=days.max() + pd.Timedelta(days=1),
+        )
+        loaded.append(rows[rows["timestamp"].dt.floor("D").isin(days)])
+    return pd.concat(loaded, ignore_index=True)
+
+
+# -------------------------------
+# Ingestion
+# -------------------------------
+def ingest_frames(base_path, hr, steps, sleep, state=None):
+    """Ingest cleaned delta frames (see preprocess.clean_*) into the store.
+
+    Returns a summary dict with the rows appended and upserted.
+    """
+    store = os.path.join(base_path, PARQUET_NAME)
+    own_state = state is None
+    if own_state:
+        state = load_state(base_path)
+    watermarks = state["watermarks"]
+    steps = _with_pending(base_path, "steps", steps)
+    sleep = _with_pending(base_path, "sleep", sleep)
+
+    hr_1min = resample_heart_rate(hr, samples=True)
+    on_time = hr_1min["timestamp"] > _watermark_of(hr_1min, watermarks)
+    late_hr = hr_1min[~on_time]
+
+    # Late steps/sleep update stored minutes even without new heart rate
+    late_steps = steps[steps["timestamp"] <= _watermark_of(steps, watermarks)]
+    late_sleep = sleep[sleep["timestamp"] <= _watermark_of(sleep, watermarks)]
+
+    upserted = 0
+    written = [hr_1min[["Id", "timestamp"]]]
+    if not (late_hr.empty and late_steps.empty and late_sleep.empty) and os.path.exists(store):
+        partitions = _affected_partitions([late_hr, late_steps, late_sleep])
+        stored = _load_partitions(store, partitions)
+        rewritten = _fold_late_minutes(stored, late_hr, late_steps, late_sleep)
+        written.append(rewritten[["Id", "timestamp"]])
+        if not rewritten.empty:
+            write_cleaned_dataset(rewritten, store, batch_no=_batch_name(state), replace_partitions=True)
+            state["batches"] += 1
+        upserted = len(late_hr)
+
+    appended = merge_metrics(hr_1min[on_time], steps, sleep)
+    if not appended.empty:
+        appended["sleep"] = _stored_sleep(store, appended, sleep, watermarks)
+        write_cleaned_dataset(appended, store, batch_no=_batch_name(state))
+        state["batches"] += 1
+
+        newest = appended.groupby("Id")["timestamp"].max()
+        for uid, ts in newest.items():
+            watermarks[uid] = max(ts, watermarks.get(uid, ts))
+
+    written = pd.concat(written, ignore_index=True)
+    if not written.empty:
+        update_rollups(base_path, _affected_partitions([written]))
+    _save_pending(base_path, "steps", steps, written, watermarks)
+    _save_pending(base_path, "sleep", sleep, written, watermarks)
+
+    if own_state:
+        save_state(base_path, state)
+    return {"appended": len(appended), "late_minutes": upserted}
+
+
+def preprocess_incremental(base_path, batch_path):
+    """Ingest the raw CSVs uploaded since the last run (in ``batch_path``)."""
+    print("Starting incremental preprocessing...")
+
+    def read(name, clean):
+        path = os.path.join(batch_path, name)
+        return clean(pd.read_csv(path)) if os.path.exists(path) else clean(_empty(name))
+
+    hr = read("heartrate.csv", clean_heart_rate)
+    steps = read("steps.csv", clean_steps)
+    sleep = read("sleep.csv", clean_sleep)
+
+    with span("preprocess.incremental", rows=len(hr) + len(steps) + len(sleep)):
+        summary = ingest_frames(base_path, hr, steps, sleep)
+
+    print(f"Appended {summary['appended']:,} new minutes, "
+          f"folded {summary['late_minutes']:,} late minutes into stored partitions")
+    print(f"Cleaned dataset updated: {PARQUET_NAME}")
+
+
+def _empty(name):
+    columns = {
+        "heartrate.csv": ["Id", "Time", "Value"],
+        "steps.csv": ["Id", "ActivityMinute", "Steps"],
+        "sleep.csv": ["Id", "SleepDay", "TotalMinutesAsleep"],
+    }[name]
+    return pd.DataFrame({col: pd.Series(dtype="int64" if col == "Id" else "object") for col in columns})
@@ -0,0 +1,229 @@
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import pandas as pd
+
+# Stage timings for the pipeline scripts.
+#
+# Code marks its stages with ``with span("preprocess.resample") as s:`` and
+# may record how many rows the stage handled (``s.rows = len(df)``). With
+# tracing off, span() hands back one shared do-nothing object, so marked
+# stages cost a function call. With tracing on, each finished span is
+# appended to a JSON lines trace file: its name and parent, wall time,
+# rows, and resident memory before/after plus the process peak. Worker
+# processes inherit tracing through the environment and append to the
+# same file, and the process that turned tracing on prints a per-stage
+# summary table when it exits.
+#
+# Tracing is turned on with enable(), the --trace option of the scripts,
+# or FITPULSE_TRACE=<trace file>. FITPULSE_PROFILE=<folder> additionally
+# runs each top-level span under cProfile and writes <stage>.<pid>.prof
+# there (snakeviz / pstats). For sampling profilers such as py-spy, span
+# records carry the pid and epoch start time, so a recording of the same
+# run can be lined up with the stages.
+
+TRACE_ENV = "FITPULSE_TRACE"
+PROFILE_ENV = "FITPULSE_PROFILE"
+
+_MB = 1024 * 1024
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_tracer = None
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return None
+
+
+def _peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _mb(value):
+    return None if value is None else round(value / _MB, 1)
+
+
+class _NullSpan:
+    """Stands in for a span while tracing is off."""
+
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, rows, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.rows = rows
+        self.attrs = attrs
+        self._profile = None
+
+    def __enter__(self):
+        tracer = self.tracer
+        self.parent = tracer.stack[-1].name if tracer.stack else None
+        if tracer.profile_dir and not tracer.stack:
+            import cProfile
+            self._profile = cProfile.Profile()
+        tracer.stack.append(self)
+        self.rss_before = _rss_bytes()
+        self.started = time.time()
+        self._start = time.perf_counter()
+        if self._profile is not None:
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(os.path.join(
+                self.tracer.profile_dir, f"{self.name}.{os.getpid()}.prof"
+            ))
+        self.tracer.stack.pop()
+        rss_after = _rss_bytes()
+        record = {
+            "name": self.name,
+            "parent": self.parent,
+            "pid": os.getpid(),
+            "start": round(self.started, 6),
+            "seconds": round(seconds, 6),
+            "rows": None if self.rows is None else int(self.rows),
+            "rss_mb": _mb(rss_after),
+            "rss_delta_mb": _mb(rss_after - self.rss_before)
+            if rss_after is not None and self.rss_before is not None else None,
+            "peak_rss_mb": _mb(_peak_rss_bytes()),
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(self.attrs)
+        self.tracer.write(record)
+        return False
+
+
+class Tracer:
+    def __init__(self, path, profile_dir=None):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.stack = []
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def write(self, record):
+        # One short append per span; lines from several processes interleave
+        # whole because the file is opened in append mode
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def span(name, rows=None, **attrs):
+    """Context manager timing one stage; a shared no-op while tracing is off."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, rows, attrs)
+
+
+def enabled():
+    return _tracer is not None
+
+
+def enable(path, profile_dir=None, summary=True):
+    """Trace spans to ``path`` (started afresh) here and in processes started from here.
+
+    With ``summary`` the per-stage table is printed to stderr at exit.
+    """
+    global _tracer
+    path = os.path.abspath(path)
+    open(path, "w").close()
+    os.environ[TRACE_ENV] = path
+    if profile_dir:
+        profile_dir = os.path.abspath(profile_dir)
+        os.environ[PROFILE_ENV] = profile_dir
+    _tracer = Tracer(path, profile_dir)
+    if summary:
+        atexit.register(_print_summary, path, os.getpid())
+
+
+def _print_summary(path, pid):
+    # Worker processes inherit the registration when forked
+    if os.getpid() != pid:
+        return
+    table = summary(path)
+    if not table.empty:
+        print(f"\nStage summary ({path})", file=sys.stderr)
+        print(table.to_string(index=False), file=sys.stderr)
+
+
+# -------------------------------
+# Reading traces
+# -------------------------------
+def load_trace(path):
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summary(path):
+    """Per-stage calls, total/mean/max seconds, rows, rows/s and memory."""
+    trace = load_trace(path) if os.path.exists(path) else pd.DataFrame()
+    if trace.empty:
+        return trace
+    table = trace.groupby("name", sort=False).agg(
+        calls=("seconds", "size"),
+        total_s=("seconds", "sum"),
+        mean_s=("seconds", "mean"),
+        max_s=("seconds", "max"),
+        rows=("rows", lambda rows: rows.sum(min_count=1)),
+        rss_delta_mb=("rss_delta_mb", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        processes=("pid", "nunique"),
+    ).reset_index()
+    table["rows"] = table["rows"].astype("Int64")
+    table["rows_per_s"] = (table["rows"] / table["total_s"]).where(table["rows"] > 0).round(1)
+    # Share of the outermost spans' time (the wall time of a sequential
+    # run); stages run in parallel workers can add up to more than 100%
+    wall = trace.loc[trace["parent"].isna(), "seconds"].sum()
+    table["share"] = (table["total_s"] / wall * 100).round(1).astype(str) + "%" if wall else None
+    for column in ("total_s", "mean_s", "max_s"):
+        table[column] = table[column].round(3)
+    return table.sort_values("total_s", ascending=False, ignore_index=True)
+
+
+# Processes started with FITPULSE_TRACE set append to the trace file; pool
+# workers leave the summary to their parent
+if os.environ.get(TRACE_ENV):
+    _tracer = Tracer(os.environ[TRACE_ENV], os.environ.get(PROFILE_ENV))
+    if multiprocessing.parent_process() is None:
+        atexit.register(_print_summary, os.environ[TRACE_ENV], os.getpid())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a FitPulse trace file")
+    parser.add_argument("trace", help="JSON lines trace written with --trace or FITPULSE_TRACE")
+    args = parser.parse_args()
+    print(summary(args.trace).to_string(index=False))
@@ -1,94 +1,460 @@
+import argparse
+import os
+import shutil
+
+import numpy as np
 import pandas as pd
 
+from instrumentation import enable as enable_tracing, span
+from rollups import build_rollups
+from storage import CSV_NAME, PARQUET_NAME, SAMPLES_COLUMN, write_cleaned_dataset
+
 # Base path where CSV files are stored
 BASE_PATH = "FitPulse Health Anomaly Detection from Fitness Devices/Milestone1/data"
 
-def preprocess_data():
-    print("Starting preprocessing...")
+# Streaming mode sizes its chunks from a memory budget. One raw CSV row
+# costs roughly this many bytes once parsed (strings, datetime conversion
+# and groupby scratch space included).
+RAW_ROW_BYTES = 512
+DEFAULT_MEMORY_BUDGET_MB = 512
+
+OUTPUT_COLUMNS = ["Id", "timestamp", "heart_rate", "steps", "sleep"]
+
+
+# Timestamp format of the Fitbit exports, e.g. "4/12/2016 7:21:00 AM"
+FITBIT_TIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
 
-    # -------------------------------
-    # 1. Read CSV files
-    # -------------------------------
-    hr = pd.read_csv(f"{BASE_PATH}/heartrate.csv")
-    steps = pd.read_csv(f"{BASE_PATH}/steps.csv")
-    sleep = pd.read_csv(f"{BASE_PATH}/sleep.csv")
-
-    # -------------------------------
-    # 2. Convert timestamps to UTC
-    # -------------------------------
-    hr["Time"] = pd.to_datetime(hr["Time"], utc=True)
-    steps["ActivityMinute"] = pd.to_datetime(steps["ActivityMinute"], utc=True)
-    sleep["SleepDay"] = pd.to_datetime(sleep["SleepDay"], utc=True)
-
-    # -------------------------------
-    # 3. Rename columns for clarity
-    # -------------------------------
+
+# -------------------------------
+# Cleaning helpers (shared by both modes)
+# -------------------------------
+def parse_times(values):
+    # pandas cannot infer the format from a first value like
+    # "4/12/2016 12:00:00 AM" and then parses every row with dateutil
+    try:
+        return pd.to_datetime(values, format=FITBIT_TIME_FORMAT, utc=True)
+    except ValueError:
+        return pd.to_datetime(values, utc=True)
+
+
+def clean_heart_rate(hr):
+    hr = hr.copy()
+    hr["Time"] = parse_times(hr["Time"])
     hr = hr.rename(columns={
         "Time": "timestamp",
         "Value": "heart_rate"
     })
 
+    # Drop rows where timestamp is missing in heart rate
+    return hr.dropna(subset=["timestamp"])
+
+
+def clean_steps(steps):
+    steps = steps.copy()
+    steps["ActivityMinute"] = parse_times(steps["ActivityMinute"])
     steps = steps.rename(columns={
         "ActivityMinute": "timestamp",
         "Steps": "steps"
     })
+    steps["steps"] = steps["steps"].fillna(0)
+    return steps
+
 
+def clean_sleep(sleep):
+    sleep = sleep.copy()
+    sleep["SleepDay"] = parse_times(sleep["SleepDay"])
     sleep = sleep.rename(columns={
         "SleepDay": "timestamp",
         "TotalMinutesAsleep": "sleep"
     })
-
-    # -------------------------------
-    # 4. Handle missing values
-    # -------------------------------
-    steps["steps"] = steps["steps"].fillna(0)
     sleep["sleep"] = sleep["sleep"].fillna(0)
+    return sleep
+
+
+def resample_heart_rate(hr, samples=False):
+    grouped = hr.groupby(["Id", pd.Grouper(key="timestamp", freq="1min")])["heart_rate"]
+    if not samples:
+        return grouped.mean().reset_index()
+
+    # The Parquet store also keeps how many readings each minute averages,
+    # so readings arriving later can be folded into a stored minute
+    return grouped.agg(**{"heart_rate": "mean", SAMPLES_COLUMN: "count"}).reset_index()
+
+
+def _ticks(timestamps, unit):
+    # Whole minutes ("m") or days ("D") since the epoch, as int64
+    return timestamps.values.astype(f"datetime64[{unit}]").view("int64")
 
-    # Drop rows where timestamp is missing in heart rate
-    hr = hr.dropna(subset=["timestamp"])
-
-    # -------------------------------
-    # 5. Resample heart rate to 1-minute interval
-    # -------------------------------
-    hr_1min = (
-        hr
-        .groupby(["Id", pd.Grouper(key="timestamp", freq="1min")])["heart_rate"]
-        .mean()
-        .reset_index()
-    )
-
-    # -------------------------------
-    # 6. Merge datasets
-    # -------------------------------
-    final_df = hr_1min.merge(
-        steps[["Id", "timestamp", "steps"]],
-        on=["Id", "timestamp"],
-        how="left"
-    )
-
-    final_df = final_df.merge(
-        sleep[["Id", "timestamp", "sleep"]],
-        on=["Id", "timestamp"],
-        how="left"
-    )
-
-    # -------------------------------
-    # 7. Fill remaining missing values
-    # -------------------------------
-    final_df["steps"] = final_df["steps"].fillna(0)
-    final_df["sleep"] = final_df["sleep"].fillna(0)
-
-    # Sort data properly
-    final_df = final_df.sort_values(["Id", "timestamp"])
-
-    # -------------------------------
-    # 8. Save cleaned dataset
-    # -------------------------------
-    final_df.to_csv(f"{BASE_PATH}/cleaned_dataset.csv", index=False)
+
+def user_codes(ids):
+    """Sorted distinct user ids and each row's position among them."""
+    ids = np.asarray(ids)
+    if len(ids) and (ids[1:] >= ids[:-1]).all():
+        # Id-sorted rows: one pass instead of a sort
+        starts = np.r_[True, ids[1:] != ids[:-1]]
+        return ids[starts], np.cumsum(starts) - 1
+    return np.unique(ids, return_inverse=True)
+
+
+def align_sorted(left, right, column, unit, codes=None):
+    """Look up ``right[column]`` for every (Id, time) row of ``left``.
+
+    Times are compared at ``unit`` resolution. Both sides become one int64
+    key (user code, tick) and the left keys are binary-searched in the
+    right keys: no hash table and no merged copy of ``left``. ``right``
+    normally comes sorted by (Id, timestamp) and is only sorted here when
+    it is not. Values go into a preallocated array, unmatched rows get 0,
+    and if a key repeats on the right the last row wins. ``codes`` is
+    user_codes(left["Id"]), to share it between several lookups.
+    """
+    values = right[column].to_numpy()
+    if len(left) == 0:
+        return np.zeros(0, dtype=values.dtype)
+    if len(right) == 0:
+        return np.zeros(len(left), dtype="float64")
+
+    users, left_codes = codes if codes is not None else user_codes(left["Id"])
+    left_ticks = _ticks(left["timestamp"], unit)
+    right_ticks = _ticks(right["timestamp"], unit)
+    origin = min(left_ticks.min(), right_ticks.min())
+    width = max(left_ticks.max(), right_ticks.max()) - origin + 1
+
+    right_ids = right["Id"].to_numpy()
+    right_codes = np.searchsorted(users, right_ids).clip(max=len(users) - 1)
+    known = users[right_codes] == right_ids
+    if not known.all():
+        right_codes, right_ticks, values = right_codes[known], right_ticks[known], values[known]
+    right_keys = right_codes * width + (right_ticks - origin)
+    if len(right_keys) > 1 and not (right_keys[1:] >= right_keys[:-1]).all():
+        order = np.argsort(right_keys, kind="stable")
+        right_keys, values = right_keys[order], values[order]
+    if len(right_keys) == 0:
+        return np.zeros(len(left), dtype="float64")
+
+    # Keys built in place of the tick array, one (rows,) temporary fewer
+    left_keys = left_ticks
+    left_keys -= origin
+    left_keys += left_codes * width
+    pos = np.searchsorted(right_keys, left_keys, side="right")
+    pos -= 1
+    np.maximum(pos, 0, out=pos)
+    hit = right_keys[pos] == left_keys
+    del left_keys
+
+    out = np.zeros(len(left), dtype="float64")
+    np.copyto(out, values[pos], where=hit)
+
+    # Like a left join: integer columns stay integers if nothing was missing
+    if hit.all():
+        return out.astype(values.dtype)
+    return out
+
+
+def merge_metrics(hr_1min, steps, sleep):
+    # hr_1min comes out of the groupby sorted by (Id, timestamp), so the
+    # result is too. Steps are per minute. Sleep logs are per day, so every
+    # minute of a day gets that day's minutes asleep.
+    codes = user_codes(hr_1min["Id"])
+    return pd.DataFrame({
+        **{col: hr_1min[col] for col in hr_1min.columns},
+        "steps": align_sorted(hr_1min, steps, "steps", "m", codes),
+        "sleep": align_sorted(hr_1min, sleep, "sleep", "D", codes),
+    }, index=hr_1min.index, copy=False)
+
+
+def preprocess_data(base_path=BASE_PATH, streaming=False,
+                    memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, output_format="csv"):
+    if streaming:
+        with span("preprocess", format=output_format, streaming=True):
+            preprocess_data_streaming(base_path, memory_budget_mb, output_format)
+        return
+
+    print("Starting preprocessing...")
+
+    with span("preprocess", format=output_format):
+        # -------------------------------
+        # 1. Read CSV files
+        # -------------------------------
+        with span("preprocess.read_csv") as s:
+            hr = pd.read_csv(f"{base_path}/heartrate.csv")
+            steps = pd.read_csv(f"{base_path}/steps.csv")
+            sleep = pd.read_csv(f"{base_path}/sleep.csv")
+            s.rows = len(hr) + len(steps) + len(sleep)
+
+        # -------------------------------
+        # 2-4. Convert timestamps to UTC, rename columns, handle missing values
+        # -------------------------------
+        with span("preprocess.clean", rows=s.rows):
+            hr = clean_heart_rate(hr)
+            steps = clean_steps(steps)
+            sleep = clean_sleep(sleep)
+
+        # -------------------------------
+        # 5. Resample heart rate to 1-minute interval
+        # -------------------------------
+        with span("preprocess.resample", rows=len(hr)):
+            hr_1min = resample_heart_rate(hr, samples=output_format == "parquet")
+
+        # -------------------------------
+        # 6-7. Merge datasets and fill remaining missing values
+        # -------------------------------
+        # Already sorted by Id and timestamp
+        with span("preprocess.merge", rows=len(hr_1min)):
+            final_df = merge_metrics(hr_1min, steps, sleep)
+
+        # -------------------------------
+        # 8. Save cleaned dataset
+        # -------------------------------
+        with span("preprocess.write", rows=len(final_df)):
+            if output_format == "parquet":
+                write_cleaned_dataset(final_df, f"{base_path}/{PARQUET_NAME}")
+                saved_as = PARQUET_NAME
+            else:
+                final_df.to_csv(f"{base_path}/{CSV_NAME}", index=False)
+                saved_as = CSV_NAME
+
+        # -------------------------------
+        # 9. Daily/hourly rollups for detection and the dashboard
+        # -------------------------------
+        with span("preprocess.rollups", rows=len(final_df)):
+            build_rollups(base_path, df=final_df)
 
     print("Preprocessing completed successfully!")
-    print("Cleaned dataset saved as cleaned_dataset.csv")
+    print(f"Cleaned dataset saved as {saved_as}")
+
+
+# ============================================================
+# STREAMING MODE
+# ============================================================
+# Raw exports are read in bounded chunks. Fitbit writes them ordered by
+# Id and time, so every 1-minute bucket except the last one of a chunk is
+# complete and can be written out straight away. The raw rows of that last
+# bucket are carried into the next chunk, so each bucket is still averaged
+# in a single groupby and the output matches the in-memory mode exactly.
+
+def chunk_rows_for_budget(memory_budget_mb):
+    # Heart rate and steps readers get half of the budget each
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    return max(1, int(budget_bytes / 2 / RAW_ROW_BYTES))
+
+
+def _keys_through(df, key):
+    uid, ts = key
+    return (df["Id"] < uid) | ((df["Id"] == uid) & (df["timestamp"] <= ts))
+
+
+def _first_key(df):
+    return df["Id"].iloc[0], df["timestamp"].iloc[0]
+
+
+def _last_key(df):
+    return df["Id"].iloc[-1], df["timestamp"].iloc[-1]
+
+
+def _is_key_sorted(df):
+    return df.set_index(["Id", "timestamp"]).index.is_monotonic_increasing
+
+
+class OrderedStepsReader:
+    """Hands out steps rows in (Id, timestamp) order, one chunk at a time."""
+
+    def __init__(self, path, chunk_rows):
+        self._chunks = pd.read_csv(path, chunksize=chunk_rows)
+        self._buffer = None
+        self._taken_through = None
+        self._exhausted = False
+
+    def _load_next(self):
+        try:
+            chunk = clean_steps(next(self._chunks))
+        except StopIteration:
+            self._exhausted = True
+            return
+        if chunk.empty:
+            return
+        if not _is_key_sorted(chunk) or (
+            self._buffer is not None and not self._buffer.empty
+            and _first_key(chunk) < _last_key(self._buffer)
+        ) or (
+            self._taken_through is not None
+            and _first_key(chunk) <= self._taken_through
+        ):
+            raise ValueError(
+                "steps.csv is not ordered by Id and ActivityMinute; "
+                "run preprocess_data() without streaming instead"
+            )
+        if self._buffer is None or self._buffer.empty:
+            self._buffer = chunk
+        else:
+            self._buffer = pd.concat([self._buffer, chunk], ignore_index=True)
+
+    def take_through(self, key):
+        """Return (and drop from the buffer) every row with key <= ``key``."""
+        while not self._exhausted and (
+            self._buffer is None or self._buffer.empty
+            or _last_key(self._buffer) <= key
+        ):
+            self._load_next()
+
+        self._taken_through = key
+        if self._buffer is None:
+            return pd.DataFrame({
+                "Id": pd.Series(dtype="int64"),
+                "timestamp": pd.Series(dtype="datetime64[ns, UTC]"),
+                "steps": pd.Series(dtype="float64"),
+            })
+
+        mask = _keys_through(self._buffer, key)
+        taken = self._buffer[mask]
+        self._buffer = self._buffer[~mask]
+        return taken
+
+
+class CleanedDatasetWriter:
+    """Appends batches to cleaned_dataset.csv with the in-memory mode's dtypes.
+
+    A full merge leaves steps/sleep as integers only when every minute found
+    a match; a single miss turns the whole column into floats. Batches are
+    written as integers until the first miss, at which point the rows
+    already on disk are rewritten once with that column as float.
+    """
+
+    def __init__(self, path, chunk_rows):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self._float_columns = {"heart_rate"}
+
+    def write(self, batch):
+        batch = batch[OUTPUT_COLUMNS]
+        new_floats = {
+            col for col in ("steps", "sleep")
+            if batch[col].dtype.kind == "f" and col not in self._float_columns
+        }
+        if new_floats and self.rows:
+            self._refloat(new_floats)
+        self._float_columns |= new_floats
+
+        batch = batch.astype({col: "float64" for col in self._float_columns})
+        first = self.rows == 0
+        batch.to_csv(self.path, index=False, mode="w" if first else "a", header=first)
+        self.rows += len(batch)
+
+    def close(self):
+        if self.rows == 0:
+            pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(self.path, index=False)
+
+    def _refloat(self, columns):
+        tmp_path = f"{self.path}.tmp"
+        chunks = pd.read_csv(self.path, dtype=str, chunksize=self.chunk_rows)
+        for i, chunk in enumerate(chunks):
+            chunk = chunk.astype({col: "float64" for col in columns})
+            chunk.to_csv(tmp_path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+        os.replace(tmp_path, self.path)
+
+
+class ParquetDatasetWriter:
+    """Appends batches to the partitioned cleaned_dataset.parquet."""
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self._batches = 0
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    def write(self, batch):
+        write_cleaned_dataset(batch, self.path, batch_no=self._batches)
+        self._batches += 1
+        self.rows += len(batch)
+
+    def close(self):
+        pass
+
+
+def preprocess_data_streaming(base_path=BASE_PATH,
+                              memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, output_format="csv"):
+    print("Starting streaming preprocessing...")
+
+    chunk_rows = chunk_rows_for_budget(memory_budget_mb)
+    samples = output_format == "parquet"
+
+    # Sleep logs are daily (one row per user per day), small enough to keep
+    sleep = clean_sleep(pd.read_csv(f"{base_path}/sleep.csv"))
+    steps = OrderedStepsReader(f"{base_path}/steps.csv", chunk_rows)
+
+    if output_format == "parquet":
+        writer = ParquetDatasetWriter(f"{base_path}/{PARQUET_NAME}")
+    else:
+        writer = CleanedDatasetWriter(f"{base_path}/{CSV_NAME}", chunk_rows)
+    carry = None
+    last_written = None
+
+    def flush(hr_1min):
+        nonlocal last_written
+        if hr_1min.empty:
+            return
+        last_written = _last_key(hr_1min)
+        with span("preprocess.merge", rows=len(hr_1min)):
+            batch = merge_metrics(hr_1min, steps.take_through(last_written), sleep)
+        with span("preprocess.write", rows=len(batch)):
+            writer.write(batch)
+
+    for chunk in pd.read_csv(f"{base_path}/heartrate.csv", chunksize=chunk_rows):
+        with span("preprocess.clean", rows=len(chunk)):
+            hr = clean_heart_rate(chunk)
+        if carry is not None:
+            hr = pd.concat([carry, hr], ignore_index=True)
+        if hr.empty:
+            continue
+
+        with span("preprocess.resample", rows=len(hr)):
+            hr_1min = resample_heart_rate(hr, samples)
+        if last_written is not None and _first_key(hr_1min) <= last_written:
+            raise ValueError(
+                "heartrate.csv is not ordered by Id and Time; "
+                "run preprocess_data() without streaming instead"
+            )
+
+        # Hold back the newest bucket, it may continue in the next chunk
+        open_id, open_minute = _last_key(hr_1min)
+        in_open = (hr["Id"] == open_id) & (hr["timestamp"].dt.floor("1min") == open_minute)
+        carry = hr[in_open]
+        flush(hr_1min.iloc[:-1])
+
+    if carry is not None and not carry.empty:
+        flush(resample_heart_rate(carry, samples))
+    writer.close()
+    with span("preprocess.rollups", rows=writer.rows):
+        build_rollups(base_path)
+
+    print(f"Streaming preprocessing completed: {writer.rows:,} rows "
+          f"(chunks of {chunk_rows:,} raw rows)")
+    print(f"Cleaned dataset saved as {os.path.basename(writer.path)}")
+
 
 # Run preprocessing
 if __name__ == "__main__":
-    preprocess_data()
+    parser = argparse.ArgumentParser(description="Clean and align Fitbit exports")
+    parser.add_argument("--base-path", default=BASE_PATH)
+    parser.add_argument("--streaming", action="store_true",
+                        help="read raw files in bounded chunks")
+    parser.add_argument("--memory-budget-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help="peak memory budget for streaming mode")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="write cleaned_dataset.csv or the partitioned cleaned_dataset.parquet")
+    parser.add_argument("--incremental", metavar="BATCH_DIR", default=None,
+                        help="ingest only the raw CSVs in BATCH_DIR into the existing Parquet store")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="write per-stage timings to FILE (JSON lines) and print a summary")
+    args = parser.parse_args()
+
+    if args.trace:
+        enable_tracing(args.trace)
+
+    if args.incremental:
+        from incremental import preprocess_incremental
+        preprocess_incremental(args.base_path, args.incremental)
+    else:
+        preprocess_data(args.base_path, args.streaming, args.memory_budget_mb, args.format)
@@ -0,0 +1,216 @@
+import argparse
+import os
+import shutil
+
+import pandas as pd
+
+from storage import (
+    CSV_NAME, METRIC_COLUMNS, PARQUET_NAME, _arrow, _utc, find_cleaned_dataset,
+    from_epoch_minutes, is_parquet, list_users, load_cleaned_dataset,
+)
+
+# Materialized daily and hourly rollups of the cleaned dataset.
+#
+# Detection and the dashboard work on daily means, and recomputing them
+# from minute rows reads millions of rows per chart. The rollups hold, per
+# user and day (or hour), the mean/min/max/count of every metric, so those
+# readers touch one row per day instead. They are Parquet datasets
+# partitioned by user (rollup_daily.parquet/Id=<id>/...) next to the
+# cleaned dataset, built after preprocessing and updated for just the
+# (user, day) partitions an incremental run touched.
+
+ROLLUP_NAMES = {"D": "rollup_daily.parquet", "h": "rollup_hourly.parquet"}
+STATS = ["mean", "min", "max", "count"]
+BUCKET_MINUTES = {"D": 24 * 60, "h": 60}
+
+# Users read per batch when building from a partitioned store
+BUILD_USERS = 200
+CSV_CHUNK_ROWS = 1_000_000
+
+
+def rollup_path(base_path, freq="D"):
+    return os.path.join(base_path, ROLLUP_NAMES[freq])
+
+
+def has_rollups(base_path, freq="D"):
+    return os.path.isdir(rollup_path(base_path, freq))
+
+
+def _schema(metrics=METRIC_COLUMNS):
+    pa, _ = _arrow()
+    fields = [("ds", pa.timestamp("us", tz="UTC"))]
+    for metric in metrics:
+        fields += [(f"{metric}_mean", pa.float64()), (f"{metric}_min", pa.float64()),
+                   (f"{metric}_max", pa.float64()), (f"{metric}_count", pa.int64())]
+    return pa.schema(fields + [("Id", pa.int64())])
+
+
+def _partitioning():
+    pa, ds = _arrow()
+    return ds.partitioning(pa.schema([("Id", pa.int64())]), flavor="hive")
+
+
+# -------------------------------
+# Aggregation
+# -------------------------------
+def partial_rollup(df, freq, metrics=METRIC_COLUMNS):
+    """Sum/min/max/count per (Id, bucket); partials of one bucket can be merged.
+
+    ``df`` has a ``timestamp`` column, or a ``minute`` column of epoch
+    minutes like storage.load_compact() frames (buckets are then naive UTC).
+    """
+    if "minute" in df:
+        # Integer buckets; only the distinct ones become datetimes below
+        bucket = (df["minute"] // BUCKET_MINUTES[freq]).rename("ds")
+    else:
+        bucket = df["timestamp"].dt.floor(freq).rename("ds")
+    grouped = df.groupby([df["Id"], bucket], observed=True)[list(metrics)]
+    parts = grouped.agg(["sum", "min", "max", "count"])
+    parts.columns = [f"{metric}_{stat}" for metric, stat in parts.columns]
+    if "minute" in df:
+        starts = from_epoch_minutes(parts.index.levels[1] * BUCKET_MINUTES[freq])
+        parts.index = parts.index.set_levels(starts, level="ds")
+    return parts
+
+
+def merge_partials(partials, metrics=METRIC_COLUMNS):
+    combined = pd.concat(partials)
+    if not combined.index.has_duplicates:
+        return combined
+    how = {}
+    for metric in metrics:
+        how.update({f"{metric}_sum": "sum", f"{metric}_min": "min",
+                    f"{metric}_max": "max", f"{metric}_count": "sum"})
+    return combined.groupby(level=["Id", "ds"], observed=True).agg(how)
+
+
+def finalize(parts, metrics=METRIC_COLUMNS):
+    rollup = pd.DataFrame(index=parts.index)
+    for metric in metrics:
+        count = parts[f"{metric}_count"]
+        rollup[f"{metric}_mean"] = parts[f"{metric}_sum"] / count.where(count > 0)
+        rollup[f"{metric}_min"] = parts[f"{metric}_min"]
+        rollup[f"{metric}_max"] = parts[f"{metric}_max"]
+        rollup[f"{metric}_count"] = count.astype("int64")
+    return rollup.reset_index().sort_values(["Id", "ds"], ignore_index=True)
+
+
+def compute_rollup(df, freq="D", metrics=METRIC_COLUMNS):
+    return finalize(partial_rollup(df, freq, metrics), metrics)
+
+
+# -------------------------------
+# Storage
+# -------------------------------
+def _write(rollup, path, replace_users=False):
+    # One file per user partition (Id=<id>/part-0.parquet), written with
+    # pq.write_table on this thread. ds.write_dataset would start Arrow's
+    # IO thread pool, whose idle threads are torn down racily at
+    # interpreter exit: a CSV-only preprocess run then aborted after
+    # finishing ("terminate called without an active exception").
+    import pyarrow.parquet as pq
+
+    pa, _ = _arrow()
+    schema = _schema()
+    file_schema = schema.remove(schema.get_field_index("Id"))
+    os.makedirs(path, exist_ok=True)
+    for uid, rows in rollup.groupby("Id", sort=False, observed=True):
+        folder = os.path.join(path, f"Id={uid}")
+        if replace_users and os.path.isdir(folder):
+            shutil.rmtree(folder)
+        os.makedirs(folder, exist_ok=True)
+        table = pa.Table.from_pandas(rows[file_schema.names], schema=file_schema,
+                                     preserve_index=False)
+        pq.write_table(table, os.path.join(folder, "part-0.parquet"))
+
+
+def _source_chunks(source, metrics):
+    # The cleaned dataset in pieces small enough to hold in memory
+    columns = ["Id", "timestamp"] + list(metrics)
+    if is_parquet(source) and os.path.isdir(source):
+        user_ids = list_users(source)
+        for i in range(0, len(user_ids), BUILD_USERS):
+            yield load_cleaned_dataset(source, columns, user_ids=user_ids[i:i + BUILD_USERS])
+    elif is_parquet(source):
+        yield load_cleaned_dataset(source, columns)
+    else:
+        for chunk in pd.read_csv(source, usecols=columns, chunksize=CSV_CHUNK_ROWS):
+            chunk["timestamp"] = pd.to_datetime(chunk["timestamp"], utc=True)
+            yield chunk
+
+
+def build_rollups(base_path, freqs=tuple(ROLLUP_NAMES), df=None):
+    """Rebuild the rollups from the cleaned dataset in ``base_path`` (or ``df``)."""
+    source = find_cleaned_dataset(base_path)
+    for freq in freqs:
+        chunks = [df] if df is not None else _source_chunks(source, METRIC_COLUMNS)
+        parts = merge_partials([partial_rollup(chunk, freq) for chunk in chunks])
+        path = rollup_path(base_path, freq)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        _write(finalize(parts), path)
+
+
+def update_rollups(base_path, partitions):
+    """Recompute the rollup rows of the (Id, day) ``partitions`` a run touched."""
+    if partitions.empty:
+        return
+    store = os.path.join(base_path, PARQUET_NAME)
+    for freq in ROLLUP_NAMES:
+        if not has_rollups(base_path, freq):
+            continue
+        path = rollup_path(base_path, freq)
+        updated = []
+        for uid, days in partitions.groupby("Id")["day"]:
+            rows = load_cleaned_dataset(
+                store, ["Id", "timestamp"] + METRIC_COLUMNS, user_ids=[uid],
+                start=days.min(), end=days.max() + pd.Timedelta(days=1),
+            )
+            rows = rows[rows["timestamp"].dt.floor("D").isin(days)]
+            stored = load_rollup(base_path, freq, user_ids=[uid])
+            kept = stored[~stored["ds"].dt.floor("D").isin(days)]
+            updated.append(pd.concat([kept, compute_rollup(rows, freq)], ignore_index=True))
+        rollup = pd.concat(updated, ignore_index=True).sort_values(["Id", "ds"], ignore_index=True)
+        _write(rollup, path, replace_users=True)
+
+
+def load_rollup(base_path, freq="D", user_ids=None, start=None, end=None, metrics=None):
+    """Rollup rows (Id, ds, <metric>_<stat>...), ordered by Id and ds.
+
+    ``start`` is inclusive and ``end`` exclusive, on the bucket start.
+    """
+    pa, ds = _arrow()
+    dataset = ds.dataset(rollup_path(base_path, freq), format="parquet",
+                         schema=_schema(), partitioning=_partitioning())
+    expr = None
+    if user_ids is not None:
+        expr = ds.field("Id").isin([int(u) for u in user_ids])
+    for op, value in (("ge", start), ("lt", end)):
+        if value is None:
+            continue
+        scalar = pa.scalar(_utc(value).to_pydatetime(), pa.timestamp("us", tz="UTC"))
+        cond = ds.field("ds") >= scalar if op == "ge" else ds.field("ds") < scalar
+        expr = cond if expr is None else expr & cond
+    columns = None
+    if metrics is not None:
+        columns = ["Id", "ds"] + [f"{m}_{stat}" for m in metrics for stat in STATS]
+    rollup = dataset.to_table(columns=columns, filter=expr).to_pandas()
+    return rollup.sort_values(["Id", "ds"], kind="stable", ignore_index=True)
+
+
+def rollup_means(rollup, metrics=METRIC_COLUMNS):
+    """Rollup rows as (Id, ds, <metric>...) means, like detection.daily_table()."""
+    means = rollup[["Id", "ds"] + [f"{m}_mean" for m in metrics]]
+    return means.rename(columns={f"{m}_mean": m for m in metrics})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build daily/hourly rollups of the cleaned dataset")
+    parser.add_argument("--base-path", required=True,
+                        help=f"folder holding {PARQUET_NAME} or {CSV_NAME}")
+    parser.add_argument("--freq", nargs="+", choices=list(ROLLUP_NAMES), default=list(ROLLUP_NAMES))
+    args = parser.parse_args()
+
+    build_rollups(args.base_path, args.freq)
+    for freq in args.freq:
+        print(f"Rollup written: {rollup_path(args.base_path, freq)}")
@@ -0,0 +1,345 @@
+import ctypes
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Cleaned dataset storage.
+#
+# The pipeline passes the cleaned dataset between milestones either as the
+# original cleaned_dataset.csv or as a Parquet dataset partitioned by user
+# and day (cleaned_dataset.parquet/Id=<id>/day=<YYYY-MM-DD>/*.parquet).
+# Parquet keeps typed Id/timestamp columns, so readers skip the text
+# timestamp parsing, and user/date filters only open the matching
+# partitions.
+
+CSV_NAME = "cleaned_dataset.csv"
+PARQUET_NAME = "cleaned_dataset.parquet"
+
+COLUMNS = ["Id", "timestamp", "heart_rate", "steps", "sleep"]
+METRIC_COLUMNS = ["heart_rate", "steps", "sleep"]
+
+# Parquet only: number of raw readings behind each minute's heart_rate mean
+SAMPLES_COLUMN = "heart_rate_samples"
+
+# Large enough for every (user, day) partition of a fleet-wide export
+MAX_PARTITIONS = 1 << 20
+
+
+def _arrow():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return pa, ds
+
+
+def _partitioning():
+    pa, ds = _arrow()
+    return ds.partitioning(
+        pa.schema([("Id", pa.int64()), ("day", pa.string())]),
+        flavor="hive"
+    )
+
+
+def _schema():
+    # Declared up front so files written with and without the samples
+    # column read back as one dataset
+    pa, _ = _arrow()
+    return pa.schema([
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("heart_rate", pa.float64()),
+        ("steps", pa.float64()),
+        ("sleep", pa.float64()),
+        (SAMPLES_COLUMN, pa.int64()),
+        ("Id", pa.int64()),
+        ("day", pa.string()),
+    ])
+
+
+def _source_name(source):
+    # Accept paths as well as file-like objects such as Streamlit uploads
+    return str(getattr(source, "name", source))
+
+
+def is_parquet(source):
+    name = _source_name(source).rstrip("/")
+    return name.endswith(".parquet") or (
+        isinstance(source, (str, os.PathLike)) and os.path.isdir(source)
+    )
+
+
+def find_cleaned_dataset(data_dir):
+    """Prefer the Parquet dataset in ``data_dir`` and fall back to the CSV."""
+    parquet_path = os.path.join(data_dir, PARQUET_NAME)
+    if os.path.exists(parquet_path):
+        return parquet_path
+    return os.path.join(data_dir, CSV_NAME)
+
+
+# -------------------------------
+# Writing
+# -------------------------------
+def _day_strings(timestamps):
+    # Format each distinct day once instead of every row
+    codes, days = pd.factorize(timestamps.dt.normalize())
+    return np.asarray(days.strftime("%Y-%m-%d"), dtype=object)[codes]
+
+
+def _to_table(df):
+    pa, _ = _arrow()
+    samples = df[SAMPLES_COLUMN] if SAMPLES_COLUMN in df else pd.Series(pd.NA, index=df.index)
+    df = df[COLUMNS].astype({col: "float64" for col in METRIC_COLUMNS})
+    df = df.assign(**{SAMPLES_COLUMN: samples.astype("Int64")}, day=_day_strings(df["timestamp"]))
+    return pa.Table.from_pandas(df, schema=_schema(), preserve_index=False)
+
+
+def write_cleaned_dataset(df, path, batch_no=None, replace_partitions=False):
+    """Write ``df`` as a Parquet dataset partitioned by user and day.
+
+    Without ``batch_no`` the dataset at ``path`` is replaced. Streaming and
+    incremental writers pass an increasing ``batch_no`` to add one batch at
+    a time; ``replace_partitions`` first clears the (user, day) partitions
+    the batch touches.
+    """
+    _, ds = _arrow()
+    if batch_no is None and os.path.exists(path):
+        shutil.rmtree(path)
+
+    basename = "part-{i}.parquet" if batch_no is None else f"part-{batch_no}-{{i}}.parquet"
+    ds.write_dataset(
+        _to_table(df),
+        path,
+        format="parquet",
+        partitioning=_partitioning(),
+        basename_template=basename,
+        existing_data_behavior="delete_matching" if replace_partitions else "overwrite_or_ignore",
+        max_partitions=MAX_PARTITIONS,
+    )
+
+
+# -------------------------------
+# Reading
+# -------------------------------
+def _utc(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tz is None else ts.tz_convert("UTC")
+
+
+def _parquet_filter(user_ids, start, end, partitioned=True):
+    pa, ds = _arrow()
+    expr = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if user_ids is not None:
+        expr = both(expr, ds.field("Id").isin([int(u) for u in user_ids]))
+    if start is not None:
+        start = _utc(start)
+        if partitioned:
+            expr = both(expr, ds.field("day") >= start.strftime("%Y-%m-%d"))
+        expr = both(expr, ds.field("timestamp") >= pa.scalar(start.to_pydatetime(), pa.timestamp("us", tz="UTC")))
+    if end is not None:
+        end = _utc(end)
+        if partitioned:
+            expr = both(expr, ds.field("day") <= end.strftime("%Y-%m-%d"))
+        expr = both(expr, ds.field("timestamp") < pa.scalar(end.to_pydatetime(), pa.timestamp("us", tz="UTC")))
+    return expr
+
+
+def _read_parquet(source, columns, user_ids, start, end):
+    _, ds = _arrow()
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        dataset = ds.dataset(source, format="parquet", schema=_schema(), partitioning=_partitioning())
+        table = dataset.to_table(columns=columns, filter=_parquet_filter(user_ids, start, end))
+    else:
+        # A single uploaded file: filters still skip row groups via statistics
+        import pyarrow.parquet as pq
+        table = pq.read_table(
+            source,
+            columns=columns,
+            filters=_parquet_filter(user_ids, start, end, partitioned=False),
+        )
+    return table.to_pandas()
+
+
+def _read_csv(source, columns, user_ids, start, end):
+    df = pd.read_csv(source, usecols=columns)
+    if user_ids is not None:
+        df = df[df["Id"].isin(user_ids)]
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    if start is not None:
+        df = df[df["timestamp"] >= _utc(start)]
+    if end is not None:
+        df = df[df["timestamp"] < _utc(end)]
+    return df
+
+
+def load_cleaned_dataset(source, columns=None, user_ids=None, start=None, end=None):
+    """Load the cleaned dataset with typed columns.
+
+    ``columns`` limits the columns read, ``user_ids`` and the ``start``
+    (inclusive) / ``end`` (exclusive) timestamps limit the rows. With a
+    Parquet dataset these are pushed down to the partitions and files.
+    Rows come back ordered by Id and timestamp with UTC timestamps.
+    """
+    columns = list(COLUMNS if columns is None else columns)
+    read_columns = list(dict.fromkeys(["Id", "timestamp"] + columns))
+
+    if is_parquet(source):
+        df = _read_parquet(source, read_columns, user_ids, start, end)
+    else:
+        df = _read_csv(source, read_columns, user_ids, start, end)
+
+    df = df.sort_values(["Id", "timestamp"], kind="stable", ignore_index=True)
+    return df[columns]
+
+
+def list_users(source):
+    """User Ids of the cleaned dataset in stored order, read from the Id column only."""
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        ids = {
+            int(part.split("=", 1)[1])
+            for f in _arrow()[1].dataset(source, format="parquet").files
+            for part in f.split("/")
+            if part.startswith("Id=")
+        }
+        return np.array(sorted(ids), dtype="int64")
+    if is_parquet(source):
+        return pd.read_parquet(source, columns=["Id"])["Id"].unique()
+    return pd.read_csv(source, usecols=["Id"])["Id"].unique()
+
+
+# -------------------------------
+# Compact in-memory form
+# -------------------------------
+# Long-running readers such as the dashboard keep the whole dataset in
+# memory. load_compact() holds it as a categorical Id (int16 codes for up
+# to 32k users), float32 heart rate, uint16 steps and sleep, and int64
+# minutes since the epoch (UTC) in a "minute" column. Sources are read
+# and converted a chunk at a time, so the float64/datetime form of the
+# whole dataset never exists.
+
+COMPACT_COLUMNS = ["Id", "minute", "heart_rate", "steps", "sleep"]
+COMPACT_CHUNK_ROWS = 1_000_000
+_UINT16_MAX = np.iinfo(np.uint16).max
+
+
+def to_epoch_minutes(timestamps):
+    """int64 minutes since 1970-01-01 UTC of a datetime Series (naive = UTC)."""
+    # .values: datetime64 (UTC for tz-aware series), not Timestamp objects
+    return timestamps.values.astype("datetime64[m]").view("int64")
+
+
+def from_epoch_minutes(minutes):
+    """Naive UTC datetimes of epoch minutes (a scalar or an array)."""
+    return pd.to_datetime(minutes, unit="m")
+
+
+def _compact_counts(values):
+    # Steps and sleep are whole minutes/steps; keep float32 for the rare
+    # chunk that has gaps or values uint16 cannot hold
+    values = np.asarray(values, dtype="float32")
+    if len(values) and not (
+        np.isfinite(values).all() and values.min() >= 0 and values.max() <= _UINT16_MAX
+        and (values == np.round(values)).all()
+    ):
+        return values
+    return values.astype("uint16")
+
+
+def _compact_chunk(chunk):
+    timestamps = chunk["timestamp"]
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps, utc=True)
+    ids = pd.Categorical(chunk["Id"].to_numpy(dtype="int64"))
+    frame = pd.DataFrame({
+        "minute": to_epoch_minutes(timestamps),
+        "heart_rate": chunk["heart_rate"].to_numpy(dtype="float32"),
+        "steps": _compact_counts(chunk["steps"]),
+        "sleep": _compact_counts(chunk["sleep"]),
+    }, copy=False)
+    return ids, frame
+
+
+def _filter_chunk(chunk, user_ids, start, end):
+    if user_ids is not None:
+        chunk = chunk[chunk["Id"].isin(user_ids)]
+    if start is not None or end is not None:
+        chunk = chunk.assign(timestamp=pd.to_datetime(chunk["timestamp"], utc=True))
+        if start is not None:
+            chunk = chunk[chunk["timestamp"] >= _utc(start)]
+        if end is not None:
+            chunk = chunk[chunk["timestamp"] < _utc(end)]
+    return chunk
+
+
+def _source_chunks(source, user_ids, start, end):
+    columns = ["Id", "timestamp"] + METRIC_COLUMNS
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        _, ds = _arrow()
+        dataset = ds.dataset(source, format="parquet", schema=_schema(), partitioning=_partitioning())
+        batches = dataset.to_batches(columns=columns, filter=_parquet_filter(user_ids, start, end),
+                                     batch_size=COMPACT_CHUNK_ROWS)
+        for batch in batches:
+            yield batch.to_pandas()
+    elif is_parquet(source):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(COMPACT_CHUNK_ROWS, columns=columns):
+            yield _filter_chunk(batch.to_pandas(), user_ids, start, end)
+    else:
+        dtypes = {col: "float32" for col in METRIC_COLUMNS}
+        for chunk in pd.read_csv(source, usecols=columns, dtype=dtypes, chunksize=COMPACT_CHUNK_ROWS):
+            yield _filter_chunk(chunk, user_ids, start, end)
+
+
+def release_freed_memory():
+    """Hand memory freed by large temporaries back to the OS.
+
+    Arrow's pool and glibc's heap both keep it otherwise, and a
+    long-running process such as the dashboard stays that large.
+    """
+    pa, _ = _arrow()
+    pa.default_memory_pool().release_unused()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def load_compact(source, user_ids=None, start=None, end=None):
+    """Load the cleaned dataset in compact dtypes (COMPACT_COLUMNS).
+
+    Filters work as in load_cleaned_dataset() and rows come back ordered
+    by Id and minute. ``Id`` is an ordered categorical of the user Ids.
+    """
+    from pandas.api.types import union_categoricals
+
+    ids, frames = [], []
+    for chunk in _source_chunks(source, user_ids, start, end):
+        chunk_ids, frame = _compact_chunk(chunk)
+        del chunk
+        ids.append(chunk_ids)
+        frames.append(frame)
+        release_freed_memory()
+    if not frames:
+        return pd.DataFrame({
+            "Id": pd.Categorical([], categories=pd.Index([], dtype="int64"), ordered=True),
+            "minute": np.array([], dtype="int64"),
+            "heart_rate": np.array([], dtype="float32"),
+            "steps": np.array([], dtype="uint16"),
+            "sleep": np.array([], dtype="uint16"),
+        })
+
+    df = pd.concat(frames, ignore_index=True, copy=False)
+    del frames
+    df.insert(0, "Id", union_categoricals(ids, sort_categories=True).as_ordered())
+
+    codes = df["Id"].cat.codes.to_numpy()
+    minutes = df["minute"].to_numpy()
+    same_user = codes[1:] == codes[:-1]
+    if (codes[1:] < codes[:-1]).any() or (minutes[1:] < minutes[:-1])[same_user].any():
+        df = df.take(np.lexsort((minutes, codes))).reset_index(drop=True)
+    del codes, minutes, same_user
+    release_freed_memory()
+    return df
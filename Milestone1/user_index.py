@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+# Per-user access to the cleaned dataset.
+#
+# Selecting a user with df[df["Id"] == uid] scans every row, so a loop over
+# users costs O(users x rows). UserIndex sorts the frame by Id once (the
+# cleaned dataset already is) and records each user's row range; a user's
+# rows are then an iloc slice, a view that needs no scan and no copy.
+
+
+class UserIndex:
+    """Id-sorted frame with the [start, stop) row range of every user."""
+
+    def __init__(self, df):
+        if not df["Id"].is_monotonic_increasing:
+            df = df.sort_values("Id", kind="stable", ignore_index=True)
+        self.df = df
+
+        if isinstance(df["Id"].dtype, pd.CategoricalDtype):
+            # Compact frames (storage.load_compact): scan the small codes
+            ids = df["Id"].cat.codes.to_numpy()
+        else:
+            ids = df["Id"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.array([], dtype=int)
+        stops = np.r_[starts[1:], len(ids)].astype(int)
+
+        if isinstance(df["Id"].dtype, pd.CategoricalDtype):
+            self.user_ids = df["Id"].cat.categories.to_numpy()[ids[starts]]
+        else:
+            self.user_ids = ids[starts]
+        self._ranges = dict(zip(self.user_ids.tolist(), zip(starts.tolist(), stops.tolist())))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        return int(user_id) in self._ranges
+
+    def __getitem__(self, user_id):
+        start, stop = self._ranges.get(int(user_id), (0, 0))
+        return self.df.iloc[start:stop]
+
+    def __iter__(self):
+        for user_id in self.user_ids:
+            yield user_id, self[user_id]
+
+
+def time_slice(frame, column, start=None, end=None):
+    """Rows of ``frame`` with ``start`` <= ``column`` < ``end``, as an iloc view.
+
+    ``frame`` must be ordered by ``column``, as a user's rows are; the
+    bounds are found by binary search instead of a boolean mask and copy.
+    """
+    values = frame[column].to_numpy()
+    lo = 0 if start is None else np.searchsorted(values, start, "left")
+    hi = len(values) if end is None else np.searchsorted(values, end, "left")
+    return frame.iloc[lo:hi]
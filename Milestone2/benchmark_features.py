@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+
+import numpy as np
+import pandas as pd
+
+from feature_extraction import extract_shard, load_ts_data
+from storage import find_cleaned_dataset, list_users
+from window_features import extract_minimal
+
+# Native minimal features against TSFresh's extract_features.
+#
+# Both engines get the same long-format heart rate input; the report has
+# the wall time of each, the speedup and the largest relative difference
+# between their outputs. The TSFresh import is timed separately, since the
+# native engine does not pay it.
+
+
+def synthetic_ts_data(users, minutes, seed=0):
+    """Minute heart rate per user, with gaps, in TSFresh long format."""
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range("2016-04-12", periods=minutes, freq="min", tz="UTC")
+    ts_data = pd.DataFrame({
+        "id": np.repeat(np.arange(users) + 1_000_000_000, minutes),
+        "time": np.tile(timestamps, users),
+        "value": rng.normal(75, 12, users * minutes),
+    })
+    return ts_data[rng.random(len(ts_data)) > 0.1].reset_index(drop=True)
+
+
+def max_relative_difference(a, b):
+    a = a.sort_index()
+    b = b.sort_index()[a.columns]
+    a_values = a.to_numpy(dtype="float64")
+    scale = np.maximum(np.abs(a_values), 1e-12)
+    return float(np.nanmax(np.abs(a_values - b.to_numpy(dtype="float64")) / scale))
+
+
+def run(ts_data):
+    start = time.perf_counter()
+    import tsfresh  # noqa: F401
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = extract_shard(ts_data)
+    tsfresh_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    native = extract_minimal(ts_data)
+    native_seconds = time.perf_counter() - start
+
+    reference.index = reference.index.astype(native.index.dtype)
+    return {
+        "users": int(ts_data["id"].nunique()),
+        "rows": len(ts_data),
+        "tsfresh_import_seconds": round(import_seconds, 3),
+        "tsfresh_seconds": round(tsfresh_seconds, 3),
+        "native_seconds": round(native_seconds, 3),
+        "speedup": round(tsfresh_seconds / native_seconds, 1),
+        "max_relative_difference": max_relative_difference(reference, native),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark native features against TSFresh")
+    parser.add_argument("--data-dir", default=None,
+                        help="benchmark on a cleaned dataset instead of synthetic data")
+    parser.add_argument("--users", type=int, default=200, help="synthetic users")
+    parser.add_argument("--minutes", type=int, default=5000, help="synthetic minutes per user")
+    parser.add_argument("--json", default=None, help="also write the report to this file")
+    args = parser.parse_args()
+
+    if args.data_dir:
+        data_path = find_cleaned_dataset(args.data_dir)
+        ts_data = load_ts_data(data_path, list_users(data_path))
+    else:
+        ts_data = synthetic_ts_data(args.users, args.minutes)
+
+    report = run(ts_data)
+
+    print(pd.Series(report).to_string())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
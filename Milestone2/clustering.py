@@ -0,0 +1,238 @@
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+# Mini-batch clustering of per-user feature vectors.
+#
+# modeling.py's default path fits StandardScaler, KMeans and PCA on the
+# whole feature matrix in memory. Here the feature file (CSV or Parquet,
+# one row per user) is streamed in chunks instead:
+#
+# 1. One pass partial_fits the scaler and keeps a uniform sample of rows.
+# 2. Every candidate k gets a MiniBatchKMeans fitted chunk by chunk, one
+#    process per k, and is scored by its silhouette on the sample. The
+#    best k wins (or k is given).
+# 3. One more pass partial_fits an IncrementalPCA for the 2-D projection.
+#
+# Memory stays at one chunk plus the sample, whatever the number of users.
+# The scaler, centroids and projection are saved as a small JSON model, and
+# assign() places new users with NumPy alone: no refit, no scikit-learn.
+
+DEFAULT_MODEL_PATH = "data/cluster_model.json"
+DEFAULT_CHUNK_ROWS = 10_000
+DEFAULT_K_RANGE = range(2, 9)
+# Rows kept for silhouette scoring and the cluster plot
+SAMPLE_ROWS = 10_000
+N_EPOCHS = 3
+N_COMPONENTS = 2
+SEED = 42
+
+
+# -------------------------------
+# Streaming feature rows
+# -------------------------------
+def iter_feature_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Feature rows (indexed by user id) of a CSV or Parquet file, one chunk at a time."""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, index_col=0, chunksize=chunk_rows)
+
+
+def _scale(chunk, columns, mean, scale):
+    # Missing features (e.g. the deviation of a single reading) sit at the mean
+    X = chunk.reindex(columns=columns).to_numpy(dtype="float64")
+    X = (X - mean) / scale
+    X[np.isnan(X)] = 0.0
+    return X
+
+
+def _scaled_chunks(path, chunk_rows, columns, mean, scale):
+    for chunk in iter_feature_chunks(path, chunk_rows):
+        if len(chunk):
+            yield chunk.index, _scale(chunk, columns, mean, scale)
+
+
+def scan_features(path, chunk_rows=DEFAULT_CHUNK_ROWS, sample_rows=SAMPLE_ROWS, seed=SEED):
+    """Pass 1: partial_fit the scaler and draw a uniform row sample."""
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler()
+    rng = np.random.default_rng(seed)
+    columns = None
+    rows = 0
+    sample, sample_keys = None, None
+    for chunk in iter_feature_chunks(path, chunk_rows):
+        if columns is None:
+            columns = list(chunk.columns)
+        chunk = chunk.reindex(columns=columns)
+        rows += len(chunk)
+        scaler.partial_fit(chunk.to_numpy(dtype="float64"))
+
+        # Rows with the smallest random keys so far are a uniform sample
+        keys = rng.random(len(chunk))
+        if sample is not None:
+            chunk = pd.concat([sample, chunk])
+            keys = np.concatenate([sample_keys, keys])
+        keep = np.argsort(keys, kind="stable")[:sample_rows]
+        sample, sample_keys = chunk.iloc[keep], keys[keep]
+
+    if columns is None:
+        raise ValueError(f"No feature rows in {path}")
+    scale = np.where(scaler.scale_ > 0, scaler.scale_, 1.0)
+    return columns, scaler.mean_, scale, rows, sample
+
+
+# -------------------------------
+# k selection
+# -------------------------------
+def fit_kmeans(job):
+    """Fit MiniBatchKMeans with ``k`` clusters over the streamed rows; score it."""
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+
+    path, chunk_rows, columns, mean, scale, k, X_sample, n_epochs = job
+    start = time.perf_counter()
+    kmeans = MiniBatchKMeans(n_clusters=k, random_state=SEED, n_init=3,
+                             batch_size=max(1024, k * 10))
+    # The first partial_fit needs at least k rows; seed it from the sample
+    kmeans.partial_fit(X_sample)
+    for _ in range(n_epochs):
+        for _, X in _scaled_chunks(path, chunk_rows, columns, mean, scale):
+            kmeans.partial_fit(X)
+
+    labels = kmeans.predict(X_sample)
+    score = silhouette_score(X_sample, labels) if len(set(labels)) > 1 else -1.0
+    return {
+        "k": k,
+        "silhouette": float(score),
+        "sample_inertia": float(((X_sample - kmeans.cluster_centers_[labels]) ** 2).sum()),
+        "seconds": round(time.perf_counter() - start, 3),
+        "centroids": kmeans.cluster_centers_,
+    }
+
+
+def fit_minibatch(path, k="auto", k_range=DEFAULT_K_RANGE, workers=None,
+                  chunk_rows=DEFAULT_CHUNK_ROWS, n_epochs=N_EPOCHS):
+    """Fit the streamed scaler/MiniBatchKMeans/IncrementalPCA model of ``path``.
+
+    With ``k="auto"`` every k of ``k_range`` is fitted, ``workers`` at a
+    time, and the best silhouette wins. Returns the ClusterModel and the
+    sampled feature rows.
+    """
+    from sklearn.decomposition import IncrementalPCA
+
+    columns, mean, scale, rows, sample = scan_features(path, chunk_rows)
+    X_sample = _scale(sample, columns, mean, scale)
+
+    # Silhouette needs 2 <= k < sampled rows
+    ks = [k] if k != "auto" else [c for c in k_range if 2 <= c < len(X_sample)]
+    if not ks:
+        raise ValueError(f"Too few users ({rows}) to choose k from {list(k_range)}")
+    jobs = [(path, chunk_rows, columns, mean, scale, c, X_sample, n_epochs) for c in ks]
+    if workers == 1 or len(jobs) == 1:
+        candidates = [fit_kmeans(job) for job in jobs]
+    else:
+        with Pool(min(workers or os.cpu_count(), len(jobs))) as pool:
+            candidates = pool.map(fit_kmeans, jobs)
+    best = max(candidates, key=lambda c: c["silhouette"])
+
+    # partial_fit needs n_components rows per call, so short chunks are held
+    # over to the next one (and a last one of fewer rows is left out)
+    pca = IncrementalPCA(n_components=min(N_COMPONENTS, len(columns)))
+    pending = []
+    for _, X in _scaled_chunks(path, chunk_rows, columns, mean, scale):
+        pending.append(X)
+        if sum(len(p) for p in pending) >= pca.n_components:
+            pca.partial_fit(np.concatenate(pending))
+            pending = []
+
+    return ClusterModel(
+        columns=columns,
+        mean=mean,
+        scale=scale,
+        centroids=best["centroids"],
+        components=pca.components_,
+        pca_mean=pca.mean_,
+        info={
+            "rows": rows,
+            "k": best["k"],
+            "candidates": [{key: c[key] for key in ("k", "silhouette", "sample_inertia", "seconds")}
+                           for c in candidates],
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+    ), sample
+
+
+# -------------------------------
+# Persisted model
+# -------------------------------
+class ClusterModel:
+    """Scaler, centroids and 2-D projection of a fitted clustering."""
+
+    ARRAYS = ("mean", "scale", "centroids", "components", "pca_mean")
+
+    def __init__(self, columns, mean, scale, centroids, components, pca_mean, info=None):
+        self.columns = list(columns)
+        self.mean = np.asarray(mean, dtype="float64")
+        self.scale = np.asarray(scale, dtype="float64")
+        self.centroids = np.asarray(centroids, dtype="float64")
+        self.components = np.asarray(components, dtype="float64")
+        self.pca_mean = np.asarray(pca_mean, dtype="float64")
+        self.info = info or {}
+
+    @property
+    def k(self):
+        return len(self.centroids)
+
+    def save(self, path=DEFAULT_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "columns": self.columns,
+                **{name: getattr(self, name).tolist() for name in self.ARRAYS},
+                "info": self.info,
+            }, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        with open(path) as f:
+            entry = json.load(f)
+        return cls(entry["columns"], **{name: entry[name] for name in cls.ARRAYS},
+                   info=entry.get("info"))
+
+    def transform(self, features):
+        return _scale(features, self.columns, self.mean, self.scale)
+
+    def assign(self, features):
+        """Nearest centroid of every row of ``features``; no refit."""
+        X = self.transform(features)
+        # |x - c|^2 without the (rows, k, features) temporary
+        distances = (self.centroids ** 2).sum(axis=1) - 2 * X @ self.centroids.T
+        return distances.argmin(axis=1)
+
+    def project(self, features):
+        return (self.transform(features) - self.pca_mean) @ self.components.T
+
+
+def assign_file(path, model, out_path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Write (Id, cluster, pc1, pc2) for every row of ``path``; returns the row count."""
+    rows = 0
+    for chunk in iter_feature_chunks(path, chunk_rows):
+        projected = model.project(chunk)
+        out = pd.DataFrame({"cluster": model.assign(chunk)}, index=chunk.index)
+        for i in range(projected.shape[1]):
+            out[f"pc{i + 1}"] = projected[:, i]
+        out.to_csv(out_path, mode="w" if rows == 0 else "a", header=rows == 0,
+                   index_label="Id")
+        rows += len(out)
+    return rows
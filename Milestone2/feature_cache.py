@@ -0,0 +1,82 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+# On-disk cache of per-user feature vectors.
+#
+# Every user's vector is stored with a fingerprint of the series it was
+# computed from. A run fingerprints each user's current series and only
+# recomputes the users whose fingerprint is new or changed; everyone else
+# is served from the cache. The cache is a single Parquet table (one row
+# per user), read and rewritten whole, which stays small next to the data.
+
+DEFAULT_CACHE_PATH = "data/feature_cache.parquet"
+
+# Bump when the extracted feature set changes, so stale vectors miss
+FEATURE_VERSION = "tsfresh-minimal-v1"
+
+
+def fingerprints(ts_data, version=FEATURE_VERSION):
+    """Fingerprint of every id's (time, value) series in tsfresh long format."""
+    ts_data = ts_data.sort_values(["id", "time"], kind="stable")
+    row_hashes = pd.util.hash_pandas_object(ts_data[["time", "value"]], index=False).to_numpy()
+    ids = ts_data["id"].to_numpy()
+
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.array([], dtype=int)
+    stops = np.r_[starts[1:], len(ids)].astype(int)
+
+    result = {}
+    for start, stop in zip(starts, stops):
+        digest = hashlib.sha1(version.encode())
+        digest.update(row_hashes[start:stop].tobytes())
+        result[ids[start]] = digest.hexdigest()[:20]
+    return result
+
+
+class FeatureCache:
+    """Per-user feature vectors keyed by a fingerprint of the user's series."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0}
+        if os.path.exists(path):
+            table = pd.read_parquet(path)
+            self._fingerprints = table.pop("fingerprint")
+            self._features = table
+        else:
+            self._fingerprints = pd.Series(dtype="object")
+            self._features = pd.DataFrame()
+
+    def stale(self, current):
+        """Ids of ``current`` ({id: fingerprint}) that must be recomputed."""
+        cached = self._fingerprints.to_dict()
+        stale = [uid for uid, fp in current.items() if cached.get(uid) != fp]
+        self.stats["misses"] += len(stale)
+        self.stats["hits"] += len(current) - len(stale)
+        return stale
+
+    def update(self, features, current):
+        """Store freshly computed ``features`` (indexed by id)."""
+        if features.empty:
+            return
+        kept = ~self._features.index.isin(features.index)
+        self._features = pd.concat([self._features[kept], features])
+        self._fingerprints = pd.concat([
+            self._fingerprints[kept],
+            pd.Series({uid: current[uid] for uid in features.index}, dtype="object"),
+        ])
+
+    def get(self, ids):
+        return self._features.reindex(list(ids))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        table = self._features.assign(fingerprint=self._fingerprints)
+        tmp_path = f"{self.path}.tmp"
+        table.to_parquet(tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        return f"Feature cache: {self.stats['hits']} hits, {self.stats['misses']} recomputed"
@@ -1,48 +1,166 @@
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+
 import pandas as pd
-from tsfresh import extract_features
-from tsfresh.feature_extraction import MinimalFCParameters
-from sklearn.feature_selection import VarianceThreshold
-
-# Load cleaned dataset
-df = pd.read_csv("data/cleaned_dataset.csv")
-df["timestamp"] = pd.to_datetime(df["timestamp"])
-
-# Use FIRST 5 USERS (as in notebook)
-user_ids = df["Id"].unique()[:5]
-df = df[df["Id"].isin(user_ids)]
-
-# Limit rows per user to keep balance
-df = df.groupby("Id").head(600)
-
-# Prepare TSFresh input (Heart Rate)
-ts_data = df[["Id", "timestamp", "heart_rate"]].dropna()
-ts_data.columns = ["id", "time", "value"]
-
-# Extract features
-features = extract_features(
-    ts_data,
-    column_id="id",
-    column_sort="time",
-    default_fc_parameters=MinimalFCParameters(),
-    disable_progressbar=False
-)
-
-print("Extracted features shape:", features.shape)
-
-# Feature selection (same as notebook)
-if features.shape[0] > 1:
-    selector = VarianceThreshold(threshold=0.01)
-    selected_array = selector.fit_transform(features)
-    selected_features = pd.DataFrame(
-        selected_array,
-        index=features.index,
-        columns=features.columns[selector.get_support()]
+
+from feature_cache import DEFAULT_CACHE_PATH, FeatureCache, fingerprints
+from instrumentation import enable as enable_tracing, span
+from storage import METRIC_COLUMNS, find_cleaned_dataset, list_users, load_cleaned_dataset
+from window_features import extract_minimal
+
+# Users per extract_features call in all-users mode
+SHARD_USERS = 50
+
+
+def load_ts_data(data_path, user_ids, max_rows=None):
+    # Load cleaned dataset (only these users' heart rate)
+    df = load_cleaned_dataset(
+        data_path, columns=["Id", "timestamp", "heart_rate"], user_ids=user_ids
     )
-else:
-    selected_features = features.copy()
 
-# Save outputs
-features.to_csv("data/tsfresh_features.csv")
-selected_features.to_csv("data/selected_features.csv")
+    # Limit rows per user to keep balance
+    if max_rows is not None:
+        df = df.groupby("Id").head(max_rows)
+
+    # Prepare TSFresh input (Heart Rate)
+    ts_data = df[["Id", "timestamp", "heart_rate"]].dropna()
+    ts_data.columns = ["id", "time", "value"]
+    return ts_data
+
+
+def extract_shard(ts_data, progress=False):
+    # Imported here: TSFresh is slow to import and the native engine skips it
+    from tsfresh import extract_features
+    from tsfresh.feature_extraction import MinimalFCParameters
+
+    # tsfresh's own worker pool is off, the shards already run in parallel
+    with span("features.tsfresh_shard", rows=len(ts_data)):
+        return extract_features(
+            ts_data,
+            column_id="id",
+            column_sort="time",
+            default_fc_parameters=MinimalFCParameters(),
+            disable_progressbar=not progress,
+            n_jobs=0,
+        )
+
+
+def extract_parallel(ts_data, workers=None, shard_users=SHARD_USERS):
+    """Extract features with users sharded across a process pool."""
+    ids = ts_data["id"].unique()
+    if len(ids) == 0:
+        return pd.DataFrame()
+    groups = ts_data.groupby("id", sort=False)
+    shards = [
+        pd.concat([groups.get_group(uid) for uid in ids[i:i + shard_users]])
+        for i in range(0, len(ids), shard_users)
+    ]
+    if workers == 1 or len(shards) == 1:
+        return pd.concat([extract_shard(shard) for shard in shards])
+
+    with Pool(workers) as pool:
+        return pd.concat(pool.map(extract_shard, shards))
+
+
+def extract_cached(ts_data, cache, workers=None):
+    """Features for every id in ``ts_data``, recomputing only changed users."""
+    current = fingerprints(ts_data)
+    stale = cache.stale(current)
+    if stale:
+        fresh = extract_parallel(ts_data[ts_data["id"].isin(stale)], workers)
+        cache.update(fresh, current)
+        cache.save()
+    return cache.get(list(current))
+
+
+def select_features(features):
+    # Feature selection (same as notebook). scikit-learn is imported on
+    # first use; at module level it adds over a second to every start
+    from sklearn.feature_selection import VarianceThreshold
+
+    if features.shape[0] > 1:
+        selector = VarianceThreshold(threshold=0.01)
+        selected_array = selector.fit_transform(features)
+        return pd.DataFrame(
+            selected_array,
+            index=features.index,
+            columns=features.columns[selector.get_support()]
+        )
+    return features.copy()
+
+
+def main(data_dir="data", all_users=False, workers=None, cache_path=DEFAULT_CACHE_PATH,
+         engine="tsfresh", window=None):
+    data_path = find_cleaned_dataset(data_dir)
+
+    with span("features.load") as s:
+        if all_users:
+            # Every user, full history
+            user_ids = list_users(data_path)
+            ts_data = load_ts_data(data_path, user_ids)
+        else:
+            # Use FIRST 5 USERS, 600 rows each (as in notebook)
+            user_ids = list_users(data_path)[:5]
+            ts_data = load_ts_data(data_path, user_ids, max_rows=600)
+        s.rows = len(ts_data)
+
+    with span("features.extract", rows=len(ts_data), engine=engine):
+        if engine == "native":
+            # Same features and column names, one vectorized pass over all users
+            features = extract_minimal(ts_data)
+        elif all_users:
+            # Sharded across processes, unchanged users served from the cache
+            cache = FeatureCache(cache_path)
+            features = extract_cached(ts_data, cache, workers)
+            print(cache.summary())
+        else:
+            features = extract_shard(ts_data, progress=True)
+
+    print("Extracted features shape:", features.shape)
+
+    with span("features.select", rows=len(features)):
+        selected_features = select_features(features)
+
+    # Save outputs
+    with span("features.write", rows=len(features)):
+        features.to_csv(os.path.join(data_dir, "tsfresh_features.csv"))
+        selected_features.to_csv(os.path.join(data_dir, "selected_features.csv"))
+
+    print("Final selected feature shape:", selected_features.shape)
+
+    if window is not None:
+        # Per user and day/hour, for heart rate, steps and sleep
+        df = load_cleaned_dataset(data_path, columns=["Id", "timestamp"] + METRIC_COLUMNS,
+                                  user_ids=user_ids)
+        with span("features.window", rows=len(df), window=window):
+            window_features = extract_minimal(df, METRIC_COLUMNS, column_id="Id",
+                                              column_sort="timestamp", freq=window)
+        path = os.path.join(data_dir, f"window_features_{window}.csv")
+        window_features.to_csv(path)
+        print(f"Window features ({window}) shape:", window_features.shape)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract TSFresh features per user")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--all-users", action="store_true",
+                        help="every user over their full history, in parallel with a feature cache")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes for --all-users (default: CPU count)")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--engine", choices=["tsfresh", "native"], default="tsfresh",
+                        help="native computes the same minimal features with NumPy")
+    parser.add_argument("--window", choices=["D", "h"], default=None,
+                        help="also write per-day or per-hour features of every metric")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="write per-stage timings to FILE (JSON lines) and print a summary")
+    args = parser.parse_args()
+
+    if args.trace:
+        enable_tracing(args.trace)
 
-print("Final selected feature shape:", selected_features.shape)
+    main(args.data_dir, args.all_users, args.workers, args.cache_path, args.engine, args.window)
@@ -1,61 +1,180 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone3"))
+
 import pandas as pd
-import matplotlib.pyplot as plt
-from prophet import Prophet
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
-
-# Load cleaned dataset
-df = pd.read_csv("data/cleaned_dataset.csv")
-df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.tz_localize(None)
-
-# Use same 5 users as feature extraction
-user_ids = df["Id"].unique()[:5]
-df = df[df["Id"].isin(user_ids)]
-
-# ---------- PROPHET (per user, per metric) ----------
-for uid in user_ids:
-    print("\nUser:", uid)
-    user_df = df[df["Id"] == uid]
-
-    for metric in ["heart_rate", "steps", "sleep"]:
-        temp = user_df[["timestamp", metric]].dropna()
-        temp = temp.rename(columns={"timestamp": "ds", metric: "y"})
-        temp = temp.set_index("ds").resample("D").mean().reset_index()
-
-        model = Prophet(daily_seasonality=True)
-        model.fit(temp)
-
-        future = model.make_future_dataframe(periods=7)
-        forecast = model.predict(future)
-
-        model.plot(forecast)
-        plt.title(f"{metric.capitalize()} Trend - User {uid}")
+
+from clustering import (
+    DEFAULT_CHUNK_ROWS, DEFAULT_MODEL_PATH, SAMPLE_ROWS, ClusterModel, assign_file, fit_minibatch,
+)
+from instrumentation import enable as enable_tracing, span
+from model_registry import ModelRegistry
+from storage import find_cleaned_dataset, list_users, load_cleaned_dataset
+from user_index import UserIndex
+
+FEATURES_PATH = "data/selected_features.csv"
+# Written next to the cluster model
+ASSIGNMENTS_NAME = "cluster_assignments.csv"
+
+
+def model_trends(data_dir="data"):
+    # Imported here, so --help and clustering-only runs skip it
+    import matplotlib.pyplot as plt
+
+    data_path = find_cleaned_dataset(data_dir)
+
+    # Use same 5 users as feature extraction
+    user_ids = list_users(data_path)[:5]
+
+    # Load cleaned dataset (only these users). Stages are timed when tracing
+    # is on (FITPULSE_TRACE=<trace file>, see instrumentation.py)
+    with span("modeling.load") as s:
+        df = load_cleaned_dataset(data_path, user_ids=user_ids)
+        df["timestamp"] = df["timestamp"].dt.tz_localize(None)
+        index = UserIndex(df)
+        s.rows = len(df)
+
+    # ---------- PROPHET (per user, per metric) ----------
+    # Fitted models are stored and reused while a series is unchanged
+    registry = ModelRegistry()
+
+    for uid in user_ids:
+        print("\nUser:", uid)
+        user_df = index[uid]
+
+        for metric in ["heart_rate", "steps", "sleep"]:
+            temp = user_df[["timestamp", metric]].dropna()
+            temp = temp.rename(columns={"timestamp": "ds", metric: "y"})
+            temp = temp.set_index("ds").resample("D").mean().reset_index()
+
+            with span("modeling.prophet_fit", rows=len(temp), metric=metric):
+                model = registry.get_or_fit(uid, metric, temp)
+
+            with span("modeling.prophet_predict", rows=len(temp), metric=metric):
+                future = model.make_future_dataframe(periods=7)
+                forecast = model.predict(future)
+
+            with span("modeling.plot"):
+                model.plot(forecast)
+                plt.title(f"{metric.capitalize()} Trend - User {uid}")
+                plt.show()
+
+            merged = temp.merge(forecast[["ds", "yhat"]], on="ds", how="left")
+            merged["residual"] = merged["y"] - merged["yhat"]
+            threshold = 2 * merged["residual"].std()
+            merged["anomaly"] = abs(merged["residual"]) > threshold
+
+            print("Anomalies:")
+            print(merged[merged["anomaly"]])
+
+    print(registry.summary())
+
+
+# ---------- CLUSTERING ----------
+def cluster_in_memory(features_path=FEATURES_PATH, k=2):
+    # scikit-learn is only needed from here on
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.decomposition import PCA
+
+    features = pd.read_csv(features_path, index_col=0)
+
+    with span("modeling.clustering", rows=len(features)):
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(features)
+
+        kmeans = KMeans(n_clusters=k, random_state=42)
+        clusters = kmeans.fit_predict(X_scaled)
+
+        pca = PCA(n_components=2)
+        X_pca = pca.fit_transform(X_scaled)
+    return X_pca, clusters
+
+
+def cluster_minibatch(features_path=FEATURES_PATH, k="auto", workers=None,
+                      chunk_rows=DEFAULT_CHUNK_ROWS, model_path=DEFAULT_MODEL_PATH,
+                      assign_only=False):
+    """Fit (or load) the streamed clustering and assign every user in ``features_path``."""
+    out_path = os.path.join(os.path.dirname(model_path), ASSIGNMENTS_NAME)
+    if assign_only:
+        model = ClusterModel.load(model_path)
+        print(f"Loaded {model.k} centroids from {model_path}")
+    else:
+        with span("modeling.clustering_fit") as s:
+            model, _ = fit_minibatch(features_path, k, workers=workers, chunk_rows=chunk_rows)
+            s.rows = model.info["rows"]
+        model.save(model_path)
+        for candidate in model.info["candidates"]:
+            print(f"k={candidate['k']}: silhouette {candidate['silhouette']:.3f} "
+                  f"({candidate['seconds']:.1f}s)")
+        print(f"Chose k={model.k}; centroids saved to {model_path}")
+
+    with span("modeling.clustering_assign") as s:
+        s.rows = assign_file(features_path, model, out_path, chunk_rows)
+    print(f"Cluster of every user written to {out_path}")
+
+    # The plot shows a bounded number of users, not all of them
+    assigned = pd.read_csv(out_path, index_col=0, nrows=SAMPLE_ROWS)
+    return assigned[["pc1", "pc2"]].to_numpy(), assigned["cluster"].to_numpy()
+
+
+def plot_clusters(X_pca, clusters):
+    import matplotlib.pyplot as plt
+
+    with span("modeling.plot"):
+        plt.figure(figsize=(6,5))
+        plt.scatter(X_pca[:,0], X_pca[:,1], c=clusters, cmap="viridis",
+                    s=100 if len(X_pca) <= 100 else 5)
+        plt.xlabel("PC1")
+        plt.ylabel("PC2")
+        plt.title("User Behavioral Clusters")
         plt.show()
 
-        merged = temp.merge(forecast[["ds", "yhat"]], on="ds", how="left")
-        merged["residual"] = merged["y"] - merged["yhat"]
-        threshold = 2 * merged["residual"].std()
-        merged["anomaly"] = abs(merged["residual"]) > threshold
 
-        print("Anomalies:")
-        print(merged[merged["anomaly"]])
+def main(data_dir="data", clustering="kmeans", features_path=FEATURES_PATH, k=None,
+         workers=None, chunk_rows=DEFAULT_CHUNK_ROWS, model_path=DEFAULT_MODEL_PATH,
+         assign_only=False, skip_trends=False):
+    if not skip_trends:
+        model_trends(data_dir)
 
-# ---------- CLUSTERING (5 users, no error) ----------
-features = pd.read_csv("data/selected_features.csv", index_col=0)
+    if clustering == "kmeans":
+        # 5 users, no error
+        X_pca, clusters = cluster_in_memory(features_path, k or 2)
+    else:
+        X_pca, clusters = cluster_minibatch(features_path, k or "auto", workers, chunk_rows,
+                                            model_path, assign_only)
+    plot_clusters(X_pca, clusters)
 
-scaler = StandardScaler()
-X_scaled = scaler.fit_transform(features)
 
-kmeans = KMeans(n_clusters=2, random_state=42)
-clusters = kmeans.fit_predict(X_scaled)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prophet trends and behavioral clustering")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--clustering", choices=["kmeans", "minibatch"], default="kmeans",
+                        help="minibatch streams the feature file and scales to any number of users")
+    parser.add_argument("--features", default=FEATURES_PATH,
+                        help="per-user feature table (.csv or .parquet) to cluster")
+    parser.add_argument("--k", default=None,
+                        help="number of clusters; minibatch also takes 'auto' (default)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes evaluating candidate k in parallel")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="feature rows read per chunk in minibatch mode")
+    parser.add_argument("--model-path", default=DEFAULT_MODEL_PATH,
+                        help="persisted scaler, centroids and projection")
+    parser.add_argument("--assign-only", action="store_true",
+                        help="assign users to the stored centroids instead of refitting")
+    parser.add_argument("--skip-trends", action="store_true",
+                        help="only run the clustering")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="write per-stage timings to FILE (JSON lines) and print a summary")
+    args = parser.parse_args()
 
-pca = PCA(n_components=2)
-X_pca = pca.fit_transform(X_scaled)
+    if args.trace:
+        enable_tracing(args.trace)
 
-plt.figure(figsize=(6,5))
-plt.scatter(X_pca[:,0], X_pca[:,1], c=clusters, cmap="viridis", s=100)
-plt.xlabel("PC1")
-plt.ylabel("PC2")
-plt.title("User Behavioral Clusters")
-plt.show()
+    k = int(args.k) if args.k not in (None, "auto") else args.k
+    main(args.data_dir, args.clustering, args.features, k, args.workers, args.chunk_rows,
+         args.model_path, args.assign_only, args.skip_trends)
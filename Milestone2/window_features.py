@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+# Native implementation of the TSFresh MinimalFCParameters features.
+#
+# The minimal set is ten plain reductions. Instead of TSFresh's per-id
+# dispatch, all series are laid out as one array sorted by (id, window)
+# (usually already the case, so no sort at all); group boundaries come
+# from where the key changes, and every feature is a single
+# np.*.reduceat over the whole array. The median is pandas' grouped
+# median over the same group codes. Column names match TSFresh's,
+# e.g. "value__mean". With ``freq`` the same features are computed per
+# id and calendar window ("D", "h", ...) instead of per id.
+
+# In TSFresh's output order
+FEATURES = [
+    "sum_values",
+    "median",
+    "mean",
+    "length",
+    "standard_deviation",
+    "variance",
+    "root_mean_square",
+    "maximum",
+    "absolute_maximum",
+    "minimum",
+]
+
+
+def _group_bounds(keys):
+    # Start offset of every run of equal keys (keys already sorted)
+    changed = np.zeros(len(keys[0]), dtype=bool)
+    changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(changed)
+    return starts, np.diff(np.r_[starts, len(changed)]), np.cumsum(changed) - 1
+
+
+def _is_sorted(keys):
+    ids = keys[0]
+    if not (ids[1:] >= ids[:-1]).all():
+        return False
+    if len(keys) == 1:
+        return True
+    windows = keys[1]
+    same_id = ids[1:] == ids[:-1]
+    return bool((windows[1:] >= windows[:-1])[same_id].all())
+
+
+def _reduce(values, starts, lengths, codes):
+    sums = np.add.reduceat(values, starts)
+    means = sums / lengths
+    # Two-pass variance, population form like np.var in TSFresh
+    deviations = values - np.repeat(means, lengths)
+    variances = np.add.reduceat(deviations * deviations, starts) / lengths
+    maxima = np.maximum.reduceat(values, starts)
+    minima = np.minimum.reduceat(values, starts)
+    return {
+        "sum_values": sums,
+        "median": pd.Series(values).groupby(codes).median().to_numpy(),
+        "mean": means,
+        "length": lengths.astype("float64"),
+        "standard_deviation": np.sqrt(variances),
+        "variance": variances,
+        "root_mean_square": np.sqrt(np.add.reduceat(values * values, starts) / lengths),
+        "maximum": maxima,
+        "absolute_maximum": np.maximum(np.abs(maxima), np.abs(minima)),
+        "minimum": minima,
+    }
+
+
+def extract_minimal(df, value_columns=("value",), column_id="id", column_sort="time", freq=None):
+    """Minimal feature set per id (or per id and ``freq`` window).
+
+    ``df`` is long format like TSFresh input: one row per (id, time) with
+    one column per metric. NaNs are dropped per metric, as TSFresh does.
+    Returns a frame indexed by id, or by (id, window start) with ``freq``.
+    """
+    result = []
+    for column in value_columns:
+        rows = df[[column_id, column_sort, column]].dropna()
+        ids = rows[column_id].to_numpy()
+        values = rows[column].to_numpy(dtype="float64")
+        keys = [ids]
+        if freq is not None:
+            # .values: datetime64 (UTC for tz-aware times), not Timestamp objects
+            floored = rows[column_sort].dt.floor(freq)
+            keys.append(floored.values)
+        if len(values) and not _is_sorted(keys):
+            order = np.lexsort(keys[::-1])
+            keys = [key[order] for key in keys]
+            values = values[order]
+
+        if len(values):
+            starts, lengths, codes = _group_bounds(keys)
+            features = _reduce(values, starts, lengths, codes)
+        else:
+            starts = np.array([], dtype=int)
+            features = {name: np.array([], dtype="float64") for name in FEATURES}
+
+        if freq is None:
+            index = pd.Index(keys[0][starts])
+        else:
+            window_starts = pd.DatetimeIndex(keys[1][starts])
+            if floored.dt.tz is not None:
+                window_starts = window_starts.tz_localize("UTC").tz_convert(floored.dt.tz)
+            index = pd.MultiIndex.from_arrays(
+                [keys[0][starts], window_starts], names=[None, column_sort]
+            )
+        result.append(pd.DataFrame(
+            {f"{column}__{name}": features[name] for name in FEATURES}, index=index
+        ))
+
+    return pd.concat(result, axis=1) if len(result) > 1 else result[0]
@@ -1,141 +1,159 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-from prophet import Prophet
+import argparse
 import os
-
-# Create visualization folder
-os.makedirs("visualizations", exist_ok=True)
-
-# Load cleaned dataset
-df = pd.read_csv("/content/drive/MyDrive/FitPulse Health Anomaly Detection from Fitness Devices/Milestone2/data/cleaned_dataset.csv")
-df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.tz_localize(None)
-
-# Select at least 5 users
-user_ids = df["Id"].unique()[:5]
-
-print("Selected User IDs:", user_ids)
-
-# ANOMALY IDENTIFICATION (RESIDUAL ANALYSIS)
-
-
-all_hr_results = []
-
-for uid in user_ids:
-    user_df = df[df["Id"] == uid]
-
-    # -------- Heart Rate Data --------
-    hr = user_df[["timestamp", "heart_rate"]].dropna()
-    hr = hr.rename(columns={"timestamp": "ds", "heart_rate": "y"})
-    hr = hr.set_index("ds").resample("D").mean().reset_index()
-
-    if len(hr) < 10:
-        continue
-
-    # Prophet Model
-    model = Prophet(daily_seasonality=True)
-    model.fit(hr)
-
-    future = model.make_future_dataframe(periods=7)
-    forecast = model.predict(future)
-
-    # Residuals
-    merged = hr.merge(forecast[["ds", "yhat"]], on="ds", how="left")
-    merged["residual"] = merged["y"] - merged["yhat"]
-    merged["user_id"] = uid
-
-    all_hr_results.append(merged)
-
-# Combine all users
-hr_results = pd.concat(all_hr_results, ignore_index=True)
-
-# Threshold-based anomaly detection (Standard Deviation)
-
-threshold_hr = 2 * hr_results["residual"].std()
-hr_results["anomaly"] = abs(hr_results["residual"]) > threshold_hr
-
-#ANOMALY LABELING
-
-hr_results["label"] = hr_results["anomaly"].apply(
-    lambda x: "Anomalous" if x else "Normal"
-)
-
-print("Sample labeled data:")
-hr_results.head()
-
-#VISUALIZATION OF HEART RATE ANOMALIES
-
-plt.figure(figsize=(12,6))
-
-for uid in user_ids:
-    user_data = hr_results[hr_results["user_id"] == uid]
-    plt.plot(user_data["ds"], user_data["y"], label=f"User {uid}")
-
-    anomalies = user_data[user_data["anomaly"]]
-    plt.scatter(anomalies["ds"], anomalies["y"], color="red")
-
-plt.title("Heart Rate Time-Series with Anomalies (5 Users)")
-plt.xlabel("Date")
-plt.ylabel("Heart Rate")
-plt.legend()
-plt.tight_layout()
-
-plt.savefig("visualizations/heart_rate_anomalies.png")
-plt.show()
-
-# ============================================================
-# SLEEP ANOMALY DETECTION 
-
-all_sleep_results = []
-
-for uid in user_ids:
-    user_df = df[df["Id"] == uid]
-
-    # -------- Sleep Data --------
-    sleep = user_df[["timestamp", "sleep"]].dropna()
-    sleep = sleep.rename(columns={"timestamp": "ds", "sleep": "y"})
-    sleep = sleep.set_index("ds").resample("D").mean().reset_index()
-
-    if len(sleep) < 10:
-        continue
-
-    model = Prophet(daily_seasonality=True)
-    model.fit(sleep)
-
-    future = model.make_future_dataframe(periods=7)
-    forecast = model.predict(future)
-
-    merged = sleep.merge(forecast[["ds", "yhat"]], on="ds", how="left")
-    merged["residual"] = merged["y"] - merged["yhat"]
-    merged["user_id"] = uid
-
-    all_sleep_results.append(merged)
-
-sleep_results = pd.concat(all_sleep_results, ignore_index=True)
-
-# Threshold-based detection
-threshold_sleep = 2 * sleep_results["residual"].std()
-sleep_results["anomaly"] = abs(sleep_results["residual"]) > threshold_sleep
-
-# ============================================================
-# VISUALIZATION OF SLEEP ANOMALIES
-# ============================================================
-
-plt.figure(figsize=(12,6))
-
-for uid in user_ids:
-    user_data = sleep_results[sleep_results["user_id"] == uid]
-    plt.plot(user_data["ds"], user_data["y"], label=f"User {uid}")
-
-    anomalies = user_data[user_data["anomaly"]]
-    plt.scatter(anomalies["ds"], anomalies["y"], color="red")
-
-plt.title("Sleep Pattern Visualization with Anomalies (5 Users)")
-plt.xlabel("Date")
-plt.ylabel("Sleep")
-plt.legend()
-plt.tight_layout()
-
-plt.savefig("visualizations/sleep_anomalies.png")
-plt.show()
-print("Milestone 3 anomaly detection completed successfully.")
-print("Screenshots saved in 'visualizations/' folder.")
\ No newline at end of file
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+
+from detection import DEFAULT_JOB_TIMEOUT, detect_anomalies
+from detectors import DETECTORS, get_detector
+from downsample import MAX_POINTS, downsample
+from instrumentation import enable as enable_tracing, span
+from model_registry import DEFAULT_MODEL_DIR, ModelRegistry
+from rollups import has_rollups, load_rollup, rollup_means
+from storage import find_cleaned_dataset, list_users, load_cleaned_dataset
+from thresholds import ThresholdStore
+from user_index import UserIndex
+
+DATA_DIR = "/content/drive/MyDrive/FitPulse Health Anomaly Detection from Fitness Devices/Milestone2/data"
+
+
+def plot_anomalies(results, title, ylabel, path, max_points=MAX_POINTS):
+    # Imported here, so runs that fail or stop before plotting skip it
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(12,6))
+
+    for uid, user_data in results.groupby("user_id", sort=False):
+        # Long (e.g. minute) series are thinned; anomalies are always drawn
+        user_data = downsample(user_data, max_points)
+        plt.plot(user_data["ds"], user_data["y"], label=f"User {uid}")
+
+        anomalies = user_data[user_data["anomaly"]]
+        plt.scatter(anomalies["ds"], anomalies["y"], color="red")
+
+    plt.title(title)
+    plt.xlabel("Date")
+    plt.ylabel(ylabel)
+    plt.legend()
+    plt.tight_layout()
+
+    plt.savefig(path)
+    plt.show()
+
+
+def main(data_dir=DATA_DIR, workers=None, job_timeout=DEFAULT_JOB_TIMEOUT,
+         model_dir=DEFAULT_MODEL_DIR, detector_name="prophet", thresholds="global",
+         refit_thresholds=False):
+    # Create visualization folder
+    os.makedirs("visualizations", exist_ok=True)
+
+    data_path = find_cleaned_dataset(data_dir)
+
+    # Select at least 5 users
+    user_ids = list_users(data_path)[:5]
+
+    # Load cleaned dataset (only the columns and users analysed below).
+    # With a daily rollup next to it, read the daily means instead of the
+    # minute rows; resampling them to daily again changes nothing.
+    base_path = os.path.dirname(data_path)
+    with span("detection.load") as s:
+        if has_rollups(base_path):
+            metrics = ["heart_rate", "sleep"]
+            df = rollup_means(load_rollup(base_path, "D", user_ids, metrics=metrics), metrics)
+            df = df.rename(columns={"ds": "timestamp"})
+        else:
+            df = load_cleaned_dataset(
+                data_path, columns=["Id", "timestamp", "heart_rate", "sleep"], user_ids=user_ids
+            )
+        df["timestamp"] = df["timestamp"].dt.tz_localize(None)
+
+        # One Id-sorted index, shared by the heart rate and sleep passes
+        index = UserIndex(df)
+        s.rows = len(df)
+
+    print("Selected User IDs:", user_ids)
+
+    # ANOMALY IDENTIFICATION (RESIDUAL ANALYSIS)
+    # By default one Prophet fit per (user, metric), run in parallel, with
+    # models reused while their data is unchanged. The NumPy detectors
+    # score all users at once instead. Either way the residuals go through
+    # the threshold-based detection (2 x standard deviation) and labeling,
+    # with one standard deviation per metric or, with thresholds="user",
+    # a robust one per user kept next to the models.
+    registry = None
+    if detector_name == "prophet":
+        registry = ModelRegistry(model_dir) if model_dir else None
+        detector = None
+    else:
+        detector = get_detector(detector_name)
+    threshold_store = None
+    if thresholds == "user":
+        threshold_store = ThresholdStore(model_dir or DEFAULT_MODEL_DIR, detector_name,
+                                         refit=refit_thresholds)
+
+    with span("detection.detect", rows=len(df), detector=detector_name):
+        results, failed = detect_anomalies(
+            index, user_ids, ["heart_rate", "sleep"], workers=workers, timeout=job_timeout,
+            registry=registry, detector=detector, threshold_store=threshold_store
+        )
+    if registry is not None:
+        print(registry.summary())
+    if threshold_store is not None:
+        print(threshold_store.summary())
+
+    for job in failed:
+        print(f"Skipped user {job.user_id} ({job.metric}): {job.error}")
+
+    hr_results = results["heart_rate"]
+    sleep_results = results["sleep"]
+
+    print("Sample labeled data:")
+    print(hr_results.head())
+
+    #VISUALIZATION OF HEART RATE ANOMALIES
+    with span("detection.plot", rows=len(hr_results), metric="heart_rate"):
+        plot_anomalies(
+            hr_results,
+            "Heart Rate Time-Series with Anomalies (5 Users)", "Heart Rate",
+            "visualizations/heart_rate_anomalies.png"
+        )
+
+    # ============================================================
+    # VISUALIZATION OF SLEEP ANOMALIES
+    # ============================================================
+    with span("detection.plot", rows=len(sleep_results), metric="sleep"):
+        plot_anomalies(
+            sleep_results,
+            "Sleep Pattern Visualization with Anomalies (5 Users)", "Sleep",
+            "visualizations/sleep_anomalies.png"
+        )
+
+    print("Milestone 3 anomaly detection completed successfully.")
+    print("Screenshots saved in 'visualizations/' folder.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prophet residual anomaly detection")
+    parser.add_argument("--data-dir", default=DATA_DIR,
+                        help="folder holding the cleaned dataset")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="parallel Prophet fits (default: all cores, 1 = sequential)")
+    parser.add_argument("--job-timeout", type=int, default=DEFAULT_JOB_TIMEOUT,
+                        help="seconds allowed for one user's fit")
+    parser.add_argument("--model-dir", default=DEFAULT_MODEL_DIR,
+                        help="fitted model store, empty string to always refit")
+    parser.add_argument("--detector", choices=sorted(DETECTORS), default="prophet",
+                        help="residual baseline used for detection")
+    parser.add_argument("--thresholds", choices=["global", "user"], default="global",
+                        help="one threshold per metric, or per user (stored with the models)")
+    parser.add_argument("--refit-thresholds", action="store_true",
+                        help="refit the stored per-user thresholds on this run's residuals")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="write per-stage timings to FILE (JSON lines) and print a summary")
+    args = parser.parse_args()
+
+    if args.trace:
+        enable_tracing(args.trace)
+
+    main(args.data_dir, args.workers, args.job_timeout, args.model_dir, args.detector,
+         args.thresholds, args.refit_thresholds)
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+
+import numpy as np
+import pandas as pd
+
+from detection import label_anomalies
+from detectors import DETECTORS, get_detector
+from storage import find_cleaned_dataset, list_users, load_cleaned_dataset
+
+# Throughput of each detector and agreement of its flags with Prophet's.
+#
+# Prophet is timed on a subset of users (it is the slow one); the NumPy
+# detectors score every user. Agreement is measured on the Prophet subset,
+# with both sides thresholded on that subset alone. On synthetic data the
+# recall of the injected spikes is reported too.
+
+
+def synthetic_fleet(users, days, seed=0, spike_rate=0.03):
+    """Hourly heart rate with a weekly rhythm, trend and injected spike days."""
+    rng = np.random.default_rng(seed)
+    hours = days * 24
+    timestamps = pd.date_range("2016-04-12", periods=hours, freq="h")
+    day_index = np.arange(hours) // 24
+
+    base = rng.normal(72, 6, (users, 1))
+    weekly = rng.normal(0, 3, (users, 7))[:, day_index % 7]
+    trend = rng.normal(0, 0.05, (users, 1)) * day_index
+    noise = rng.normal(0, 4, (users, hours))
+
+    spikes = rng.random((users, days)) < spike_rate
+    spike_size = rng.choice([-1, 1], (users, days)) * rng.uniform(15, 30, (users, days))
+    heart_rate = base + weekly + trend + noise + (spikes * spike_size)[:, day_index]
+
+    ids = np.arange(users) + 1_000_000_000
+    df = pd.DataFrame({
+        "Id": np.repeat(ids, hours),
+        "timestamp": np.tile(timestamps, users),
+        "heart_rate": heart_rate.ravel(),
+    })
+    truth = pd.DataFrame({
+        "user_id": np.repeat(ids, days),
+        "ds": np.tile(pd.date_range("2016-04-12", periods=days, freq="D"), users),
+        "spike": spikes.ravel(),
+    })
+    return df, ids, truth
+
+
+def agreement(flags, reference):
+    both = flags.merge(reference, on=["user_id", "ds"], suffixes=("", "_ref"))
+    a, b = both["anomaly"], both["anomaly_ref"]
+    true_pos = (a & b).sum()
+    return {
+        "agreement": round(float((a == b).mean()), 4),
+        "precision_vs_prophet": round(float(true_pos / a.sum()), 4) if a.sum() else None,
+        "recall_vs_prophet": round(float(true_pos / b.sum()), 4) if b.sum() else None,
+    }
+
+
+def spike_recall(flags, truth):
+    both = flags.merge(truth, on=["user_id", "ds"])
+    spikes = both[both["spike"]]
+    return round(float(spikes["anomaly"].mean()), 4) if len(spikes) else None
+
+
+def run(df, user_ids, metric, prophet_users, workers, truth=None):
+    report = []
+    subset = user_ids[:prophet_users]
+
+    def subset_flags(residuals):
+        return label_anomalies(residuals[residuals["user_id"].isin(subset)].copy())
+
+    start = time.perf_counter()
+    prophet = get_detector("prophet", workers=workers).score(df, subset, metric)
+    seconds = time.perf_counter() - start
+    reference = label_anomalies(prophet.copy())[["user_id", "ds", "anomaly"]]
+    entry = {"detector": "prophet", "series": len(subset), "seconds": round(seconds, 3),
+             "series_per_s": round(len(subset) / seconds, 1)}
+    if truth is not None:
+        entry["spike_recall"] = spike_recall(reference, truth)
+    report.append(entry)
+
+    for name in DETECTORS:
+        if name == "prophet":
+            continue
+        start = time.perf_counter()
+        residuals = get_detector(name).score(df, user_ids, metric)
+        seconds = time.perf_counter() - start
+
+        flags = subset_flags(residuals)[["user_id", "ds", "anomaly"]]
+        entry = {"detector": name, "series": len(user_ids), "seconds": round(seconds, 3),
+                 "series_per_s": round(len(user_ids) / seconds, 1)}
+        entry.update(agreement(flags, reference))
+        if truth is not None:
+            entry["spike_recall"] = spike_recall(flags, truth)
+        report.append(entry)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark residual detectors against Prophet")
+    parser.add_argument("--data-dir", default=None,
+                        help="benchmark on a cleaned dataset instead of synthetic data")
+    parser.add_argument("--metric", default="heart_rate")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic users")
+    parser.add_argument("--days", type=int, default=90, help="synthetic days per user")
+    parser.add_argument("--prophet-users", type=int, default=20,
+                        help="users fitted with Prophet for the reference flags")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--json", default=None, help="also write the report to this file")
+    args = parser.parse_args()
+
+    if args.data_dir:
+        data_path = find_cleaned_dataset(args.data_dir)
+        user_ids = list_users(data_path)
+        df = load_cleaned_dataset(data_path, columns=["Id", "timestamp", args.metric])
+        df["timestamp"] = df["timestamp"].dt.tz_localize(None)
+        truth = None
+    else:
+        df, user_ids, truth = synthetic_fleet(args.users, args.days)
+
+    report = run(df, user_ids, args.metric, args.prophet_users, args.workers, truth)
+
+    print(pd.DataFrame(report).to_string(index=False))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
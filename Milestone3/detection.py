@@ -0,0 +1,242 @@
+import os
+import signal
+import time
+import traceback
+from multiprocessing import Pool, TimeoutError as PoolTimeout
+from typing import NamedTuple
+
+import pandas as pd
+
+from instrumentation import span
+from model_registry import ModelRegistry, make_model
+from user_index import UserIndex
+
+# Residual anomaly detection shared by the Milestone 3 scripts.
+#
+# Every (user, metric) series is resampled to daily means, fitted with
+# Prophet and turned into residuals. Fits are independent, so they are
+# fanned out over a process pool; the 2 * std threshold is applied once
+# all residuals are back, exactly as the sequential loops did. With a
+# ModelRegistry, unchanged series reuse their stored model.
+
+MIN_DAYS = 10
+FORECAST_DAYS = 7
+THRESHOLD_STDS = 2
+
+DEFAULT_JOB_TIMEOUT = 300
+# Extra time the parent waits beyond the job timeout before giving up on
+# a worker that died without reporting back
+RESULT_GRACE_SECONDS = 30
+
+
+class JobResult(NamedTuple):
+    user_id: int
+    metric: str
+    frame: pd.DataFrame
+    error: str
+    seconds: float
+    registry_stats: dict = None
+
+
+def daily_series(user_df, metric):
+    series = user_df[["timestamp", metric]].dropna()
+    series = series.rename(columns={"timestamp": "ds", metric: "y"})
+    return series.set_index("ds").resample("D").mean().reset_index()
+
+
+def daily_table(df, metrics):
+    """Daily means of several metrics per user, in one groupby (Id, ds, *metrics)."""
+    day = df["timestamp"].dt.floor("D").rename("ds")
+    return df.groupby([df["Id"], day])[list(metrics)].mean().reset_index()
+
+
+def series_from_daily(user_daily, metric):
+    # Same series as daily_series() on the user's minute rows
+    series = user_daily[["ds", metric]].dropna().rename(columns={metric: "y"})
+    if series.empty:
+        return series.reset_index(drop=True)
+    return series.set_index("ds").asfreq("D").reset_index()
+
+
+def prophet_residuals(series, registry=None, user_id=None, metric=None):
+    if registry is None:
+        model = make_model().fit(series)
+    else:
+        model = registry.get_or_fit(user_id, metric, series)
+
+    future = model.make_future_dataframe(periods=FORECAST_DAYS)
+    forecast = model.predict(future)
+
+    merged = series.merge(forecast[["ds", "yhat"]], on="ds", how="left")
+    merged["residual"] = merged["y"] - merged["yhat"]
+    return merged
+
+
+# -------------------------------
+# Worker side
+# -------------------------------
+class JobTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise JobTimeout()
+
+
+def run_job(job):
+    """Fit one (user, metric) series; never raises, failures are reported."""
+    user_id, metric, series, timeout, registry = job
+    start = time.perf_counter()
+
+    # Count this job's registry activity separately; the driver sums them up
+    # and evicts once the run is done
+    if registry is not None:
+        registry = ModelRegistry(registry.root, registry.max_bytes, auto_evict=False)
+    stats = registry.stats if registry is not None else None
+
+    # SIGALRM bounds the fit from inside the worker where available (POSIX)
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with span("detection.prophet_fit", rows=len(series), metric=metric):
+            merged = prophet_residuals(series, registry, user_id, metric)
+        merged["user_id"] = user_id
+        return JobResult(user_id, metric, merged, None, time.perf_counter() - start, stats)
+    except JobTimeout:
+        error = f"timed out after {timeout}s"
+    except Exception:
+        error = traceback.format_exc(limit=3)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    return JobResult(user_id, metric, None, error, time.perf_counter() - start, stats)
+
+
+# -------------------------------
+# Driver side
+# -------------------------------
+def build_jobs(df, user_ids, metrics, timeout=DEFAULT_JOB_TIMEOUT, registry=None):
+    # ``df`` may already be a UserIndex shared with other passes
+    index = df if isinstance(df, UserIndex) else UserIndex(df)
+
+    jobs = []
+    for uid in user_ids:
+        user_df = index[uid]
+        for metric in metrics:
+            series = daily_series(user_df, metric)
+            if len(series) < MIN_DAYS:
+                continue
+            jobs.append((uid, metric, series, timeout, registry))
+    return jobs
+
+
+def jobs_from_daily(daily, user_ids, metrics, timeout=DEFAULT_JOB_TIMEOUT, registry=None):
+    # Like build_jobs, from a daily_table() shared by every metric
+    index = UserIndex(daily)
+    jobs = []
+    for uid in user_ids:
+        user_daily = index[uid]
+        for metric in metrics:
+            series = series_from_daily(user_daily, metric)
+            if len(series) < MIN_DAYS:
+                continue
+            jobs.append((uid, metric, series, timeout, registry))
+    return jobs
+
+
+def run_jobs(jobs, workers=None, timeout=DEFAULT_JOB_TIMEOUT):
+    """Run fit jobs, returning one JobResult per job in submission order.
+
+    ``workers`` of 1 runs in-process; ``None`` uses every core.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        return [run_job(job) for job in jobs]
+
+    results = []
+    pool = Pool(processes=min(workers, len(jobs)))
+    try:
+        pending = [pool.apply_async(run_job, (job,)) for job in jobs]
+        wait = timeout + RESULT_GRACE_SECONDS if timeout else None
+        for job, result in zip(jobs, pending):
+            try:
+                results.append(result.get(timeout=wait))
+            except Exception as exc:
+                error = "worker lost" if isinstance(exc, PoolTimeout) else repr(exc)
+                results.append(JobResult(job[0], job[1], None, error, wait or 0.0))
+    finally:
+        # Also stops any worker still stuck in a fit
+        pool.terminate()
+        pool.join()
+    return results
+
+
+def label_anomalies(results, thresholds=None):
+    # One threshold for all users, or their own from a ThresholdTable
+    if thresholds is None:
+        threshold = THRESHOLD_STDS * results["residual"].std()
+        results["anomaly"] = abs(results["residual"]) > threshold
+    else:
+        results["anomaly"] = thresholds.flag(results)
+    results["label"] = results["anomaly"].map({True: "Anomalous", False: "Normal"})
+    return results
+
+
+def fit_residuals(df, user_ids, metrics, workers=None, timeout=DEFAULT_JOB_TIMEOUT,
+                  registry=None):
+    """Fit every (user, metric) series in parallel.
+
+    Returns ``{metric: residuals}`` with every user's residuals per metric,
+    and the list of failed JobResults. Registry counters are added to
+    ``registry.stats``.
+    """
+    jobs = build_jobs(df, user_ids, metrics, timeout, registry)
+    return collect_results(run_jobs(jobs, workers, timeout), metrics, registry)
+
+
+def collect_results(job_results, metrics, registry=None):
+    """Residuals per metric and the failed JobResults of a run_jobs() pass.
+
+    The jobs' registry counters are added to ``registry.stats`` and the
+    store is evicted once for the whole pass.
+    """
+    if registry is not None:
+        for r in job_results:
+            if r.registry_stats:
+                registry.merge_stats(r.registry_stats)
+        registry.evict()
+
+    failed = [r for r in job_results if r.error is not None]
+    residuals = {}
+    for metric in metrics:
+        frames = [r.frame for r in job_results if r.metric == metric and r.error is None]
+        if frames:
+            residuals[metric] = pd.concat(frames, ignore_index=True)
+    return residuals, failed
+
+
+def detect_anomalies(df, user_ids, metrics, workers=None, timeout=DEFAULT_JOB_TIMEOUT,
+                     registry=None, detector=None, threshold_store=None):
+    """Compute residuals for every (user, metric) and flag anomalies.
+
+    Prophet is used unless another ``detector`` from detectors.py is given.
+    ``df`` may be a DataFrame or a UserIndex. Returns ``{metric: results}``, thresholded globally per metric
+    (per user with a thresholds.ThresholdStore), and the list of failed JobResults.
+    """
+    if detector is None:
+        residuals, failed = fit_residuals(df, user_ids, metrics, workers, timeout, registry)
+    else:
+        frame = df.df if isinstance(df, UserIndex) else df
+        residuals = {metric: detector.score(frame, user_ids, metric) for metric in metrics}
+        failed = getattr(detector, "failed", [])
+
+    return {
+        metric: label_anomalies(
+            frame, threshold_store.get_or_fit(metric, frame) if threshold_store else None
+        )
+        for metric, frame in residuals.items()
+        if not frame.empty
+    }, failed
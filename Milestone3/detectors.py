@@ -0,0 +1,218 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from detection import MIN_DAYS
+
+# Pluggable residual detectors.
+#
+# Every detector produces an expected value ("yhat") per user-day; the
+# residual y - yhat is then thresholded exactly like the Prophet path
+# (|residual| > 2 * std). Prophet fits one model per series. The NumPy
+# backends instead lay all users out as one users x days matrix and
+# compute every baseline with array operations over the whole fleet.
+# Users with fewer than MIN_DAYS observed days are skipped, as in the
+# Prophet path.
+
+# Users per block in the array backends, bounds the temporary
+# (users, days, window) arrays built for rolling windows
+ROW_BLOCK = 4096
+
+RESULT_COLUMNS = ["ds", "y", "yhat", "residual", "user_id"]
+
+
+# -------------------------------
+# Users x days matrix
+# -------------------------------
+def daily_matrix(df, user_ids, metric):
+    """Daily means as a (users, days) array over one shared calendar."""
+    users_df = df[df["Id"].isin(user_ids)]
+    daily = (
+        users_df
+        .groupby(["Id", users_df["timestamp"].dt.floor("D")])[metric]
+        .mean()
+        .unstack()
+    )
+    if daily.empty:
+        return np.empty((len(user_ids), 0)), pd.DatetimeIndex([])
+    days = pd.date_range(daily.columns.min(), daily.columns.max(), freq="D")
+    daily = daily.reindex(index=list(user_ids), columns=days)
+    return daily.to_numpy(dtype="float64"), days
+
+
+def _in_span(Y):
+    # Days between a user's first and last observation, like resample("D")
+    valid = ~np.isnan(Y)
+    started = np.maximum.accumulate(valid, axis=1)
+    not_ended = np.maximum.accumulate(valid[:, ::-1], axis=1)[:, ::-1]
+    return started & not_ended
+
+
+def matrix_to_frame(Y, E, days, user_ids):
+    rows, cols = np.nonzero(_in_span(Y))
+    y = Y[rows, cols]
+    yhat = E[rows, cols]
+    return pd.DataFrame({
+        "ds": days[cols],
+        "y": y,
+        "yhat": yhat,
+        "residual": y - yhat,
+        "user_id": np.asarray(user_ids)[rows],
+    })
+
+
+def _by_row_blocks(Y, fn):
+    if len(Y) <= ROW_BLOCK:
+        return fn(Y)
+    return np.concatenate([fn(Y[i:i + ROW_BLOCK]) for i in range(0, len(Y), ROW_BLOCK)])
+
+
+def _rolling(Y, window, reducer):
+    # Centered window along the day axis, NaN-padded at both ends
+    half = window // 2
+    padded = np.pad(Y, ((0, 0), (half, window - 1 - half)), constant_values=np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return reducer(windows, axis=2)
+
+
+# -------------------------------
+# Detectors
+# -------------------------------
+class MatrixDetector:
+    """Base for detectors that score every user at once."""
+
+    name = None
+
+    def expected(self, Y):
+        raise NotImplementedError
+
+    def score(self, df, user_ids, metric):
+        Y, days = daily_matrix(df, user_ids, metric)
+        enough = (~np.isnan(Y)).sum(axis=1) >= MIN_DAYS
+        Y, user_ids = Y[enough], np.asarray(user_ids)[enough]
+        if not len(Y):
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        E = _by_row_blocks(Y, self.expected)
+        return matrix_to_frame(Y, E, days, user_ids)
+
+    def score_series(self, series, user_id=None, metric=None):
+        # One user's daily series (ds, y), e.g. from the dashboard
+        Y = series["y"].to_numpy(dtype="float64")[np.newaxis, :]
+        merged = series.copy()
+        merged["yhat"] = self.expected(Y)[0]
+        merged["residual"] = merged["y"] - merged["yhat"]
+        return merged
+
+
+class RollingMedianDetector(MatrixDetector):
+    """Centered rolling median; robust to the spikes it is meant to find."""
+
+    name = "rolling_median"
+
+    def __init__(self, window=7):
+        self.window = window
+
+    def expected(self, Y):
+        return _rolling(Y, self.window, np.nanmedian)
+
+
+class SeasonalDetector(MatrixDetector):
+    """STL-style decomposition: rolling-median trend plus a weekly profile."""
+
+    name = "seasonal"
+
+    def __init__(self, period=7, trend_window=15):
+        self.period = period
+        self.trend_window = trend_window
+
+    def expected(self, Y):
+        trend = _rolling(Y, self.trend_window, np.nanmedian)
+        detrended = Y - trend
+
+        # Mean detrended value per phase of the period (day of week)
+        n_days = Y.shape[1]
+        padded_days = -(-n_days // self.period) * self.period
+        padded = np.pad(detrended, ((0, 0), (0, padded_days - n_days)), constant_values=np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            profile = np.nanmean(padded.reshape(len(Y), -1, self.period), axis=1)
+            profile -= np.nanmean(profile, axis=1, keepdims=True)
+        profile = np.nan_to_num(profile)
+
+        seasonal = np.tile(profile, (1, padded_days // self.period))[:, :n_days]
+        return trend + seasonal
+
+
+class EwmaDetector(MatrixDetector):
+    """One-step-ahead exponentially weighted moving average."""
+
+    name = "ewma"
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+
+    def expected(self, Y):
+        # Sequential over days, vectorized over users
+        E = np.empty_like(Y)
+        level = Y[:, 0].copy()
+        E[:, 0] = level
+        for t in range(1, Y.shape[1]):
+            E[:, t] = level
+            y = Y[:, t]
+            updated = np.where(np.isnan(y), level, self.alpha * y + (1 - self.alpha) * level)
+            level = np.where(np.isnan(level), y, updated)
+        return E
+
+
+class ProphetDetector:
+    """One Prophet fit per user, run on the process pool of detection.py."""
+
+    name = "prophet"
+
+    def __init__(self, workers=None, timeout=None, registry=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.registry = registry
+        self.failed = []
+        self._index = None
+
+    def score(self, df, user_ids, metric):
+        from detection import DEFAULT_JOB_TIMEOUT, fit_residuals
+        from user_index import UserIndex
+
+        # Build the per-user index once and reuse it for every metric
+        if self._index is None or self._index.df is not df:
+            self._index = UserIndex(df)
+        df = self._index
+
+        residuals, failed = fit_residuals(
+            df, user_ids, [metric], self.workers, self.timeout or DEFAULT_JOB_TIMEOUT,
+            self.registry
+        )
+        self.failed.extend(failed)
+        if metric not in residuals:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        return residuals[metric]
+
+    def score_series(self, series, user_id=None, metric=None):
+        from detection import prophet_residuals
+        return prophet_residuals(series, self.registry, user_id, metric)
+
+
+DETECTORS = {
+    ProphetDetector.name: ProphetDetector,
+    RollingMedianDetector.name: RollingMedianDetector,
+    SeasonalDetector.name: SeasonalDetector,
+    EwmaDetector.name: EwmaDetector,
+}
+
+
+def get_detector(name, **kwargs):
+    try:
+        detector_cls = DETECTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown detector '{name}', choose from {sorted(DETECTORS)}")
+    return detector_cls(**kwargs)
@@ -0,0 +1,144 @@
+import numpy as np
+
+# Bounded-size series for plotting.
+#
+# A month of one user's minute rows is ~43k points, and a browser chart
+# (or a matplotlib figure with several users) slows to a crawl on a few
+# hundred thousand. Plots get at most MAX_POINTS points instead:
+#
+# - minmax_indices(): the lowest and highest point of equal-count buckets,
+#   fully vectorized; spikes survive, which is what an anomaly plot needs.
+# - lttb_indices(): Largest-Triangle-Three-Buckets, the point per bucket
+#   that best keeps the visual shape of the line.
+# - SeriesPyramid: min-max levels, each ~PYRAMID_FACTOR times smaller than
+#   the one below, computed once. A zoomed window is served from the
+#   finest level that fits MAX_POINTS in it, so zooming in brings back
+#   detail while the payload stays bounded.
+#
+# Rows flagged as anomalies are always plotted, whatever the level.
+
+MAX_POINTS = 5000
+PYRAMID_FACTOR = 4
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype("datetime64[ns]").view("int64").astype("float64")
+    return x.astype("float64")
+
+
+def minmax_indices(y, n_buckets):
+    """Sorted indices of the min and max of ``y`` in ``n_buckets`` equal-count buckets."""
+    y = _as_float(y)
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    size = -(-n // n_buckets)
+    n_buckets = -(-n // size)
+    pad = n_buckets * size - n
+    # NaN never wins; a bucket of NaN only gives its first index
+    low = np.pad(np.where(np.isnan(y), np.inf, y), (0, pad), constant_values=np.inf)
+    high = np.pad(np.where(np.isnan(y), -np.inf, y), (0, pad), constant_values=-np.inf)
+    offsets = np.arange(n_buckets) * size
+    indices = np.concatenate([
+        offsets + low.reshape(n_buckets, size).argmin(axis=1),
+        offsets + high.reshape(n_buckets, size).argmax(axis=1),
+    ])
+    return np.unique(np.minimum(indices, n - 1))
+
+
+def lttb_indices(x, y, n_out):
+    """Sorted indices of the ``n_out`` points Largest-Triangle-Three-Buckets keeps."""
+    x, y = _as_float(x), _as_float(y)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # First and last point fixed; n_out - 2 buckets in between
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Average point of every bucket (the third corner of the triangles)
+    counts = np.diff(np.r_[edges, n])
+    valid = ~np.isnan(y)
+    mean_x = np.add.reduceat(x, edges) / counts
+    y_counts = np.add.reduceat(valid, edges)
+    mean_y = np.add.reduceat(np.where(valid, y, 0.0), edges) / np.maximum(y_counts, 1)
+    mean_x[-1], mean_y[-1] = x[-1], y[-1]
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        cx, cy = mean_x[i + 1], mean_y[i + 1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        area = np.where(np.isnan(area), -1.0, area)
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _thin_anomalies(positions, y, max_points):
+    # Anomalies get up to half the budget on top of the line; beyond that
+    # the extremes of each stretch of them are kept
+    if len(positions) <= max_points // 2:
+        return positions
+    return positions[minmax_indices(y[positions], max_points // 4)]
+
+
+def downsample(frame, max_points=MAX_POINTS, x="ds", y="y", keep="anomaly", method="lttb"):
+    """At most ~``max_points`` rows of a sorted series, always keeping rows flagged ``keep``."""
+    if len(frame) <= max_points:
+        return frame
+    if method == "lttb":
+        indices = lttb_indices(frame[x].to_numpy(), frame[y].to_numpy(), max_points)
+    else:
+        indices = minmax_indices(frame[y].to_numpy(), max_points // 2)
+    if keep in frame:
+        kept = np.flatnonzero(frame[keep].to_numpy(dtype=bool))
+        indices = np.union1d(indices, _thin_anomalies(kept, frame[y].to_numpy(), max_points))
+    return frame.iloc[indices]
+
+
+class SeriesPyramid:
+    """Min-max levels of a sorted series, queried per zoom window."""
+
+    def __init__(self, frame, x="ds", y="y", keep="anomaly", max_points=MAX_POINTS,
+                 factor=PYRAMID_FACTOR):
+        frame = frame.reset_index(drop=True)
+        self.max_points = max_points
+        self.levels = [frame]
+        while len(self.levels[-1]) > max_points:
+            level = self.levels[-1]
+            buckets = max(len(level) // (2 * factor), max_points // 2)
+            self.levels.append(level.iloc[minmax_indices(level[y].to_numpy(), buckets)])
+        self._x = [level[x].to_numpy() for level in self.levels]
+        self._y = frame[y].to_numpy()
+        if keep in frame:
+            self._anomalies = np.flatnonzero(frame[keep].to_numpy(dtype=bool))
+        else:
+            self._anomalies = np.array([], dtype=int)
+
+    @property
+    def rows(self):
+        return len(self.levels[0])
+
+    @property
+    def bounds(self):
+        values = self._x[0]
+        return (values[0], values[-1]) if len(values) else (None, None)
+
+    def query(self, start=None, end=None):
+        """Rows in [start, end] from the finest level with at most max_points there, plus the anomalies."""
+        for level, values in zip(self.levels, self._x):
+            lo = 0 if start is None else np.searchsorted(values, start, "left")
+            hi = len(values) if end is None else np.searchsorted(values, end, "right")
+            if hi - lo <= self.max_points:
+                break
+        rows = level.iloc[lo:hi]
+
+        values = self._x[0][self._anomalies]
+        lo = 0 if start is None else np.searchsorted(values, start, "left")
+        hi = len(values) if end is None else np.searchsorted(values, end, "right")
+        anomalies = _thin_anomalies(self._anomalies[lo:hi], self._y, self.max_points)
+        # Levels keep the base frame's positions as index labels
+        return self.levels[0].iloc[np.union1d(rows.index, anomalies)]
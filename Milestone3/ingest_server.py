@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+
+import numpy as np
+import pandas as pd
+
+from incremental import ingest_frames, load_state, save_state
+from streaming import OnlineDetector
+
+# Long-running ingestion service in front of the pipeline.
+#
+# Devices POST batches of minute readings as JSON to /readings. Requests
+# are validated against the cleaned dataset schema and queued; a batcher
+# drains the queue into micro-batches (by row count or age), scores every
+# reading with the online detector and hands the batch to a single writer
+# that ingests it into the Parquet store (incremental.py, watermarks and
+# late data included). Both queues are bounded: when the writer falls
+# behind, the batcher blocks, the request queue fills up, and requests
+# wait up to ``put_timeout`` before being refused with 503.
+#
+#   GET /metrics   queue depths, counters and per-stage latencies
+#   GET /alerts    the most recent Anomalous readings
+
+SCHEMA = {"Id": int, "timestamp": str, "heart_rate": float, "steps": float, "sleep": float}
+REQUIRED = ("Id", "timestamp")
+# Ids are stored as int64
+INT64_MIN, INT64_MAX = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+
+DEFAULT_PORT = 8765
+DEFAULT_BATCH_ROWS = 5000
+DEFAULT_MAX_DELAY = 1.0
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_PUT_TIMEOUT = 5.0
+MAX_BODY_BYTES = 16 * 1024 * 1024
+RECENT_ALERTS = 1000
+LATENCY_SAMPLES = 2048
+
+
+class ValidationError(Exception):
+    pass
+
+
+def validate(records):
+    """Check a list of reading dicts and return it as a typed frame."""
+    if not isinstance(records, list) or not records:
+        raise ValidationError("expected a non-empty JSON list of readings")
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise ValidationError(f"reading {i}: expected an object")
+        unknown = set(record) - set(SCHEMA)
+        if unknown:
+            raise ValidationError(f"reading {i}: unknown fields {sorted(unknown)}")
+        for field in REQUIRED:
+            if record.get(field) is None:
+                raise ValidationError(f"reading {i}: missing {field}")
+        if not isinstance(record["Id"], int) or isinstance(record["Id"], bool):
+            raise ValidationError(f"reading {i}: Id must be an integer")
+        if not INT64_MIN <= record["Id"] <= INT64_MAX:
+            raise ValidationError(f"reading {i}: Id is out of the 64-bit integer range")
+        for field in ("heart_rate", "steps", "sleep"):
+            value = record.get(field)
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+                raise ValidationError(f"reading {i}: {field} must be a number or null")
+
+    frame = pd.DataFrame.from_records(records, columns=list(SCHEMA))
+    frame["Id"] = frame["Id"].astype("int64")
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], utc=True, errors="coerce", format="ISO8601")
+    bad = frame["timestamp"].isna()
+    if bad.any():
+        raise ValidationError(f"reading {int(np.flatnonzero(bad)[0])}: timestamp is not ISO 8601")
+    frame[["heart_rate", "steps", "sleep"]] = frame[["heart_rate", "steps", "sleep"]].astype("float64")
+    return frame
+
+
+class StageLatency:
+    """Count and recent latency samples (seconds) of one pipeline stage."""
+
+    def __init__(self):
+        self.count = 0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, seconds):
+        self.count += 1
+        self.samples.append(seconds)
+
+    def summary(self):
+        if not self.samples:
+            return {"count": self.count}
+        ms = np.array(self.samples) * 1000
+        return {
+            "count": self.count,
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "max_ms": round(float(ms.max()), 3),
+        }
+
+
+class IngestPipeline:
+    """Bounded request queue -> batcher/detector -> bounded writer queue."""
+
+    def __init__(self, base_path, batch_rows=DEFAULT_BATCH_ROWS, max_delay=DEFAULT_MAX_DELAY,
+                 queue_size=DEFAULT_QUEUE_SIZE, put_timeout=DEFAULT_PUT_TIMEOUT, detector=None):
+        self.base_path = base_path
+        self.batch_rows = batch_rows
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.detector = detector or OnlineDetector()
+        self.requests = asyncio.Queue(maxsize=queue_size)
+        self.batches = asyncio.Queue(maxsize=2)
+        self.alerts = deque(maxlen=RECENT_ALERTS)
+        self.stages = {name: StageLatency() for name in ("validate", "queue_wait", "detect", "write")}
+        self.counters = {"requests": 0, "rejected": 0, "refused": 0, "rows": 0, "rows_written": 0,
+                         "batches": 0, "write_errors": 0}
+        self._tasks = []
+        self._state = None
+
+    async def start(self):
+        # Watermarks are loaded once and kept in memory by the single writer
+        self._state = await asyncio.to_thread(load_state, self.base_path)
+        self._tasks = [asyncio.create_task(self._batcher()), asyncio.create_task(self._writer())]
+
+    async def stop(self):
+        # Flush what was accepted: everything queued is batched and written
+        await self.requests.put(None)
+        await self._tasks[0]
+        await self.batches.put(None)
+        await self._tasks[1]
+
+    async def submit(self, records):
+        """Validate and enqueue one request. Returns (HTTP status, body)."""
+        self.counters["requests"] += 1
+        start = time.perf_counter()
+        try:
+            frame = validate(records)
+        except ValidationError as exc:
+            self.counters["rejected"] += 1
+            return 422, {"error": str(exc)}
+        self.stages["validate"].add(time.perf_counter() - start)
+
+        try:
+            await asyncio.wait_for(self.requests.put((time.perf_counter(), frame)), self.put_timeout)
+        except asyncio.TimeoutError:
+            self.counters["refused"] += 1
+            return 503, {"error": "ingestion queue full, retry later"}
+        self.counters["rows"] += len(frame)
+        return 202, {"accepted": len(frame)}
+
+    async def _batcher(self):
+        frames, rows, deadline = [], 0, None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(self.requests.get(), timeout)
+            except asyncio.TimeoutError:
+                item = False
+            if item:
+                enqueued, frame = item
+                self.stages["queue_wait"].add(time.perf_counter() - enqueued)
+                frames.append(frame)
+                rows += len(frame)
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_delay
+            if frames and (item is None or item is False or rows >= self.batch_rows):
+                batch = pd.concat(frames, ignore_index=True)
+                frames, rows, deadline = [], 0, None
+                self._detect(batch)
+                # Blocks while the writer is busy with two batches already
+                await self.batches.put(batch)
+            if item is None:
+                return
+
+    def _detect(self, batch):
+        start = time.perf_counter()
+        batch = batch.sort_values("timestamp", kind="stable")
+        columns = [batch["Id"].tolist(), batch["timestamp"].astype(str).tolist()]
+        columns += [batch[m].tolist() for m in self.detector.metrics]
+        for event in self.detector.process(zip(*columns), anomalies_only=True):
+            self.alerts.append(event._asdict())
+        self.stages["detect"].add(time.perf_counter() - start)
+
+    async def _writer(self):
+        while True:
+            batch = await self.batches.get()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write, batch)
+                self.counters["rows_written"] += len(batch)
+            except Exception as exc:
+                self.counters["write_errors"] += 1
+                print(f"write failed: {exc!r}", file=sys.stderr)
+            self.counters["batches"] += 1
+            self.stages["write"].add(time.perf_counter() - start)
+
+    def _write(self, batch):
+        hr = batch.loc[batch["heart_rate"].notna(), ["Id", "timestamp", "heart_rate"]]
+        steps = batch.loc[batch["steps"].notna(), ["Id", "timestamp", "steps"]]
+        sleep = batch.loc[batch["sleep"].notna(), ["Id", "timestamp", "sleep"]]
+        # Sleep is a daily total; keyed by day like sleep logs
+        sleep = sleep.assign(timestamp=sleep["timestamp"].dt.floor("D"))
+        ingest_frames(self.base_path, hr, steps, sleep, state=self._state)
+        save_state(self.base_path, self._state)
+
+    def metrics(self):
+        return {
+            "queues": {"requests": self.requests.qsize(), "batches": self.batches.qsize()},
+            "counters": dict(self.counters),
+            "detector": dict(self.detector.stats),
+            "stages": {name: stage.summary() for name, stage in self.stages.items()},
+        }
+
+
+# -------------------------------
+# HTTP front end
+# -------------------------------
+STATUS_TEXT = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+               413: "Payload Too Large", 422: "Unprocessable Entity", 503: "Service Unavailable"}
+
+
+async def _respond(writer, status, body):
+    payload = json.dumps(body).encode()
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n")
+    if status == 503:
+        head += "Retry-After: 1\r\n"
+    writer.write(head.encode() + b"\r\n" + payload)
+    await writer.drain()
+
+
+async def _handle(pipeline, reader, writer):
+    # One connection, any number of keep-alive requests
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode().split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                await _respond(writer, 413, {"error": f"body over {MAX_BODY_BYTES} bytes"})
+                return
+            body = await reader.readexactly(length) if length else b""
+
+            if method == "POST" and path == "/readings":
+                try:
+                    records = json.loads(body)
+                except ValueError:
+                    await _respond(writer, 400, {"error": "body is not valid JSON"})
+                    continue
+                status, response = await pipeline.submit(records)
+                await _respond(writer, status, response)
+            elif method == "GET" and path == "/metrics":
+                await _respond(writer, 200, pipeline.metrics())
+            elif method == "GET" and path == "/alerts":
+                await _respond(writer, 200, list(pipeline.alerts))
+            else:
+                await _respond(writer, 404, {"error": f"no route {method} {path}"})
+
+            if headers.get("connection", "").lower() == "close":
+                return
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        return
+    finally:
+        writer.close()
+
+
+async def serve(base_path, host="127.0.0.1", port=DEFAULT_PORT, ready=None, **pipeline_kwargs):
+    pipeline = IngestPipeline(base_path, **pipeline_kwargs)
+    await pipeline.start()
+    server = await asyncio.start_server(lambda r, w: _handle(pipeline, r, w), host, port)
+    print(f"Ingesting into {base_path} on http://{host}:{port}/readings", flush=True)
+    if ready is not None:
+        ready.set()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await pipeline.stop()
+
+
+# -------------------------------
+# Client (tests and device simulators)
+# -------------------------------
+def post_readings(records, host="127.0.0.1", port=DEFAULT_PORT, connection=None):
+    """POST a batch of readings; returns (status, parsed JSON body)."""
+    import http.client
+
+    conn = connection or http.client.HTTPConnection(host, port)
+    conn.request("POST", "/readings", json.dumps(records), {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    body = json.loads(response.read())
+    if connection is None:
+        conn.close()
+    return response.status, body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Async ingestion server for device readings")
+    parser.add_argument("--base-path", required=True,
+                        help="directory of the cleaned_dataset.parquet store")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS)
+    parser.add_argument("--max-delay", type=float, default=DEFAULT_MAX_DELAY,
+                        help="seconds before a partial micro-batch is flushed")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="requests waiting for the batcher before producers block")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.base_path, args.host, args.port, batch_rows=args.batch_rows,
+                          max_delay=args.max_delay, queue_size=args.queue_size))
+    except KeyboardInterrupt:
+        pass
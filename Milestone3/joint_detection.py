@@ -0,0 +1,493 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+
+import numpy as np
+import pandas as pd
+
+from detection import THRESHOLD_STDS, daily_table
+from instrumentation import enable as enable_tracing, span
+from preprocess import user_codes
+from rollups import has_rollups, load_rollup, rollup_means
+from storage import METRIC_COLUMNS, find_cleaned_dataset, list_users, load_cleaned_dataset
+
+# Joint anomaly scoring of the aligned (heart_rate, steps, sleep) rows.
+#
+# The per-metric paths threshold every metric against its own baseline,
+# so the heart rate of a run is as anomalous as the same heart rate at
+# rest. Here every row is scored against the rows of the same user *in the
+# same activity state*: no steps, or one of the fleet's step quartiles.
+# All statistics come from np.bincount over (user, state) group codes,
+# so a whole fleet at minute or day resolution is scored in one
+# vectorized pass, with no per-user loop:
+#
+# - activity: z score of heart rate against the (user, state) mean and
+#   std, i.e. an activity-conditioned heart rate baseline.
+# - mahalanobis: squared Mahalanobis distance of (heart_rate, steps,
+#   sleep) from the (user, state) mean under its covariance, so a high
+#   heart rate after a short night counts for less than at rest after a
+#   normal one.
+# - isolation_forest: scikit-learn's IsolationForest over the columns
+#   standardized per (user, state); fitted on a sample of the rows and
+#   much slower than the others.
+#
+# Means and covariances are refitted once without the rows flagged by the
+# first fit, so the anomalies do not widen their own baseline; the sums
+# behind them are kept, so the refit only touches the dropped rows. (user,
+# state) groups with too few rows borrow the fleet's offset and spread for
+# that state around the user's own mean.
+
+RESOLUTIONS = ("minute", "day")
+# Quartiles of the positive step counts split moving rows into 4 states
+STEP_QUANTILES = (0.25, 0.5, 0.75)
+# Rows a (user, state) group needs for its own mean and covariance
+MIN_GROUP_ROWS = 30
+# Upper 0.1% of the chi-square distribution by degrees of freedom
+# (= number of scored columns); 10.83 is |z| > 3.29 for heart rate alone
+CHI2_999 = {1: 10.83, 2: 13.82, 3: 16.27}
+RIDGE = 1e-3
+MIN_VARIANCE = 1e-6
+
+FOREST_SAMPLE_ROWS = 200_000
+# Share of the rows flagged; deeper trees than scikit-learn's default of
+# 256 samples per tree separate a raised heart rate from the spread of the
+# steps and sleep columns far better
+FOREST_CONTAMINATION = 0.005
+FOREST_MAX_SAMPLES = 2048
+# Rows scored per IsolationForest call, bounds its temporaries
+SCORE_BLOCK = 1_000_000
+SEED = 42
+
+OUTPUT_COLUMNS = ["Id", "heart_rate", "steps", "sleep", "expected_heart_rate", "score",
+                  "anomaly", "label"]
+
+
+# -------------------------------
+# Grouped statistics
+# -------------------------------
+def _fill_by_user(values, codes, n_users):
+    # Missing values (e.g. days without a sleep log) get the user's mean
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+    present = ~missing
+    sums = np.bincount(codes[present], values[present], n_users)
+    counts = np.bincount(codes[present], minlength=n_users)
+    means = np.divide(sums, counts, out=np.zeros(n_users), where=counts > 0)
+    return np.where(missing, means[codes], values)
+
+
+def activity_states(steps, edges=None):
+    """0 for rows without steps, 1-4 for the quartiles of the positive step counts."""
+    steps = np.nan_to_num(np.asarray(steps, dtype="float64"))
+    if edges is None:
+        moving = steps[steps > 0]
+        edges = np.quantile(moving, STEP_QUANTILES) if len(moving) else np.zeros(len(STEP_QUANTILES))
+    states = np.searchsorted(edges, steps, side="right") + 1
+    states[steps <= 0] = 0
+    return states, edges
+
+
+def group_sums(X, groups, n_groups, rows=None):
+    """Row count, column sums and cross-product sums of ``X`` per group."""
+    if rows is not None:
+        X, groups = X[rows], groups[rows]
+    n = np.bincount(groups, minlength=n_groups).astype("float64")
+    k = X.shape[1]
+    sums = np.stack([np.bincount(groups, X[:, j], n_groups) for j in range(k)], axis=1)
+    cross = np.empty((n_groups, k, k))
+    for i in range(k):
+        for j in range(i, k):
+            cross[:, i, j] = cross[:, j, i] = np.bincount(groups, X[:, i] * X[:, j], n_groups)
+    return n, sums, cross
+
+
+def _mean_cov(n, sums, cross):
+    mean = sums / np.maximum(n, 1)[:, None]
+    scatter = cross - n[:, None, None] * mean[:, :, None] * mean[:, None, :]
+    return mean, scatter / np.maximum(n - 1, 1)[:, None, None]
+
+
+def _state_fallback(n, mean, cov, n_users, n_states):
+    # Per user mean, and per state the fleet's mean offset from it and the
+    # spread around that offset, all from the (user, state) moments
+    k = mean.shape[1]
+    n = n.reshape(n_users, n_states)
+    mean = mean.reshape(n_users, n_states, k)
+    cov = cov.reshape(n_users, n_states, k, k)
+
+    user_mean = (n[..., None] * mean).sum(axis=1) / np.maximum(n.sum(axis=1), 1)[:, None]
+    offset = mean - user_mean[:, None, :]
+    n_state = n.sum(axis=0)
+    state_offset = (n[..., None] * offset).sum(axis=0) / np.maximum(n_state, 1)[:, None]
+    deviation = offset - state_offset
+    scatter = (np.maximum(n - 1, 0)[..., None, None] * cov
+               + n[..., None, None] * deviation[..., :, None] * deviation[..., None, :]).sum(axis=0)
+    state_cov = scatter / np.maximum(n_state - 1, 1)[:, None, None]
+    return user_mean, state_offset, state_cov
+
+
+def _precision(cov):
+    # Inverse of the ridge-regularized covariances, one per group
+    k = cov.shape[-1]
+    diagonal = np.diagonal(cov, axis1=1, axis2=2)
+    regularized = cov + np.eye(k) * np.maximum(RIDGE * diagonal, MIN_VARIANCE)[:, None, :]
+    return np.linalg.inv(regularized)
+
+
+def _squared_distance(X, mean, P, groups):
+    # sum_ij D_i D_j P_ij, one (rows,) temporary per pair instead of (rows, k, k)
+    D = X - mean[groups]
+    k = D.shape[1]
+    d2 = np.zeros(len(D))
+    for i in range(k):
+        d2 += D[:, i] ** 2 * P[:, i, i][groups]
+        for j in range(i + 1, k):
+            d2 += 2 * D[:, i] * D[:, j] * P[:, i, j][groups]
+    return d2
+
+
+class GroupModel:
+    """Mean and covariance of the columns per (user, activity state) group."""
+
+    def __init__(self, X, codes, n_users, states, min_group_rows=MIN_GROUP_ROWS):
+        self.n_users = n_users
+        self.n_states = len(STEP_QUANTILES) + 2
+        self.min_group_rows = min_group_rows
+        self.X = X
+        self.groups = codes * self.n_states + states
+        # Raw sums, so dropping rows later only touches those rows
+        self.n, self.sums, self.cross = group_sums(X, self.groups, n_users * self.n_states)
+        self._update()
+
+    def _update(self):
+        mean, cov = _mean_cov(self.n, self.sums, self.cross)
+        # Sparse groups: the user's mean plus the fleet's offset for the state
+        sparse = self.n < self.min_group_rows
+        if sparse.any():
+            user_mean, state_offset, state_cov = _state_fallback(
+                self.n, mean, cov, self.n_users, self.n_states)
+            group_user, group_state = np.divmod(np.flatnonzero(sparse), self.n_states)
+            mean[sparse] = user_mean[group_user] + state_offset[group_state]
+            cov[sparse] = state_cov[group_state]
+        self.mean, self.cov = mean, cov
+        self.precision = _precision(cov)
+
+    def drop(self, rows):
+        """Refit without ``rows`` (a boolean mask)."""
+        n, sums, cross = group_sums(self.X, self.groups, len(self.n), rows)
+        self.n, self.sums, self.cross = self.n - n, self.sums - sums, self.cross - cross
+        self._update()
+
+    def squared_distance(self):
+        return _squared_distance(self.X, self.mean, self.precision, self.groups)
+
+    def expected(self, column=0):
+        return self.mean[self.groups, column]
+
+    def standardized(self):
+        std = np.sqrt(np.maximum(np.diagonal(self.cov, axis1=1, axis2=2), MIN_VARIANCE))
+        return (self.X - self.mean[self.groups]) / std[self.groups]
+
+
+# -------------------------------
+# Detectors
+# -------------------------------
+class JointDetector:
+    """Base for detectors scoring the merged metric rows of a whole fleet."""
+
+    name = None
+
+    def scores(self, X, codes, n_users, states):
+        """Score (larger = more anomalous), anomaly flags and expected heart rate per row."""
+        raise NotImplementedError
+
+    def score(self, df, time_column="timestamp"):
+        """Score every row of ``df`` (Id, time, heart_rate, steps, sleep)."""
+        ids, codes = user_codes(df["Id"])
+        n_users = len(ids)
+        X = np.column_stack([df[m].to_numpy(dtype="float64") for m in METRIC_COLUMNS])
+        X[:, 1] = np.nan_to_num(X[:, 1])
+        X[:, 2] = _fill_by_user(X[:, 2], codes, n_users)
+        states, _ = activity_states(X[:, 1])
+
+        # Rows without heart rate are carried through unscored
+        scored = ~np.isnan(X[:, 0])
+        if scored.all():
+            score, anomaly, expected = self.scores(X, codes, n_users, states)
+        else:
+            score = np.full(len(df), np.nan)
+            anomaly = np.zeros(len(df), dtype=bool)
+            expected = np.full(len(df), np.nan)
+            if scored.any():
+                s, a, e = self.scores(X[scored], codes[scored], n_users, states[scored])
+                score[scored], anomaly[scored], expected[scored] = s, a, e
+
+        return pd.DataFrame({
+            "Id": df["Id"].to_numpy(),
+            time_column: df[time_column].to_numpy(),
+            **{m: X[:, j] for j, m in enumerate(METRIC_COLUMNS)},
+            "expected_heart_rate": expected,
+            "score": score,
+            "anomaly": anomaly,
+            "label": pd.Categorical.from_codes(anomaly.astype("int8"), ["Normal", "Anomalous"]),
+        })
+
+
+class MahalanobisDetector(JointDetector):
+    """Squared Mahalanobis distance from the (user, activity state) mean."""
+
+    name = "mahalanobis"
+    columns = METRIC_COLUMNS
+
+    def __init__(self, threshold=None, min_group_rows=MIN_GROUP_ROWS):
+        self.threshold = threshold if threshold is not None else CHI2_999[len(self.columns)]
+        self.min_group_rows = min_group_rows
+
+    def scores(self, X, codes, n_users, states):
+        if len(self.columns) < X.shape[1]:
+            X = X[:, [METRIC_COLUMNS.index(c) for c in self.columns]]
+        model = GroupModel(X, codes, n_users, states, self.min_group_rows)
+        # Refit without the rows the first fit flags
+        model.drop(model.squared_distance() > self.threshold)
+        d2 = model.squared_distance()
+        return d2, d2 > self.threshold, model.expected()
+
+
+class ActivityBaselineDetector(MahalanobisDetector):
+    """Heart rate against the user's own heart rate at the same activity level."""
+
+    name = "activity"
+    columns = ["heart_rate"]
+
+    def scores(self, X, codes, n_users, states):
+        d2, anomaly, expected = super().scores(X, codes, n_users, states)
+        # Signed z score: negative below the baseline
+        return np.copysign(np.sqrt(d2), X[:, 0] - expected), anomaly, expected
+
+
+class IsolationForestDetector(JointDetector):
+    """IsolationForest over the columns standardized per (user, activity state)."""
+
+    name = "isolation_forest"
+
+    def __init__(self, contamination=FOREST_CONTAMINATION, sample_rows=FOREST_SAMPLE_ROWS,
+                 n_estimators=100, max_samples=FOREST_MAX_SAMPLES):
+        self.contamination = contamination
+        self.max_samples = max_samples
+        self.sample_rows = sample_rows
+        self.n_estimators = n_estimators
+
+    def scores(self, X, codes, n_users, states):
+        # scikit-learn is only needed by this detector
+        from sklearn.ensemble import IsolationForest
+
+        model = GroupModel(X, codes, n_users, states)
+        model.drop(model.squared_distance() > CHI2_999[X.shape[1]])
+        Z = model.standardized()
+
+        rng = np.random.default_rng(SEED)
+        sample = rng.choice(len(Z), min(self.sample_rows, len(Z)), replace=False)
+        forest = IsolationForest(n_estimators=self.n_estimators, contamination=self.contamination,
+                                 max_samples=min(self.max_samples, len(sample)),
+                                 random_state=SEED, n_jobs=-1).fit(Z[sample])
+        score = np.concatenate([-forest.decision_function(Z[i:i + SCORE_BLOCK])
+                                for i in range(0, len(Z), SCORE_BLOCK)])
+        return score, score > 0, model.expected()
+
+
+JOINT_DETECTORS = {
+    ActivityBaselineDetector.name: ActivityBaselineDetector,
+    MahalanobisDetector.name: MahalanobisDetector,
+    IsolationForestDetector.name: IsolationForestDetector,
+}
+
+
+def get_joint_detector(name, **kwargs):
+    try:
+        detector_cls = JOINT_DETECTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown joint detector '{name}', choose from {sorted(JOINT_DETECTORS)}")
+    return detector_cls(**kwargs)
+
+
+def per_metric_flags(df, stds=THRESHOLD_STDS):
+    """The per-metric rule for comparison: any metric > stds * std off the user's mean."""
+    _, codes = user_codes(df["Id"])
+    flags = np.zeros(len(df), dtype=bool)
+    for metric in METRIC_COLUMNS:
+        values = df[metric].to_numpy(dtype="float64")
+        present = ~np.isnan(values)
+        means = np.bincount(codes[present], values[present]) / np.bincount(codes[present])
+        residual = values - means[codes]
+        flags |= np.abs(residual) > stds * np.nanstd(residual)
+    return flags
+
+
+# -------------------------------
+# Cleaned dataset
+# -------------------------------
+def load_rows(data_path, resolution="minute", user_ids=None):
+    """Minute rows of the cleaned dataset, or one row per user-day."""
+    columns = ["Id", "timestamp"] + METRIC_COLUMNS
+    base_path = os.path.dirname(data_path)
+    if resolution == "day" and has_rollups(base_path):
+        daily = rollup_means(load_rollup(base_path, "D", user_ids))
+        daily["ds"] = daily["ds"].dt.tz_localize(None)
+        return daily
+    df = load_cleaned_dataset(data_path, columns=columns, user_ids=user_ids)
+    df["timestamp"] = df["timestamp"].dt.tz_localize(None)
+    if resolution == "day":
+        return daily_table(df, METRIC_COLUMNS)
+    return df
+
+
+def score_dataset(data_path, method="activity", resolution="minute", user_ids=None):
+    time_column = "timestamp" if resolution == "minute" else "ds"
+    with span("joint.load") as s:
+        df = load_rows(data_path, resolution, user_ids)
+        s.rows = len(df)
+
+    detector = get_joint_detector(method)
+    start = time.perf_counter()
+    with span("joint.score", rows=len(df), method=method):
+        results = detector.score(df, time_column)
+    seconds = time.perf_counter() - start
+
+    report = {
+        "method": method,
+        "resolution": resolution,
+        "users": int(results["Id"].nunique()),
+        "rows": len(results),
+        "anomalies": int(results["anomaly"].sum()),
+        "per_metric_anomalies": int(per_metric_flags(df).sum()),
+        "score_seconds": round(seconds, 3),
+        "rows_per_s": round(len(results) / seconds) if seconds else None,
+    }
+    return results[[time_column] + OUTPUT_COLUMNS], report
+
+
+# -------------------------------
+# Synthetic benchmark
+# -------------------------------
+def synthetic_rows(users, days, seed=0, episode_rate=0.5):
+    """Minute rows where heart rate follows steps and sleep, with resting-HR episodes.
+
+    Every day has walks and one workout; on average ``episode_rate``
+    times a day a user gets a 10-minute resting heart rate raised by
+    25-40 bpm. Returns the rows and the truth mask of those minutes.
+    """
+    rng = np.random.default_rng(seed)
+    minutes = days * 24 * 60
+    n = users * minutes
+    minute_of_day = np.tile(np.arange(minutes) % 1440, users)
+    day = np.tile(np.arange(minutes) // 1440, users)
+    user = np.repeat(np.arange(users), minutes)
+
+    steps = np.zeros(n)
+    awake = (minute_of_day >= 7 * 60) & (minute_of_day < 23 * 60)
+    walking = awake & (rng.random(n) < 0.15)
+    steps[walking] = rng.uniform(10, 60, walking.sum())
+    # One 45-minute workout a day at a per-user hour
+    workout_start = rng.integers(8 * 60, 20 * 60, users)[user]
+    workout = (minute_of_day >= workout_start) & (minute_of_day < workout_start + 45)
+    steps[workout] = rng.uniform(110, 160, workout.sum())
+
+    sleep = rng.normal(420, 50, (users, days)).clip(180, 600)[user, day]
+    resting = rng.normal(66, 6, users)[user]
+    heart_rate = (resting + 0.35 * steps - 0.02 * (sleep - 420) - 8 * ~awake
+                  + rng.normal(0, 3, n))
+
+    truth = np.zeros(n, dtype=bool)
+    starts = np.flatnonzero(rng.random(n) < episode_rate / 1440)
+    for offset in range(10):
+        truth[np.minimum(starts + offset, n - 1)] = True
+    truth &= steps == 0
+    heart_rate[truth] += rng.uniform(25, 40, truth.sum())
+
+    df = pd.DataFrame({
+        "Id": user + 1_000_000_000,
+        "timestamp": pd.Timestamp("2016-04-12") + pd.to_timedelta(np.tile(np.arange(minutes), users), "min"),
+        "heart_rate": heart_rate,
+        "steps": steps,
+        "sleep": sleep,
+    })
+    return df, truth, workout
+
+
+def _flag_report(name, flags, truth, workout, seconds=None):
+    true_pos = int((flags & truth).sum())
+    entry = {
+        "method": name,
+        "flagged": int(flags.sum()),
+        "precision": round(true_pos / flags.sum(), 4) if flags.sum() else None,
+        "recall": round(true_pos / truth.sum(), 4) if truth.sum() else None,
+        "false_positives": int((flags & ~truth).sum()),
+        "false_positives_exercising": int((flags & ~truth & workout).sum()),
+    }
+    if seconds is not None:
+        entry["rows_per_s"] = round(len(flags) / seconds)
+    return entry
+
+
+def benchmark(users=100, days=14, methods=tuple(JOINT_DETECTORS)):
+    df, truth, workout = synthetic_rows(users, days)
+    report = []
+    for stds in (THRESHOLD_STDS, 3):
+        start = time.perf_counter()
+        flags = per_metric_flags(df, stds)
+        report.append(_flag_report(f"per_metric_{stds}std", flags, truth, workout,
+                                   time.perf_counter() - start))
+    for name in methods:
+        start = time.perf_counter()
+        results = get_joint_detector(name).score(df)
+        seconds = time.perf_counter() - start
+        report.append(_flag_report(name, results["anomaly"].to_numpy(), truth, workout, seconds))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Joint heart rate/steps/sleep anomaly scoring")
+    parser.add_argument("--data-dir", default="data", help="folder holding the cleaned dataset")
+    parser.add_argument("--method", choices=sorted(JOINT_DETECTORS), default="activity")
+    parser.add_argument("--resolution", choices=RESOLUTIONS, default="minute",
+                        help="score user-minutes or user-days")
+    parser.add_argument("--users", type=int, default=None, help="only the first N users")
+    parser.add_argument("--output", default="joint_anomalies.parquet",
+                        help="scored rows (.parquet or .csv)")
+    parser.add_argument("--all-rows", action="store_true",
+                        help="write every scored row, not only the anomalies")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare the methods with the per-metric rule on synthetic rows")
+    parser.add_argument("--synthetic-users", type=int, default=100)
+    parser.add_argument("--synthetic-days", type=int, default=14)
+    parser.add_argument("--json", default=None, help="also write the benchmark report to this file")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="write per-stage timings to FILE (JSON lines) and print a summary")
+    args = parser.parse_args()
+
+    if args.trace:
+        enable_tracing(args.trace)
+
+    if args.benchmark:
+        report = benchmark(args.synthetic_users, args.synthetic_days)
+        print(pd.DataFrame(report).to_string(index=False))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    else:
+        data_path = find_cleaned_dataset(args.data_dir)
+        user_ids = list_users(data_path)[:args.users] if args.users else None
+        results, report = score_dataset(data_path, args.method, args.resolution, user_ids)
+        if not args.all_rows:
+            results = results[results["anomaly"]]
+        if args.output.endswith(".parquet"):
+            results.to_parquet(args.output, index=False)
+        else:
+            results.to_csv(args.output, index=False)
+        print(pd.Series(report).to_string())
+        print(f"Scored rows saved as {args.output}")
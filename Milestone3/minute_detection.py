@@ -0,0 +1,321 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+
+import numpy as np
+import pandas as pd
+
+from detection import label_anomalies
+from detectors import get_detector
+from instrumentation import enable as enable_tracing, span
+from joint_detection import MIN_GROUP_ROWS, synthetic_rows
+from preprocess import user_codes
+from storage import find_cleaned_dataset, is_parquet, list_users, load_cleaned_dataset, to_epoch_minutes
+from thresholds import fit_thresholds
+
+# Anomaly detection on the 1-minute rows, without resampling to days.
+#
+# A daily mean hides a 10-minute heart rate spike, and Prophet on minute
+# rows of every user is far too slow. Here the expected value of every
+# minute is
+#
+#   hour-of-day profile[user, hour] + day-of-week offset[user, weekday]
+#   (+ for heart rate: the user's slope on the minute's steps, so a
+#   workout is not a spike)
+#
+# All profiles come from np.bincount sums over (user, weekday, hour)
+# slots, one aggregated pass over the rows with no per-user loop. The
+# residuals are thresholded per (user, hour of day) with the robust
+# thresholds of thresholds.py, and flagged minutes are merged into
+# intervals (start, end, peak). Users are scored in batches, so memory
+# stays at one batch of minute rows.
+
+# Minute steps are mostly zero with bursts of walking: no spread to
+# threshold against, and a burst is activity rather than an anomaly
+MINUTE_METRICS = ("heart_rate",)
+# Minute residuals are many and noisy: a stricter cut than the daily 2 std
+MINUTE_THRESHOLD_STDS = 4
+# Flagged minutes at most this far apart belong to the same interval
+MAX_GAP_MINUTES = 2
+MIN_INTERVAL_MINUTES = 1
+BATCH_USERS = 200
+
+HOURS, WEEKDAYS = 24, 7
+INTERVAL_COLUMNS = ["user_id", "metric", "start", "end", "minutes", "anomalous_minutes",
+                    "peak_time", "peak_value", "peak_expected", "peak_residual"]
+
+
+# -------------------------------
+# Seasonal profiles
+# -------------------------------
+def _calendar(minutes):
+    # Hour of day and weekday (Monday = 0) of epoch minutes; 1970-01-01 was a Thursday
+    days = minutes // 1440
+    return (minutes // 60) % HOURS, (days + 3) % WEEKDAYS
+
+
+def _activity_effect(codes, n_users, values, steps):
+    # Per-user least-squares slope of the value on the minute's steps, times
+    # the steps; users with too few moving minutes take the batch's slope
+    counts = np.maximum(np.bincount(codes, minlength=n_users), 1)
+    step_dev = steps - (np.bincount(codes, steps, n_users) / counts)[codes]
+    value_dev = values - (np.bincount(codes, values, n_users) / counts)[codes]
+    covariance = np.bincount(codes, step_dev * value_dev, n_users)
+    variance = np.bincount(codes, step_dev * step_dev, n_users)
+    moving = np.bincount(codes, steps > 0, n_users)
+
+    pooled = covariance.sum() / variance.sum() if variance.sum() > 0 else 0.0
+    slope = np.full(n_users, pooled)
+    own = (moving >= MIN_GROUP_ROWS) & (variance > 0)
+    slope[own] = covariance[own] / variance[own]
+    return slope[codes] * steps
+
+
+def seasonal_expected(codes, n_users, minutes, values, steps=None):
+    """Expected value of every minute from the user's hour-of-day and weekday profiles.
+
+    With ``steps``, the user's heart rate response to steps is removed
+    before the profiles are learned and added back to the expectation.
+    """
+    activity = _activity_effect(codes, n_users, values, steps) if steps is not None else 0.0
+    adjusted = values - activity
+    hour, weekday = _calendar(minutes)
+
+    # One pass: sums and counts per (user, weekday, hour) slot
+    slots = (codes * WEEKDAYS + weekday) * HOURS + hour
+    n = np.bincount(slots, minlength=n_users * WEEKDAYS * HOURS).reshape(n_users, WEEKDAYS, HOURS)
+    sums = np.bincount(slots, adjusted, n_users * WEEKDAYS * HOURS).reshape(n_users, WEEKDAYS, HOURS)
+
+    # Hour-of-day profile over all weekdays, then each weekday's mean offset from it
+    hour_profile = sums.sum(axis=1) / np.maximum(n.sum(axis=1), 1)
+    weekday_offset = ((sums - n * hour_profile[:, None, :]).sum(axis=2)
+                      / np.maximum(n.sum(axis=2), 1))
+    return hour_profile[codes, hour] + weekday_offset[codes, weekday] + activity
+
+
+# -------------------------------
+# Scoring
+# -------------------------------
+def minute_residuals(df, metric, activity=True):
+    """Residual table (ds, y, yhat, residual, user_id) of the minute rows of ``df``."""
+    rows = df[df[metric].notna()]
+    ids, codes = user_codes(rows["Id"])
+    values = rows[metric].to_numpy(dtype="float64")
+    steps = None
+    if activity and metric == "heart_rate" and "steps" in rows:
+        steps = rows["steps"].to_numpy(dtype="float64")
+    expected = seasonal_expected(codes, len(ids), to_epoch_minutes(rows["timestamp"]), values, steps)
+    return pd.DataFrame({
+        # .values: naive UTC datetime64, also for tz-aware timestamps
+        "ds": rows["timestamp"].values,
+        "y": values,
+        "yhat": expected,
+        "residual": values - expected,
+        "user_id": ids[codes],
+    })
+
+
+def anomalous_intervals(results, metric, max_gap=MAX_GAP_MINUTES, min_minutes=MIN_INTERVAL_MINUTES):
+    """Merge the flagged minutes of a labeled residual table into intervals."""
+    flagged = results[results["anomaly"]]
+    if flagged.empty:
+        return pd.DataFrame(columns=INTERVAL_COLUMNS)
+    users = flagged["user_id"].to_numpy()
+    minutes = to_epoch_minutes(flagged["ds"])
+    # A new interval starts at a new user or after a longer gap
+    starts = np.r_[True, (users[1:] != users[:-1]) | (np.diff(minutes) > max_gap + 1)]
+    interval = np.cumsum(starts) - 1
+    bounds = np.flatnonzero(starts)
+
+    # Peak: the largest |residual| of each interval
+    magnitude = np.abs(flagged["residual"].to_numpy())
+    order = np.lexsort((-magnitude, interval))
+    peak = order[np.r_[True, interval[order][1:] != interval[order][:-1]]]
+    last = np.r_[bounds[1:], len(flagged)] - 1
+
+    intervals = pd.DataFrame({
+        "user_id": users[bounds],
+        "metric": metric,
+        "start": flagged["ds"].to_numpy()[bounds],
+        "end": flagged["ds"].to_numpy()[last],
+        "minutes": minutes[last] - minutes[bounds] + 1,
+        "anomalous_minutes": np.diff(np.r_[bounds, len(flagged)]),
+        "peak_time": flagged["ds"].to_numpy()[peak],
+        "peak_value": flagged["y"].to_numpy()[peak],
+        "peak_expected": flagged["yhat"].to_numpy()[peak],
+        "peak_residual": flagged["residual"].to_numpy()[peak],
+    })
+    return intervals[intervals["anomalous_minutes"] >= min_minutes].reset_index(drop=True)
+
+
+def detect_minutes(df, metric, stds=MINUTE_THRESHOLD_STDS, activity=True, max_gap=MAX_GAP_MINUTES):
+    """Labeled minute residuals and anomalous intervals of one metric."""
+    results = minute_residuals(df, metric, activity)
+    thresholds = fit_thresholds(results, hourly=True)
+    results["anomaly"] = thresholds.flag(results, stds)
+    results["label"] = pd.Categorical.from_codes(results["anomaly"].to_numpy(dtype="int8"),
+                                                 ["Normal", "Anomalous"])
+    return results, anomalous_intervals(results, metric, max_gap)
+
+
+def user_batches(data_path, columns, user_ids=None, batch_users=BATCH_USERS):
+    """Minute rows of ``batch_users`` whole users at a time."""
+    if user_ids is None:
+        user_ids = list_users(data_path)
+    if is_parquet(data_path) and os.path.isdir(data_path):
+        # Partitioned by user: each batch reads only its own files
+        for i in range(0, len(user_ids), batch_users):
+            yield load_cleaned_dataset(data_path, columns, user_ids=user_ids[i:i + batch_users])
+        return
+    df = load_cleaned_dataset(data_path, columns, user_ids=user_ids)
+    ids = df["Id"].to_numpy()
+    bounds = np.r_[0, np.flatnonzero(ids[1:] != ids[:-1]) + 1, len(ids)]
+    for i in range(0, len(bounds) - 1, batch_users):
+        yield df.iloc[bounds[i]:bounds[min(i + batch_users, len(bounds) - 1)]]
+
+
+def score_dataset(data_path, metrics=MINUTE_METRICS, user_ids=None, stds=MINUTE_THRESHOLD_STDS,
+                  activity=True, batch_users=BATCH_USERS):
+    """Anomalous intervals of every user and metric, scored batch by batch."""
+    columns = list(dict.fromkeys(["Id", "timestamp", *metrics, "steps"]))
+    intervals = []
+    rows = users = flagged = 0
+    fit_seconds = 0.0
+    for batch in user_batches(data_path, columns, user_ids, batch_users):
+        rows += len(batch)
+        users += batch["Id"].nunique()
+        for metric in metrics:
+            start = time.perf_counter()
+            with span("minute.score", rows=len(batch), metric=metric):
+                results, found = detect_minutes(batch, metric, stds, activity)
+            fit_seconds += time.perf_counter() - start
+            flagged += int(results["anomaly"].sum())
+            intervals.append(found)
+
+    intervals = [i for i in intervals if not i.empty]
+    intervals = (pd.concat(intervals, ignore_index=True) if intervals
+                 else pd.DataFrame(columns=INTERVAL_COLUMNS))
+    report = {
+        "users": users,
+        "rows": rows,
+        "anomalous_minutes": flagged,
+        "intervals": len(intervals),
+        "score_seconds": round(fit_seconds, 3),
+        "rows_per_s": round(rows * len(metrics) / fit_seconds) if fit_seconds else None,
+        "seconds_per_user": round(fit_seconds / users, 4) if users else None,
+    }
+    return intervals, report
+
+
+# -------------------------------
+# Synthetic benchmark
+# -------------------------------
+def _episodes(df, truth):
+    # The injected resting heart rate episodes as (user, first, last minute)
+    minutes = to_epoch_minutes(df["timestamp"])[truth]
+    users = df["Id"].to_numpy()[truth]
+    starts = np.r_[True, (users[1:] != users[:-1]) | (np.diff(minutes) > 1)]
+    last = np.r_[np.flatnonzero(starts)[1:], len(minutes)] - 1
+    return users[starts], minutes[starts], minutes[last]
+
+
+def _episode_recall(episodes, intervals):
+    # Share of episodes overlapped by an interval, and intervals overlapping none
+    users, first, last = episodes
+    hit = np.zeros(len(users), dtype=bool)
+    matched = np.zeros(len(intervals), dtype=bool)
+    starts = to_epoch_minutes(intervals["start"])
+    ends = to_epoch_minutes(intervals["end"])
+    ids = intervals["user_id"].to_numpy()
+    for uid in np.unique(users):
+        e = np.flatnonzero(users == uid)
+        i = np.flatnonzero(ids == uid)
+        overlap = (starts[i][None, :] <= last[e][:, None]) & (ends[i][None, :] >= first[e][:, None])
+        hit[e] = overlap.any(axis=1)
+        matched[i] = overlap.any(axis=0)
+    return round(float(hit.mean()), 4), int((~matched).sum())
+
+
+def benchmark(users=100, days=30):
+    """Minute detection against the daily seasonal detector on synthetic rows."""
+    df, truth, _ = synthetic_rows(users, days)
+    episodes = _episodes(df, truth)
+    report = []
+
+    start = time.perf_counter()
+    results, intervals = detect_minutes(df, "heart_rate")
+    seconds = time.perf_counter() - start
+    recall, false_intervals = _episode_recall(episodes, intervals)
+    report.append({
+        "method": "minute_seasonal",
+        "episode_recall": recall,
+        "intervals": len(intervals),
+        "false_intervals": false_intervals,
+        "seconds": round(seconds, 3),
+        "rows_per_s": round(len(df) / seconds),
+        "seconds_per_user_month": round(seconds / users * 30 / days, 4),
+    })
+
+    # The same episodes through the daily path: one residual per user-day
+    start = time.perf_counter()
+    daily = label_anomalies(get_detector("seasonal").score(df, df["Id"].unique(), "heart_rate"))
+    seconds = time.perf_counter() - start
+    user_ids, first, _ = episodes
+    episode_days = pd.DataFrame({"user_id": user_ids,
+                                 "ds": pd.to_datetime(first, unit="m").floor("D")})
+    found = episode_days.merge(daily[["user_id", "ds", "anomaly"]], on=["user_id", "ds"], how="left")
+    report.append({
+        "method": "daily_seasonal",
+        "episode_recall": round(float(found["anomaly"].eq(True).mean()), 4),
+        "intervals": int(daily["anomaly"].sum()),
+        "seconds": round(seconds, 3),
+        "rows_per_s": round(len(df) / seconds),
+    })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Anomalous intervals at 1-minute resolution")
+    parser.add_argument("--data-dir", default="data", help="folder holding the cleaned dataset")
+    parser.add_argument("--users", type=int, default=None, help="only the first N users")
+    parser.add_argument("--stds", type=float, default=MINUTE_THRESHOLD_STDS,
+                        help="robust standard deviations from the (user, hour) center")
+    parser.add_argument("--no-activity", action="store_true",
+                        help="do not adjust heart rate for the minute's steps")
+    parser.add_argument("--batch-users", type=int, default=BATCH_USERS,
+                        help="users whose minute rows are held in memory at once")
+    parser.add_argument("--output", default="minute_intervals.csv",
+                        help="anomalous intervals (.csv or .parquet)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare with the daily path on synthetic minute rows instead")
+    parser.add_argument("--synthetic-users", type=int, default=100)
+    parser.add_argument("--synthetic-days", type=int, default=30)
+    parser.add_argument("--json", default=None, help="also write the benchmark report to this file")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="write per-stage timings to FILE (JSON lines) and print a summary")
+    args = parser.parse_args()
+
+    if args.trace:
+        enable_tracing(args.trace)
+
+    if args.benchmark:
+        report = benchmark(args.synthetic_users, args.synthetic_days)
+        print(pd.DataFrame(report).to_string(index=False))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    else:
+        data_path = find_cleaned_dataset(args.data_dir)
+        user_ids = list_users(data_path)[:args.users] if args.users else None
+        intervals, report = score_dataset(data_path, MINUTE_METRICS, user_ids, args.stds,
+                                          not args.no_activity, args.batch_users)
+        if args.output.endswith(".parquet"):
+            intervals.to_parquet(args.output, index=False)
+        else:
+            intervals.to_csv(args.output, index=False)
+        print(pd.Series(report, dtype=object).to_string())
+        print(f"Anomalous intervals saved as {args.output}")
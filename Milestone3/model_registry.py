@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+# On-disk store of fitted Prophet models.
+#
+# Models are keyed by (user, metric, data fingerprint). An unchanged series
+# reloads its stored model instead of refitting. A series that changed
+# (typically a new day appended) is refitted warm-started from the user's
+# latest stored parameters, which converges in a fraction of a cold fit.
+# The store is size-bounded: least recently used models are evicted first.
+# Each registry keeps a running byte total of the store (one directory scan
+# on its first save), so a save only walks the tree when the store has
+# grown past its budget; eviction then trims it to EVICT_TO of the budget.
+# Pool workers save with auto_evict=False and the driver evicts once at
+# the end of the run.
+#
+# Prophet (and through it cmdstanpy) is imported on the first fit or load,
+# not with this module, so scripts that only use the NumPy detectors or
+# hit the "not enough data" path never pay for it.
+
+DEFAULT_MODEL_DIR = "models"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Fraction of max_bytes an eviction trims the store down to
+EVICT_TO = 0.9
+
+# Bump when the Prophet configuration below changes, so stale models miss
+MODEL_VERSION = "prophet-daily-v1"
+
+
+def make_model():
+    from prophet import Prophet
+    return Prophet(daily_seasonality=True)
+
+
+def fingerprint(series):
+    digest = hashlib.sha1(MODEL_VERSION.encode())
+    digest.update(pd.util.hash_pandas_object(series[["ds", "y"]], index=False).values.tobytes())
+    return digest.hexdigest()[:20]
+
+
+def stan_init(model):
+    # Fitted parameters of a previous model, in the form Prophet.fit(init=...) takes
+    params = {name: model.params[name][0][0] for name in ["k", "m", "sigma_obs"]}
+    params.update({name: model.params[name][0] for name in ["delta", "beta"]})
+    return params
+
+
+class ModelRegistry:
+    """Size-bounded LRU store of fitted Prophet models with hit/miss counters."""
+
+    def __init__(self, root=DEFAULT_MODEL_DIR, max_bytes=DEFAULT_MAX_BYTES, auto_evict=True):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.auto_evict = auto_evict
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "warm_starts": 0,
+            "fit_seconds": 0.0,
+            "saved_seconds": 0.0,
+        }
+        # Bytes of models in the store; None until the first save scans it
+        self._bytes = None
+
+    def _series_dir(self, user_id, metric):
+        return os.path.join(self.root, str(user_id), metric)
+
+    def _latest_path(self, user_id, metric):
+        folder = self._series_dir(user_id, metric)
+        if not os.path.isdir(folder):
+            return None
+        paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(".json")]
+        return max(paths, key=os.path.getmtime, default=None)
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # Evicted by another process, or a partial write from a crash
+            return None
+        os.utime(path)
+        from prophet.serialize import model_from_json
+        return model_from_json(entry["model"]), entry["fit_seconds"]
+
+    def _save(self, path, model, fit_seconds):
+        from prophet.serialize import model_to_json
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model": model_to_json(model), "fit_seconds": fit_seconds}, f)
+        size = os.path.getsize(tmp_path)
+        if not self.auto_evict:
+            os.replace(tmp_path, path)
+            return
+        if self._bytes is None:
+            self._bytes = sum(size for _, size, _ in self._entries())
+        elif os.path.exists(path):
+            self._bytes -= os.path.getsize(path)
+        os.replace(tmp_path, path)
+        self._bytes += size
+        if self._bytes > self.max_bytes:
+            self.evict()
+
+    def get_or_fit(self, user_id, metric, series):
+        """Return a Prophet model fitted on ``series``, reusing stored work."""
+        path = os.path.join(self._series_dir(user_id, metric), f"{fingerprint(series)}.json")
+
+        loaded = self._load(path) if os.path.exists(path) else None
+        if loaded is not None:
+            model, fit_seconds = loaded
+            self.stats["hits"] += 1
+            self.stats["saved_seconds"] += fit_seconds
+            return model
+
+        self.stats["misses"] += 1
+        previous_path = self._latest_path(user_id, metric)
+        previous = self._load(previous_path) if previous_path else None
+
+        start = time.perf_counter()
+        model = None
+        if previous is not None:
+            try:
+                model = make_model().fit(series, init=stan_init(previous[0]))
+                self.stats["warm_starts"] += 1
+            except Exception:
+                # Parameter shapes can change with the history length
+                model = None
+        if model is None:
+            model = make_model().fit(series)
+        fit_seconds = time.perf_counter() - start
+
+        self.stats["fit_seconds"] += fit_seconds
+        self._save(path, model, fit_seconds)
+        return model
+
+    def _entries(self):
+        # (mtime, size, path) of every stored model
+        entries = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used models until the store fits EVICT_TO of max_bytes."""
+        # Rescanned rather than trusted: other processes share the store
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self._bytes = total
+
+    def merge_stats(self, stats):
+        for key, value in stats.items():
+            self.stats[key] += value
+
+    def summary(self):
+        s = self.stats
+        lookups = s["hits"] + s["misses"]
+        hit_rate = s["hits"] / lookups * 100 if lookups else 0.0
+        return (
+            f"Model registry: {s['hits']} hits, {s['misses']} misses ({hit_rate:.0f}% hit rate), "
+            f"{s['warm_starts']} warm starts, {s['fit_seconds']:.1f}s fitting, "
+            f"~{s['saved_seconds']:.1f}s saved"
+        )
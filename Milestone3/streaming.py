@@ -0,0 +1,201 @@
+import argparse
+import csv
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+# Online anomaly detection for live minute-level events.
+#
+# The batch scripts resample to daily means and fit per series. Here each
+# event updates a per-user exponentially weighted mean and variance of
+# every metric in O(1) and is labelled against the baseline from before
+# the update, with the same |x - expected| > 2 * std rule and the same
+# Normal/Anomalous labels. State is a few floats per user and metric; at
+# most ``max_users`` users are tracked, the least recently seen is dropped.
+
+STREAM_METRICS = ("heart_rate", "steps")
+# Same rule as detection.py, which is not imported here: it pulls in pandas
+THRESHOLD_STDS = 2
+DEFAULT_ALPHA = 0.05
+# Events a user needs before being labelled, so the baseline has settled
+DEFAULT_WARMUP = 30
+DEFAULT_MAX_USERS = 100_000
+
+
+class Event(NamedTuple):
+    user_id: int
+    timestamp: str
+    metric: str
+    value: float
+    expected: float
+    label: str
+
+
+class OnlineDetector:
+    """Per-user EWMA mean/variance baselines with bounded state."""
+
+    def __init__(self, metrics=STREAM_METRICS, alpha=DEFAULT_ALPHA, warmup=DEFAULT_WARMUP,
+                 threshold_stds=THRESHOLD_STDS, max_users=DEFAULT_MAX_USERS):
+        self.metrics = tuple(metrics)
+        self.alpha = alpha
+        self.warmup = warmup
+        self.threshold_stds = threshold_stds
+        self.max_users = max_users
+        # user_id -> [mean, var, count] per metric, flattened; LRU order
+        self._state = OrderedDict()
+        self.stats = {"events": 0, "anomalies": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._state)
+
+    def _user_state(self, user_id):
+        state = self._state.get(user_id)
+        if state is None:
+            if len(self._state) >= self.max_users:
+                self._state.popitem(last=False)
+                self.stats["evicted"] += 1
+            state = self._state[user_id] = [0.0, 0.0, 0] * len(self.metrics)
+        else:
+            self._state.move_to_end(user_id)
+        return state
+
+    def update(self, user_id, timestamp, values):
+        """Score one event (``values`` in ``metrics`` order, NaN/None = missing).
+
+        Returns an Event per metric present, labelled against the user's
+        baseline before this event, then folds the event into it.
+        """
+        state = self._user_state(user_id)
+        alpha = self.alpha
+        events = []
+        for i, x in enumerate(values):
+            if x is None or x != x:
+                continue
+            j = 3 * i
+            mean, var, count = state[j], state[j + 1], state[j + 2]
+
+            if count == 0:
+                mean, expected, label = x, x, "Normal"
+            else:
+                expected = mean
+                diff = x - mean
+                anomalous = count >= self.warmup and diff * diff > self.threshold_stds ** 2 * var
+                label = "Anomalous" if anomalous else "Normal"
+                if anomalous:
+                    self.stats["anomalies"] += 1
+                # West's exponentially weighted mean and variance
+                increment = alpha * diff
+                mean += increment
+                var = (1 - alpha) * (var + diff * increment)
+
+            state[j], state[j + 1], state[j + 2] = mean, var, count + 1
+            events.append(Event(user_id, timestamp, self.metrics[i], x, expected, label))
+        self.stats["events"] += 1
+        return events
+
+    def process(self, events, anomalies_only=False):
+        """Label a stream of (user_id, timestamp, *values) tuples."""
+        for user_id, timestamp, *values in events:
+            for event in self.update(user_id, timestamp, values):
+                if not anomalies_only or event.label == "Anomalous":
+                    yield event
+
+
+# -------------------------------
+# Event sources
+# -------------------------------
+def _parse_row(row, metrics):
+    values = [float(row[m]) if row.get(m) not in (None, "") else None for m in metrics]
+    return (int(row["Id"]), row["timestamp"], *values)
+
+
+def tail_csv(path, metrics=STREAM_METRICS, poll_seconds=0.5, follow=True):
+    """Events from a CSV (Id,timestamp,<metrics>) that keeps being appended to."""
+    with open(path, newline="") as f:
+        header = next(csv.reader([f.readline()]))
+        partial = ""
+        while True:
+            line = f.readline()
+            if not line:
+                if not follow:
+                    return
+                time.sleep(poll_seconds)
+                continue
+            if not line.endswith("\n"):
+                # Writer is mid-line; keep the fragment until the rest arrives
+                partial += line
+                continue
+            line, partial = partial + line, ""
+            row = dict(zip(header, next(csv.reader([line]))))
+            yield _parse_row(row, metrics)
+
+
+def drain_queue(q, stop=None):
+    """Events from a queue.Queue of tuples, until ``stop`` is received."""
+    while True:
+        item = q.get()
+        if item is stop:
+            return
+        yield item
+
+
+# -------------------------------
+# Throughput benchmark
+# -------------------------------
+def synthetic_events(n_events, users=1000, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    user_ids = (rng.integers(0, users, n_events) + 1_000_000_000).tolist()
+    heart_rate = rng.normal(75, 8, n_events)
+    spikes = rng.random(n_events) < 0.001
+    heart_rate[spikes] += 60
+    steps = rng.poisson(20, n_events).astype(float)
+    timestamps = [str(i) for i in range(n_events)]
+    return list(zip(user_ids, timestamps, heart_rate.tolist(), steps.tolist()))
+
+
+def benchmark(n_events=1_000_000, users=1000):
+    events = synthetic_events(n_events, users)
+    detector = OnlineDetector()
+    start = time.perf_counter()
+    for _ in detector.process(events, anomalies_only=True):
+        pass
+    seconds = time.perf_counter() - start
+    return {
+        "events": n_events,
+        "users": users,
+        "seconds": round(seconds, 3),
+        "events_per_s": round(n_events / seconds),
+        "anomalies": detector.stats["anomalies"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Label live heart rate/steps events")
+    parser.add_argument("--tail", default=None,
+                        help="CSV with Id,timestamp,heart_rate,steps columns to follow")
+    parser.add_argument("--no-follow", action="store_true", help="stop at the end of the file")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--max-users", type=int, default=DEFAULT_MAX_USERS)
+    parser.add_argument("--all-events", action="store_true", help="print Normal events too")
+    parser.add_argument("--benchmark", type=int, default=None, metavar="EVENTS",
+                        help="measure throughput on synthetic events instead")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(benchmark(args.benchmark))
+    elif args.tail and os.path.exists(args.tail):
+        detector = OnlineDetector(alpha=args.alpha, warmup=args.warmup, max_users=args.max_users)
+        source = tail_csv(args.tail, follow=not args.no_follow)
+        try:
+            for event in detector.process(source, anomalies_only=not args.all_events):
+                print(f"{event.timestamp}  user {event.user_id}  {event.metric}={event.value:g} "
+                      f"(expected {event.expected:.1f})  {event.label}", flush=True)
+        except KeyboardInterrupt:
+            pass
+        print(detector.stats)
+    else:
+        parser.error("give --tail PATH (an existing file) or --benchmark N")
@@ -0,0 +1,170 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from detection import MIN_DAYS, THRESHOLD_STDS
+from model_registry import DEFAULT_MODEL_DIR
+
+# Per-user anomaly thresholds.
+#
+# label_anomalies() flags |residual| > 2 * std of the residuals of *all*
+# users pooled together, so a noisy user gets most of the flags and a
+# quiet one almost never alerts. A ThresholdTable holds a robust center
+# (median) and scale (1.4826 * MAD, the std of normal residuals) per user
+# and, for sub-daily residuals, per (user, hour of day). All groups come
+# out of grouped pandas reductions over the whole residual table, with no
+# loop over users. A residual is anomalous when it is more than
+# THRESHOLD_STDS scales from its group's center. Groups with too few rows
+# (or no spread) fall back to the user's level, then to the global one.
+#
+# ThresholdStore keeps the fitted tables next to the Prophet models, so a
+# later run applies them to its new residuals without refitting on the
+# history. Users the stored table has not seen are fitted and added.
+
+MAD_TO_STD = 1.4826
+# Residuals a group needs for its own threshold
+MIN_GROUP_ROWS = MIN_DAYS
+COLUMNS = ["level", "user_id", "hour", "center", "scale", "rows"]
+
+
+def _robust_groups(residual, keys):
+    # Median, scaled MAD and row count of the residual per key combination
+    grouped = residual.groupby(keys, sort=False)
+    center = grouped.median()
+    deviation = (residual - grouped.transform("median")).abs()
+    return pd.DataFrame({
+        "center": center,
+        "scale": MAD_TO_STD * deviation.groupby(keys, sort=False).median(),
+        "rows": grouped.size(),
+    }).reset_index()
+
+
+def fit_thresholds(results, hourly=False, time_column="ds", min_rows=MIN_GROUP_ROWS):
+    """Fit a ThresholdTable on a residual table (user_id, ds, residual)."""
+    results = results[results["residual"].notna()]
+    residual = results["residual"].astype("float64")
+    user = results["user_id"].rename("user_id")
+
+    deviation = (residual - residual.median()).abs()
+    levels = [pd.DataFrame({
+        "level": ["global"], "user_id": [0], "hour": [-1],
+        "center": [residual.median()], "scale": [MAD_TO_STD * deviation.median()],
+        "rows": [len(residual)],
+    })]
+
+    users = _robust_groups(residual, [user])
+    levels.append(users.assign(level="user", hour=-1))
+    if hourly:
+        hour = results[time_column].dt.hour.rename("hour")
+        levels.append(_robust_groups(residual, [user, hour]).assign(level="user_hour"))
+
+    table = pd.concat(levels, ignore_index=True)[COLUMNS]
+    reliable = (table["rows"] >= min_rows) & (table["scale"] > 0)
+    return ThresholdTable(table[reliable | (table["level"] == "global")])
+
+
+class ThresholdTable:
+    """Robust center and scale of the residuals per user (and hour of day)."""
+
+    def __init__(self, table):
+        self.table = table.reset_index(drop=True)
+        self.hourly = (self.table["level"] == "user_hour").any()
+        glob = self.table[self.table["level"] == "global"]
+        self.global_center = float(glob["center"].iloc[0]) if len(glob) else 0.0
+        self.global_scale = float(glob["scale"].iloc[0]) if len(glob) else np.nan
+
+        users = self.table[self.table["level"] == "user"]
+        self._users = pd.Index(users["user_id"])
+        self._user_params = users[["center", "scale"]].to_numpy()
+        hours = self.table[self.table["level"] == "user_hour"]
+        self._hours = pd.MultiIndex.from_arrays([hours["user_id"], hours["hour"]])
+        self._hour_params = hours[["center", "scale"]].to_numpy()
+
+    @property
+    def users(self):
+        return self._users
+
+    def lookup(self, user_ids, hours=None):
+        """Center and scale for every row, from the most specific group that has one."""
+        params = np.empty((len(user_ids), 2))
+        params[:] = self.global_center, self.global_scale
+
+        positions = self._users.get_indexer(user_ids)
+        known = positions >= 0
+        params[known] = self._user_params[positions[known]]
+
+        if hours is not None and len(self._hours):
+            positions = self._hours.get_indexer(pd.MultiIndex.from_arrays([user_ids, hours]))
+            known = positions >= 0
+            params[known] = self._hour_params[positions[known]]
+        return params[:, 0], params[:, 1]
+
+    def flag(self, results, stds=THRESHOLD_STDS, time_column="ds"):
+        """Boolean anomaly flags of a residual table; no refit."""
+        hours = results[time_column].dt.hour.to_numpy() if self.hourly else None
+        center, scale = self.lookup(results["user_id"].to_numpy(), hours)
+        return np.abs(results["residual"].to_numpy(dtype="float64") - center) > stds * scale
+
+    def extend(self, other):
+        """This table plus the groups of ``other``'s users it does not have."""
+        new = other.table[(other.table["level"] != "global")
+                          & ~other.table["user_id"].isin(self._users)]
+        return ThresholdTable(pd.concat([self.table, new], ignore_index=True))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.table.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        return cls(pd.read_parquet(path))
+
+
+class ThresholdStore:
+    """Fitted ThresholdTables per (detector, metric), kept in the model folder."""
+
+    def __init__(self, root=DEFAULT_MODEL_DIR, detector_name="prophet", hourly=False, refit=False):
+        self.folder = os.path.join(root, "thresholds", detector_name)
+        self.hourly = hourly
+        self.refit = refit
+        self.stats = {"loaded": 0, "fitted": 0, "users_added": 0, "fit_seconds": 0.0}
+
+    def path(self, metric):
+        return os.path.join(self.folder, f"{metric}{'_hourly' if self.hourly else ''}.parquet")
+
+    def get_or_fit(self, metric, results, time_column="ds"):
+        """The stored table of ``metric``, fitted on ``results`` if there is none."""
+        path = self.path(metric)
+        table = None
+        if not self.refit and os.path.exists(path):
+            table = ThresholdTable.load(path)
+            self.stats["loaded"] += 1
+
+        start = time.perf_counter()
+        if table is None:
+            table = fit_thresholds(results, self.hourly, time_column)
+            self.stats["fitted"] += 1
+        else:
+            # Only users the table has never seen are fitted
+            new = results[~results["user_id"].isin(table.users)]
+            if new.empty:
+                return table
+            added = fit_thresholds(new, self.hourly, time_column)
+            if not len(added.users):
+                return table
+            table = table.extend(added)
+            self.stats["users_added"] += len(added.users)
+        self.stats["fit_seconds"] += time.perf_counter() - start
+        table.save(path)
+        return table
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"Threshold store: {s['loaded']} loaded, {s['fitted']} fitted, "
+            f"{s['users_added']} users added, {s['fit_seconds']:.2f}s fitting"
+        )
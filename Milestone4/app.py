@@ -1,8 +1,20 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone3"))
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-from prophet import Prophet
+
+from dashboard_cache import (
+    StageTimings, daily_rollup, detect_series_anomalies, hold_dataset, load_dataset,
+    minute_pyramid, plot_pyramid, upload_hash, user_index, user_series,
+)
+from detectors import DETECTORS
+from downsample import MAX_POINTS
+from storage import from_epoch_minutes
 
 # Page Configuration with improved theme
 st.set_page_config(
@@ -173,15 +185,15 @@ st.markdown('<div class="sub-header"><i class="fas fa-file-upload"></i> Data Upl
 col1, col2 = st.columns([2, 1])
 with col1:
     uploaded_file = st.file_uploader(
-        "Choose a CSV file",
-        type=["csv"],
-        help="Upload your cleaned fitness dataset in CSV format"
+        "Choose a CSV or Parquet file",
+        type=["csv", "parquet"],
+        help="Upload your cleaned fitness dataset in CSV or Parquet format"
     )
 with col2:
     st.markdown("""
     <div class="info-box">
         <h4 style='margin:0;'><i class="fas fa-clipboard-list"></i> Data Requirements</h4>
-        <p style='margin:0.5rem 0;'><i class="fas fa-check-circle"></i> CSV format required</p>
+        <p style='margin:0.5rem 0;'><i class="fas fa-check-circle"></i> CSV or Parquet format required</p>
         <p style='margin:0.5rem 0;'><i class="fas fa-check-circle"></i> Must include 'timestamp' column</p>
         <p style='margin:0.5rem 0;'><i class="fas fa-check-circle"></i> Must include 'Id' column for users</p>
         <p style='margin:0.5rem 0;'><i class="fas fa-check-circle"></i> Supports heart_rate, steps, sleep metrics</p>
@@ -192,18 +204,25 @@ if uploaded_file is None:
     st.markdown("""
     <div class="info-box">
         <h3 style='margin:0; text-align: center;'><i class="fas fa-file-excel"></i> No File Uploaded</h3>
-        <p style='text-align: center; margin: 0.5rem 0;'>Please upload a CSV file to begin analysis</p>
+        <p style='text-align: center; margin: 0.5rem 0;'>Please upload a CSV or Parquet file to begin analysis</p>
         <div style='text-align: center; margin-top: 1rem;'>
             <i class="fas fa-arrow-up" style='font-size: 2rem; opacity: 0.7;'></i>
         </div>
     </div>
     """, unsafe_allow_html=True)
+    hold_dataset(None)
     st.stop()
 
+# Real timings of every stage of this rerun (cached stages take milliseconds)
+timings = StageTimings()
+
 # Load Data
 try:
-    df = pd.read_csv(uploaded_file)
-    df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.tz_localize(None)
+    content_hash = timings.run("Hash upload", upload_hash, uploaded_file)
+    hold_dataset(content_hash)
+    df = timings.run("Parse dataset", load_dataset, content_hash, uploaded_file)
+    index = timings.run("Index users", user_index, content_hash, df)
+    rollup = timings.run("Daily rollup", daily_rollup, content_hash, df)
     st.markdown('<div class="success-box"><i class="fas fa-check-circle"></i> Dataset loaded successfully!</div>', unsafe_allow_html=True)
     
     # Display data preview with metrics
@@ -227,7 +246,8 @@ try:
         </div>
         """, unsafe_allow_html=True)
     with col3:
-        date_range = f"{df['timestamp'].min().date()} to {df['timestamp'].max().date()}"
+        first, last = from_epoch_minutes([df["minute"].min(), df["minute"].max()]).date
+        date_range = f"{first} to {last}"
         st.markdown(f"""
         <div class="metric-card">
             <i class="fas fa-calendar-alt"></i>
@@ -238,7 +258,9 @@ try:
     
     with st.expander("View Data Sample", expanded=False):
         st.markdown('<div style="margin-bottom: 10px;"><i class="fas fa-eye"></i> <strong>Preview of your data:</strong></div>', unsafe_allow_html=True)
-        st.dataframe(df.head(10).style.background_gradient(subset=['heart_rate', 'steps', 'sleep'], cmap='YlOrRd'))
+        preview = df.head(10).assign(minute=from_epoch_minutes(df["minute"].head(10)))
+        preview = preview.rename(columns={"minute": "timestamp"})
+        st.dataframe(preview.style.background_gradient(subset=['heart_rate', 'steps', 'sleep'], cmap='YlOrRd'))
         
 except Exception as e:
     st.error(f"<i class='fas fa-exclamation-triangle'></i> Error loading file: {str(e)}", unsafe_allow_html=True)
@@ -249,7 +271,7 @@ st.markdown('<div class="sub-header"><i class="fas fa-cogs"></i> Analysis Config
 
 col1, col2, col3 = st.columns(3)
 with col1:
-    user_ids = df["Id"].unique()
+    user_ids = index.user_ids
     selected_user = st.selectbox(
         "👤 Select User",
         user_ids,
@@ -269,11 +291,23 @@ with col2:
         format_func=lambda x: f"{metric_icons[x]} {x.replace('_', ' ').title()}",
         help="Choose the health metric to analyze for anomalies"
     )
+    detector_labels = {
+        "prophet": "Prophet (trend model)",
+        "rolling_median": "Rolling median (fast)",
+        "seasonal": "Weekly seasonal (fast)",
+        "ewma": "EWMA (fast)"
+    }
+    selected_detector = st.selectbox(
+        "🧪 Detection Method",
+        list(DETECTORS),
+        format_func=lambda x: detector_labels.get(x, x),
+        help="Prophet fits a trend model; the fast methods use rolling baselines"
+    )
     
 with col3:
-    user_df = df[df["Id"] == selected_user].copy()
-    min_date = user_df["timestamp"].min().date()
-    max_date = user_df["timestamp"].max().date()
+    user_rollup = rollup[selected_user]
+    min_date = user_rollup["ds"].min().date()
+    max_date = user_rollup["ds"].max().date()
     date_range = st.date_input(
         "📅 Select Date Range",
         value=(min_date, max_date),
@@ -283,14 +317,15 @@ with col3:
     )
 
 # Process selected date range
+start_date, end_date = None, None
 if isinstance(date_range, tuple) and len(date_range) == 2:
     start_date, end_date = date_range
-    user_df = user_df[(user_df["timestamp"].dt.date >= start_date) & (user_df["timestamp"].dt.date <= end_date)]
 
-# Prepare data for Prophet
-data = user_df[["timestamp", selected_metric]].dropna()
-data = data.rename(columns={"timestamp": "ds", selected_metric: "y"})
-data = data.set_index("ds").resample("D").mean().reset_index()
+# Prepare data for Prophet (daily means within the date range)
+data = timings.run(
+    "Resample to daily", user_series,
+    content_hash, selected_user, selected_metric, start_date, end_date, user_rollup
+)
 
 if len(data) < 10:
     st.markdown("""
@@ -304,32 +339,29 @@ if len(data) < 10:
 # Run Prophet Model
 st.markdown('<div class="sub-header"><i class="fas fa-search"></i> Running Anomaly Detection</div>', unsafe_allow_html=True)
 
-with st.spinner('Training Prophet model and detecting anomalies...'):
-    progress_bar = st.progress(0)
+with st.spinner(f'Fitting {detector_labels[selected_detector]} baseline and detecting anomalies...'):
+    # Advanced by the measured stages of this rerun, not a fixed schedule
+    timings.show_progress([
+        "Hash upload", "Parse dataset", "Index users", "Daily rollup",
+        "Resample to daily", "Fit model and score",
+    ])
     
-    # Simulate progress with icon
     progress_col1, progress_col2 = st.columns([1, 5])
     with progress_col1:
         st.markdown('<div style="text-align: center;"><i class="fas fa-cogs fa-spin" style="font-size: 2rem; color: #3498DB;"></i></div>', unsafe_allow_html=True)
     
-    with progress_col2:
-        # Simulate progress
-        for i in range(100):
-            progress_bar.progress(i + 1)
-    
-    model = Prophet(daily_seasonality=True)
-    model.fit(data)
-    
-    future = model.make_future_dataframe(periods=7)
-    forecast = model.predict(future)
-    
-    merged = data.merge(forecast[["ds", "yhat"]], on="ds", how="left")
-    merged["residual"] = merged["y"] - merged["yhat"]
-    threshold = 2 * merged["residual"].std()
-    merged["anomaly"] = (merged["residual"].abs() > threshold)
+    # Fit (or reuse) the model, compute residuals and flag |residual| > 2 std
+    merged = timings.run(
+        "Fit model and score", detect_series_anomalies,
+        content_hash, selected_user, selected_metric, start_date, end_date,
+        selected_detector, data
+    )
     
-    progress_bar.empty()
     st.markdown('<div style="text-align: center; margin-top: 10px;"><i class="fas fa-check-circle" style="color: #2ECC71; font-size: 1.5rem;"></i> Model training complete!</div>', unsafe_allow_html=True)
+    
+    with progress_col2:
+        with st.expander("Stage timings", expanded=False):
+            st.dataframe(timings.as_frame(), hide_index=True)
 
 # Display Results
 st.markdown('<div class="success-box"><i class="fas fa-flag-checkered"></i> Anomaly detection completed successfully!</div>', unsafe_allow_html=True)
@@ -385,8 +417,26 @@ elif selected_metric == "steps":
 elif selected_metric == "sleep":
     y_label = "Sleep Duration (Hours)"
 
+# Imported on first use: reruns that stop early (no upload, too little
+# data) never load plotly
+import plotly.express as px
+
+# The chart gets at most MAX_POINTS points (plus the anomalies); longer
+# series are zoomed with the slider, which re-reads the finer levels
+pyramid = timings.run(
+    "Prepare plot", plot_pyramid,
+    content_hash, selected_user, selected_metric, start_date, end_date, selected_detector, merged
+)
+plot_start, plot_end = None, None
+if pyramid.rows > MAX_POINTS:
+    first, last = (pd.Timestamp(b).to_pydatetime() for b in pyramid.bounds)
+    plot_start, plot_end = (np.datetime64(t) for t in st.slider(
+        "🔍 Zoom", min_value=first, max_value=last, value=(first, last), format="MMM DD, YYYY"
+    ))
+plot_data = pyramid.query(plot_start, plot_end)
+
 fig = px.line(
-    merged, 
+    plot_data, 
     x="ds", 
     y="y", 
     title=f"{selected_metric.replace('_', ' ').title()} Trend with Anomaly Detection",
@@ -395,15 +445,15 @@ fig = px.line(
 
 # Add prediction line
 fig.add_scatter(
-    x=merged["ds"], 
-    y=merged["yhat"], 
+    x=plot_data["ds"], 
+    y=plot_data["yhat"], 
     mode="lines", 
     name="<i class='fas fa-project-diagram'></i> Predicted",
     line=dict(color="#2ECC71", dash="dash")
 )
 
 # Add anomalies
-anoms = merged[merged["anomaly"] == True]
+anoms = plot_data[plot_data["anomaly"] == True]
 if not anoms.empty:
     fig.add_scatter(
         x=anoms["ds"], 
@@ -459,7 +509,7 @@ fig.update_yaxes(
     mirror=True,
     tickmode="linear",
     dtick=5,  # Adjust based on data range
-    range=[merged["y"].min() - 5, merged["y"].max() + 5]  # Add some padding
+    range=[plot_data["y"].min() - 5, plot_data["y"].max() + 5]  # Add some padding
 )
 
 # Improve hover template
@@ -469,6 +519,45 @@ fig.update_traces(
 
 st.plotly_chart(fig, use_container_width=True)
 
+# Minute-level heart rate: scored at 1-minute resolution (see
+# minute_detection.py) and drawn from zoom levels, so a month of minutes
+# is still a chart of at most MAX_POINTS points
+if selected_metric == "heart_rate" and st.checkbox(
+    "🔬 Show minute-level heart rate",
+    help="Detect short spikes that daily means hide; zoom in for full minute detail"
+):
+    minutes = timings.run(
+        "Minute detection", minute_pyramid,
+        content_hash, selected_user, start_date, end_date, index
+    )
+    if minutes is None:
+        st.info("No minute-level heart rate for this user and date range.")
+    else:
+        first, last = (pd.Timestamp(b).to_pydatetime() for b in minutes.bounds)
+        window = st.slider(
+            "🔍 Minute window", min_value=first, max_value=last, value=(first, last),
+            format="MMM DD, HH:mm"
+        )
+        points = minutes.query(*(np.datetime64(t) for t in window))
+
+        minute_fig = px.line(
+            points, x="ds", y="y",
+            title="Minute-level Heart Rate with Anomalies",
+            labels={"ds": "Time", "y": y_label}
+        )
+        minute_anoms = points[points["anomaly"]]
+        if not minute_anoms.empty:
+            minute_fig.add_scatter(
+                x=minute_anoms["ds"],
+                y=minute_anoms["y"],
+                mode="markers",
+                name="Anomaly",
+                marker=dict(color="#E74C3C", size=8, symbol="diamond")
+            )
+        minute_fig.update_layout(plot_bgcolor="white", paper_bgcolor="white", height=400)
+        st.caption(f"{len(points):,} of {minutes.rows:,} minutes drawn")
+        st.plotly_chart(minute_fig, use_container_width=True)
+
 # Anomaly Report Section
 st.markdown('<div class="sub-header"><i class="fas fa-file-alt"></i> Anomaly Report</div>', unsafe_allow_html=True)
 
@@ -0,0 +1,223 @@
+import argparse
+import json
+import mmap
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Milestone1"))
+
+import numpy as np
+import pandas as pd
+
+from dataset_registry import DatasetRegistry
+from rollups import compute_rollup
+from storage import load_cleaned_dataset, load_compact, release_freed_memory
+from user_index import UserIndex
+
+# Resident memory of the dashboard's data layer, wide against compact.
+#
+# Each loader runs in a fresh process that loads an upload the way
+# dashboard_cache.load_dataset() does, then builds the user index and the
+# daily rollup, and reports its resident set size: at its peak and once
+# loaded, each also net of the memory the imports alone take. "wide" is
+# the float64/datetime frame of load_cleaned_dataset(), "compact" the
+# frame of load_compact(). Without --data a synthetic cleaned dataset of
+# --users users x --days days is written first.
+#
+# With --sessions N, N processes hold the dataset at the same time, each
+# with its own compact copy ("compact") or with views of the shared
+# dataset registry ("mapped"). The report sums, over the sessions, the
+# dataset bytes each holds in private buffers rather than in mapped
+# registry files, and their private (not file-backed) resident memory;
+# the registry files are counted once.
+
+USERS_PER_WRITE = 50
+
+
+def synthetic_dataset(path, users, days, coverage=0.7, seed=0):
+    """A cleaned dataset (CSV or Parquet by extension) with minute rows worn ``coverage`` of the time."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rng = np.random.default_rng(seed)
+    minutes = pd.date_range("2016-04-12", periods=days * 24 * 60, freq="min", tz="UTC")
+    writer = None
+    for first in range(0, users, USERS_PER_WRITE):
+        frames = []
+        for uid in range(first, min(first + USERS_PER_WRITE, users)):
+            worn = minutes[rng.random(len(minutes)) < coverage]
+            sleep = rng.integers(300, 540, days)
+            frames.append(pd.DataFrame({
+                "Id": 1_000_000_000 + uid,
+                "timestamp": worn,
+                "heart_rate": rng.normal(75, 12, len(worn)).round(1),
+                "steps": rng.poisson(8, len(worn)).astype("float64"),
+                "sleep": sleep[(worn - minutes[0]).days].astype("float64"),
+            }))
+        batch = pd.concat(frames, ignore_index=True)
+        if path.endswith(".parquet"):
+            table = pa.Table.from_pandas(batch, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+        else:
+            batch.to_csv(path, mode="w" if first == 0 else "a", header=first == 0, index=False)
+    if writer is not None:
+        writer.close()
+
+
+def _rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _peak_rss_bytes():
+    # VmHWM starts over at exec; ru_maxrss would carry the parent's peak
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _private_bytes():
+    # Resident pages not backed by a file (heap, anonymous mappings)
+    with open("/proc/self/statm") as f:
+        resident, shared = (int(pages) for pages in f.read().split()[1:3])
+    return (resident - shared) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _private_frame_bytes(df):
+    # Column buffers that are not views of a memory-mapped file
+    total = 0
+    for _, column in df.items():
+        is_categorical = isinstance(column.dtype, pd.CategoricalDtype)
+        values = column.array.codes if is_categorical else column.to_numpy()
+        base = values
+        while getattr(base, "base", None) is not None and not isinstance(base, mmap.mmap):
+            base = base.base
+        if not isinstance(base, mmap.mmap):
+            total += values.nbytes
+    return total
+
+
+def measure(loader, path, registry_dir=None):
+    """Load ``path`` like the dashboard in this process; resident memory in MB."""
+    imported = _rss_bytes()
+    start = time.perf_counter()
+    if loader == "mapped":
+        df = DatasetRegistry(registry_dir).open(path)
+    else:
+        with open(path, "rb") as upload:
+            if loader == "wide":
+                df = load_cleaned_dataset(upload)
+                df["timestamp"] = df["timestamp"].dt.tz_localize(None)
+            else:
+                df = load_compact(upload)
+    index = UserIndex(df)
+    rollup = compute_rollup(df, "D")
+    if loader != "wide":
+        release_freed_memory()
+    rollup = UserIndex(rollup)
+    seconds = time.perf_counter() - start
+
+    mb = 1024 * 1024
+    peak = _peak_rss_bytes()
+    loaded = _rss_bytes()
+    return {
+        "rows": len(df),
+        "users": len(index),
+        "rollup_rows": len(rollup.df),
+        "seconds": round(seconds, 2),
+        "frame_mb": round(df.memory_usage(deep=True).sum() / mb, 1),
+        "frame_private_mb": round(_private_frame_bytes(df) / mb, 1),
+        "peak_rss_mb": round(peak / mb, 1),
+        "loaded_rss_mb": round(loaded / mb, 1),
+        "peak_net_mb": round((peak - imported) / mb, 1),
+        "loaded_net_mb": round((loaded - imported) / mb, 1),
+    }
+
+
+def _child(loader, path, registry_dir=None, hold=False):
+    command = [sys.executable, os.path.abspath(__file__), "--measure", loader, "--data", path]
+    if registry_dir:
+        command += ["--registry-dir", registry_dir]
+    if hold:
+        command.append("--hold")
+    return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+
+def run_sessions(path, sessions):
+    """Box memory taken by ``sessions`` processes holding the dataset at once."""
+    report = {"sessions": sessions}
+    with tempfile.TemporaryDirectory() as registry_dir:
+        content_hash = "benchmark"
+        with open(path, "rb") as upload:
+            DatasetRegistry(registry_dir).publish(content_hash, load_compact(upload))
+
+        for loader in ("compact", "mapped"):
+            source = content_hash if loader == "mapped" else path
+            children = [_child(loader, source, registry_dir, hold=True) for _ in range(sessions)]
+            private = sum(float(child.stdout.readline()) for child in children)
+            results = [json.loads(child.communicate("\n")[0]) for child in children]
+            report[f"{loader}_private_rss_mb"] = round(private, 1)
+            report[f"{loader}_dataset_mb"] = round(sum(r["frame_private_mb"] for r in results), 1)
+
+        registry = DatasetRegistry(registry_dir).summary()
+        report["mapped_dataset_mb"] += float(registry["MB"].sum())
+    report["dataset_reduction"] = round(report["compact_dataset_mb"] / report["mapped_dataset_mb"], 2)
+    return report
+
+
+def run(path):
+    report = {"data": path}
+    for loader in ("wide", "compact"):
+        report[loader] = json.loads(_child(loader, path).communicate()[0])
+    for key in ("frame_mb", "peak_net_mb", "loaded_net_mb", "peak_rss_mb"):
+        compact = report["compact"][key]
+        report[f"{key}_reduction"] = round(report["wide"][key] / compact, 2) if compact > 0 else None
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dashboard memory: wide against compact dtypes")
+    parser.add_argument("--data", default=None,
+                        help="cleaned dataset upload (.csv or .parquet) instead of synthetic data")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic users")
+    parser.add_argument("--days", type=int, default=365, help="synthetic days per user")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet",
+                        help="synthetic upload format")
+    parser.add_argument("--sessions", type=int, default=None,
+                        help="also measure N concurrent sessions, private against mapped")
+    parser.add_argument("--json", default=None, help="also write the report to this file")
+    parser.add_argument("--measure", choices=["wide", "compact", "mapped"], default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--registry-dir", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--hold", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        result = measure(args.measure, args.data, args.registry_dir)
+        if args.hold:
+            # Keep the dataset until every session has loaded and reported
+            print(_private_bytes() / 2**20, flush=True)
+            sys.stdin.readline()
+        print(json.dumps(result))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.data
+        if path is None:
+            path = os.path.join(tmp, f"synthetic.{args.format}")
+            synthetic_dataset(path, args.users, args.days)
+        report = run(path)
+        if args.sessions:
+            report["multi_session"] = run_sessions(path, args.sessions)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
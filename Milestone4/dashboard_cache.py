@@ -0,0 +1,192 @@
+import hashlib
+import time
+import uuid
+
+import pandas as pd
+import streamlit as st
+
+from dataset_registry import DatasetRegistry
+from detection import label_anomalies, series_from_daily
+from detectors import get_detector
+from downsample import SeriesPyramid
+from instrumentation import span
+from model_registry import ModelRegistry
+from rollups import compute_rollup, rollup_means
+from storage import from_epoch_minutes, load_compact, release_freed_memory
+from user_index import UserIndex, time_slice
+
+# Memoized data and model layer for the dashboard.
+#
+# Streamlit reruns app.py on every widget change. Everything expensive is
+# cached here under the upload's content hash plus the user, metric and
+# date window it depends on, so going back to a view seen before is a
+# cache lookup. Each cache keeps a bounded number of entries and evicts
+# the least recently used one.
+
+MAX_DATASETS = 2
+MAX_SERIES = 128
+MAX_FORECASTS = 128
+
+
+def upload_hash(uploaded_file):
+    # Hash the upload once per file and remember it for later reruns
+    cached = st.session_state.get("upload_hash")
+    if cached and cached[0] == uploaded_file.file_id:
+        return cached[1]
+    digest = hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+    st.session_state["upload_hash"] = (uploaded_file.file_id, digest)
+    return digest
+
+
+@st.cache_resource(show_spinner=False)
+def dataset_registry():
+    return DatasetRegistry()
+
+
+def hold_dataset(content_hash):
+    """Lease this session's dataset in the shared registry, on every rerun.
+
+    Switching to another upload gives up the lease on the previous one, and
+    datasets no session has leased for a while are evicted.
+    """
+    registry = dataset_registry()
+    session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    previous = st.session_state.get("dataset_lease")
+    if previous is not None and previous != content_hash:
+        registry.release(previous, session_id)
+    if content_hash is not None:
+        registry.acquire(content_hash, session_id)
+    st.session_state["dataset_lease"] = content_hash
+    registry.evict_unused()
+
+
+# The upload is parsed once per box into the shared registry, in the
+# compact dtypes of storage.load_compact() (epoch minutes in a "minute"
+# column instead of datetimes). Every session gets the same memory-mapped,
+# read-only views of it, so callers must treat the frame as read-only.
+@st.cache_resource(max_entries=MAX_DATASETS, show_spinner=False)
+def load_dataset(content_hash, _uploaded_file):
+    registry = dataset_registry()
+    if content_hash not in registry:
+        _uploaded_file.seek(0)
+        registry.publish(content_hash, load_compact(_uploaded_file))
+        release_freed_memory()
+    return registry.open(content_hash)
+
+
+# Id offsets into the dataset: the user list, and each user's rows as a
+# zero-copy slice, without scanning the dataset again
+@st.cache_resource(max_entries=MAX_DATASETS, show_spinner=False)
+def user_index(content_hash, _df):
+    return UserIndex(_df)
+
+
+# Daily mean/min/max/count of every metric per user, one pass per upload.
+# A (user, metric, date window) series is then a slice of the user's few
+# hundred rollup rows instead of a resample of their minute rows.
+@st.cache_resource(max_entries=MAX_DATASETS, show_spinner=False)
+def daily_rollup(content_hash, _df):
+    rollup = compute_rollup(_df, "D")
+    release_freed_memory()
+    return UserIndex(rollup)
+
+
+@st.cache_data(max_entries=MAX_SERIES, show_spinner=False)
+def user_series(content_hash, user_id, metric, start_date, end_date, _user_rollup):
+    rows = _user_rollup
+    if start_date is not None:
+        start = pd.Timestamp(start_date).to_datetime64()
+        end = (pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_datetime64()
+        rows = time_slice(rows, "ds", start, end)
+    return series_from_daily(rollup_means(rows, [metric]), metric)
+
+
+@st.cache_data(max_entries=MAX_FORECASTS, show_spinner=False)
+def detect_series_anomalies(content_hash, user_id, metric, start_date, end_date,
+                            detector_name, _data):
+    if detector_name == "prophet":
+        # Fitted models also persist on disk, across restarts and uploads
+        detector = get_detector("prophet", registry=ModelRegistry())
+    else:
+        detector = get_detector(detector_name)
+    merged = detector.score_series(_data, user_id, metric)
+    return label_anomalies(merged)
+
+
+# Zoom levels of a detected series. The charts draw one window of at most
+# downsample.MAX_POINTS points from them, however long the series is.
+@st.cache_resource(max_entries=MAX_FORECASTS, show_spinner=False)
+def plot_pyramid(content_hash, user_id, metric, start_date, end_date, detector_name, _merged):
+    return SeriesPyramid(_merged)
+
+
+@st.cache_resource(max_entries=MAX_SERIES, show_spinner=False)
+def minute_pyramid(content_hash, user_id, start_date, end_date, _index):
+    """One user's heart rate scored at 1-minute resolution, as zoom levels."""
+    # Loaded on first use, like plotly in app.py
+    from minute_detection import detect_minutes
+
+    rows = _index[user_id]
+    if start_date is not None:
+        start = pd.Timestamp(start_date).value // 60_000_000_000
+        end = (pd.Timestamp(end_date) + pd.Timedelta(days=1)).value // 60_000_000_000
+        rows = time_slice(rows, "minute", start, end)
+    frame = pd.DataFrame({
+        "Id": user_id,
+        "timestamp": from_epoch_minutes(rows["minute"].to_numpy()),
+        "heart_rate": rows["heart_rate"].to_numpy(dtype="float64"),
+        "steps": rows["steps"].to_numpy(dtype="float64"),
+    })
+    frame = frame[frame["heart_rate"].notna()]
+    if frame.empty:
+        return None
+    results, _ = detect_minutes(frame, "heart_rate")
+    return SeriesPyramid(results)
+
+
+class StageTimings:
+    """Wall time of each dashboard stage in the current rerun.
+
+    With tracing on (FITPULSE_TRACE, see instrumentation.py) every stage is
+    also written to the trace file as a "dashboard.<stage>" span.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self._planned = []
+        self._bar = None
+
+    def run(self, stage, fn, *args):
+        start = time.perf_counter()
+        with span("dashboard." + stage.lower().replace(" ", "_")):
+            result = fn(*args)
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+        if self._bar is not None:
+            if all(s in self.seconds for s in self._planned):
+                self._bar.empty()
+                self._bar = None
+            else:
+                self._bar.progress(*self._progress(stage))
+        return result
+
+    def show_progress(self, planned):
+        """Show a progress bar that run() advances as each of the ``planned`` stages
+        finishes and removes after the last one."""
+        self._planned = list(planned)
+        self._bar = st.progress(*self._progress())
+
+    def _progress(self, stage=None):
+        done = [s for s in self._planned if s in self.seconds]
+        remaining = [s for s in self._planned if s not in self.seconds]
+        text = f"{len(done)}/{len(self._planned)} stages done"
+        if stage is not None:
+            text += f", {stage} took {self.seconds[stage] * 1000:.0f} ms"
+        if remaining:
+            text += f"; running {remaining[0]}..."
+        return len(done) / max(len(self._planned), 1), text
+
+    def as_frame(self):
+        return pd.DataFrame({
+            "Stage": list(self.seconds),
+            "Time (ms)": [round(s * 1000, 1) for s in self.seconds.values()],
+        })
@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Server-side store of uploaded datasets, shared by all dashboard sessions.
+#
+# A dataset is written once, keyed by the upload's content hash, as one
+# .npy file per column (a categorical Id as its codes plus a categories
+# file). Sessions open it with np.load(mmap_mode="r"), so every session
+# and every Streamlit process on the box reads the same page-cached
+# file through zero-copy, read-only views instead of parsing its own copy.
+#
+# Each session viewing a dataset holds a lease, a file touched on every
+# rerun. The number of live leases is the dataset's reference count; a
+# dataset with none for LEASE_SECONDS is evicted. Files are unlinked, not
+# truncated, so a process that still has them mapped keeps reading them.
+
+DEFAULT_REGISTRY_DIR = os.path.join(tempfile.gettempdir(), "fitpulse_datasets")
+LEASE_SECONDS = 30 * 60
+
+META_NAME = "meta.json"
+
+
+class DatasetRegistry:
+    """Memory-mapped datasets keyed by content hash, with session leases."""
+
+    def __init__(self, root=DEFAULT_REGISTRY_DIR, lease_seconds=LEASE_SECONDS):
+        self.root = root
+        self.lease_seconds = lease_seconds
+        self.stats = {"published": 0, "opened": 0, "evicted": 0}
+
+    def _dataset_dir(self, content_hash):
+        return os.path.join(self.root, "datasets", content_hash)
+
+    def _lease_dir(self, content_hash):
+        return os.path.join(self.root, "leases", content_hash)
+
+    def __contains__(self, content_hash):
+        return os.path.exists(os.path.join(self._dataset_dir(content_hash), META_NAME))
+
+    # -------------------------------
+    # Datasets
+    # -------------------------------
+    def publish(self, content_hash, df):
+        """Store ``df`` under ``content_hash`` unless another session already did."""
+        if content_hash in self:
+            return
+        os.makedirs(os.path.join(self.root, "datasets"), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{content_hash}.", dir=os.path.join(self.root, "datasets"))
+        columns = []
+        for i, (name, column) in enumerate(df.items()):
+            entry = {"name": name, "file": f"{i}.npy"}
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                np.save(os.path.join(tmp_dir, f"{i}.categories.npy"), column.cat.categories.to_numpy())
+                entry["ordered"] = bool(column.cat.ordered)
+                values = column.cat.codes.to_numpy()
+            else:
+                values = column.to_numpy()
+            np.save(os.path.join(tmp_dir, entry["file"]), values)
+            columns.append(entry)
+        with open(os.path.join(tmp_dir, META_NAME), "w") as f:
+            json.dump({"rows": len(df), "columns": columns}, f)
+
+        try:
+            os.rename(tmp_dir, self._dataset_dir(content_hash))
+            self.stats["published"] += 1
+        except OSError:
+            # Published by another process in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def open(self, content_hash):
+        """The dataset as a DataFrame of read-only views of the mapped files."""
+        folder = self._dataset_dir(content_hash)
+        with open(os.path.join(folder, META_NAME)) as f:
+            meta = json.load(f)
+
+        data = {}
+        for entry in meta["columns"]:
+            # Plain ndarray views of the mapping; np.memmap results confuse pandas
+            values = np.load(os.path.join(folder, entry["file"]), mmap_mode="r").view(np.ndarray)
+            if "ordered" in entry:
+                categories = np.load(os.path.join(folder, entry["file"].replace(".npy", ".categories.npy")))
+                dtype = pd.CategoricalDtype(pd.Index(categories), ordered=entry["ordered"])
+                # Codes were stored at the width pandas picks, so no cast and no copy
+                values = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+            data[entry["name"]] = values
+        self.stats["opened"] += 1
+        return pd.DataFrame(data, copy=False)
+
+    # -------------------------------
+    # Leases and eviction
+    # -------------------------------
+    def acquire(self, content_hash, session_id):
+        """Take or renew ``session_id``'s lease on ``content_hash``."""
+        folder = self._lease_dir(content_hash)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, session_id)
+        with open(path, "a"):
+            os.utime(path)
+
+    def release(self, content_hash, session_id):
+        try:
+            os.remove(os.path.join(self._lease_dir(content_hash), session_id))
+        except FileNotFoundError:
+            pass
+
+    def refcount(self, content_hash):
+        """Sessions whose lease on ``content_hash`` has not expired."""
+        folder = self._lease_dir(content_hash)
+        if not os.path.isdir(folder):
+            return 0
+        cutoff = time.time() - self.lease_seconds
+        count = 0
+        for name in os.listdir(folder):
+            try:
+                count += os.path.getmtime(os.path.join(folder, name)) >= cutoff
+            except FileNotFoundError:
+                pass
+        return count
+
+    def evict_unused(self):
+        """Remove datasets nobody has viewed for ``lease_seconds``."""
+        datasets = os.path.join(self.root, "datasets")
+        if not os.path.isdir(datasets):
+            return []
+        cutoff = time.time() - self.lease_seconds
+        evicted = []
+        for content_hash in os.listdir(datasets):
+            folder = os.path.join(datasets, content_hash)
+            if content_hash.startswith("."):
+                # Unfinished publish; only removed once clearly abandoned
+                if os.path.getmtime(folder) < cutoff:
+                    shutil.rmtree(folder, ignore_errors=True)
+                continue
+            # Freshly published datasets get a grace period to be leased
+            if self.refcount(content_hash) or os.path.getmtime(folder) >= cutoff:
+                continue
+            shutil.rmtree(folder, ignore_errors=True)
+            shutil.rmtree(self._lease_dir(content_hash), ignore_errors=True)
+            evicted.append(content_hash)
+        self.stats["evicted"] += len(evicted)
+        return evicted
+
+    def summary(self):
+        datasets = os.path.join(self.root, "datasets")
+        hashes = [h for h in os.listdir(datasets) if not h.startswith(".")] if os.path.isdir(datasets) else []
+        return pd.DataFrame({
+            "dataset": hashes,
+            "sessions": [self.refcount(h) for h in hashes],
+            "MB": [
+                round(sum(e.stat().st_size for e in os.scandir(self._dataset_dir(h))) / 2**20, 1)
+                for h in hashes
+            ],
+        })
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+MILESTONES = [os.path.join(ROOT, m) for m in ("Milestone1", "Milestone2", "Milestone3", "Milestone4")]
+
+# Start-up time of the pipeline's entry points.
+#
+# Each entry point is started with nothing to do (--help for the scripts;
+# the dashboard's imports up to its first st.stop() for the app) in a
+# fresh interpreter, several times, and the median wall time is reported
+# together with the slowest top-level imports from ``python -X importtime``
+# and whether any of the heavy backends got loaded. None of them should
+# be: Prophet, scikit-learn, matplotlib, tsfresh and plotly are imported
+# on first use. --max-seconds turns the report into a check.
+
+ENTRY_POINTS = {
+    "preprocess": ["Milestone1/preprocess.py", "--help"],
+    "feature_extraction": ["Milestone2/feature_extraction.py", "--help"],
+    "modeling": ["Milestone2/modeling.py", "--help"],
+    "anomaly_detection": ["Milestone3/anomaly_detection.py", "--help"],
+    "batch_scoring": ["Milestone3/batch_scoring.py", "--help"],
+    # app.py runs on import; these are its imports before the upload prompt
+    "dashboard": ["-c", f"import sys; sys.path[:0] = {MILESTONES!r}; "
+                        "import streamlit, dashboard_cache, detectors, storage"],
+}
+
+# Streamlit itself imports the (cheap) plotly package, not plotly.express
+HEAVY_MODULES = ["prophet", "cmdstanpy", "sklearn", "matplotlib.pyplot", "tsfresh", "plotly.express"]
+
+DEFAULT_REPEATS = 5
+
+
+def _command(entry):
+    args = ENTRY_POINTS[entry]
+    if args[0] == "-c":
+        return [sys.executable, "-X", "importtime"] + args
+    return [sys.executable, "-X", "importtime", os.path.join(ROOT, args[0])] + args[1:]
+
+
+def _parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package"; returns the
+    # cumulative microseconds per top-level package and every module loaded
+    cumulative = {}
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, total, name = line.split("|")
+        name = name.strip()
+        modules.add(name)
+        package = name.split(".")[0]
+        cumulative[package] = max(cumulative.get(package, 0), int(total))
+    return cumulative, modules
+
+
+def measure(entry, repeats=DEFAULT_REPEATS):
+    seconds = []
+    imports, modules = {}, set()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        child = subprocess.run(_command(entry), capture_output=True, text=True, cwd=ROOT)
+        seconds.append(time.perf_counter() - start)
+        if child.returncode != 0:
+            return {"error": child.stderr.strip().splitlines()[-1:]}
+        imports, modules = _parse_importtime(child.stderr)
+
+    slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {
+        "seconds": round(statistics.median(seconds), 3),
+        "slowest_imports_s": {name: round(us / 1e6, 3) for name, us in slowest},
+        "heavy_loaded": [name for name in HEAVY_MODULES if name in modules],
+    }
+
+
+def run(entries, repeats=DEFAULT_REPEATS):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+    report = {"interpreter_seconds": round((time.perf_counter() - start) / repeats, 3)}
+    for entry in entries:
+        report[entry] = measure(entry, repeats)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start-up time of the pipeline entry points")
+    parser.add_argument("--entries", nargs="+", choices=list(ENTRY_POINTS), default=list(ENTRY_POINTS))
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="exit with status 1 if any entry point starts slower than this")
+    parser.add_argument("--json", default=None, help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args.entries, args.repeats)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.max_seconds is not None:
+        slow = [entry for entry in args.entries
+                if report[entry].get("seconds", float("inf")) > args.max_seconds]
+        if slow:
+            print(f"Slower than {args.max_seconds}s: {', '.join(slow)}")
+            sys.exit(1)
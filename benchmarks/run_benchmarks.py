@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for milestone in ("Milestone1", "Milestone2", "Milestone3", "Milestone4"):
+    sys.path.append(os.path.join(ROOT, milestone))
+
+from synthetic_fleet import generate
+
+# Timed scenarios over the whole pipeline, on a synthetic Fitbit fleet.
+#
+# The fleet (synthetic_fleet.py) is written once; the scenarios then run
+# in order on it, each in a fresh process so its peak RSS is its own.
+# Preprocessing goes first and leaves the cleaned Parquet dataset the
+# later scenarios read. Only the scenario itself is timed, not imports.
+# The report is JSON with the wall time, peak RSS and rows/s of every
+# scenario plus the commit and configuration, and --compare checks it
+# against an earlier report to catch regressions between commits.
+
+SCENARIOS = [
+    "preprocess_streaming",
+    "preprocess",
+    "features_tsfresh",
+    "features_native",
+    "clustering",
+    "clustering_minibatch",
+    "detection_prophet",
+    "detection_batch",
+    "dashboard_prep",
+]
+
+# A scenario this much slower than the baseline report is a regression
+DEFAULT_TOLERANCE = 1.25
+
+
+# -------------------------------
+# Scenarios
+# -------------------------------
+# Each takes the work folder and the run configuration, does its work and
+# returns the number of rows (or series/users) it processed.
+def _cleaned_path(work_dir):
+    from storage import find_cleaned_dataset
+    return find_cleaned_dataset(work_dir)
+
+
+def preprocess_streaming(work_dir, config):
+    from preprocess import preprocess_data
+    preprocess_data(work_dir, streaming=True, memory_budget_mb=256, output_format="parquet")
+    return config["raw_rows"]["heartrate"]
+
+
+def preprocess(work_dir, config):
+    from preprocess import preprocess_data
+    preprocess_data(work_dir, output_format="parquet")
+    return config["raw_rows"]["heartrate"]
+
+
+def features_tsfresh(work_dir, config):
+    from feature_extraction import extract_parallel, load_ts_data
+    from storage import list_users
+
+    path = _cleaned_path(work_dir)
+    ts_data = load_ts_data(path, list_users(path))
+    extract_parallel(ts_data, config["workers"])
+    return len(ts_data)
+
+
+def features_native(work_dir, config):
+    from feature_extraction import load_ts_data
+    from storage import list_users
+    from window_features import extract_minimal
+
+    path = _cleaned_path(work_dir)
+    ts_data = load_ts_data(path, list_users(path))
+    extract_minimal(ts_data)
+    return len(ts_data)
+
+
+def clustering(work_dir, config):
+    # modeling.py's in-memory clustering, on native features of every user
+    from feature_extraction import load_ts_data, select_features
+    from modeling import cluster_in_memory
+    from storage import list_users
+    from window_features import extract_minimal
+
+    path = _cleaned_path(work_dir)
+    features_path = os.path.join(work_dir, "selected_features.csv")
+    select_features(extract_minimal(load_ts_data(path, list_users(path)))).to_csv(features_path)
+    _, clusters = cluster_in_memory(features_path, k=2)
+    return len(clusters)
+
+
+def clustering_minibatch(work_dir, config):
+    # The streamed clustering of modeling.py --clustering minibatch, k chosen
+    from clustering import assign_file, fit_minibatch
+    from feature_extraction import load_ts_data, select_features
+    from storage import list_users
+    from window_features import extract_minimal
+
+    path = _cleaned_path(work_dir)
+    features_path = os.path.join(work_dir, "selected_features.csv")
+    select_features(extract_minimal(load_ts_data(path, list_users(path)))).to_csv(features_path)
+    model, _ = fit_minibatch(features_path, workers=config["workers"])
+    return assign_file(features_path, model, os.path.join(work_dir, "cluster_assignments.csv"))
+
+
+def detection_prophet(work_dir, config):
+    from detection import detect_anomalies
+    from storage import list_users, load_cleaned_dataset
+    from user_index import UserIndex
+
+    path = _cleaned_path(work_dir)
+    user_ids = list_users(path)[:config["prophet_users"]]
+    df = load_cleaned_dataset(path, columns=["Id", "timestamp", "heart_rate"], user_ids=user_ids)
+    df["timestamp"] = df["timestamp"].dt.tz_localize(None)
+    results, failed = detect_anomalies(UserIndex(df), user_ids, ["heart_rate"],
+                                       workers=config["workers"])
+    return len(user_ids) - len(failed)
+
+
+def detection_batch(work_dir, config):
+    from batch_scoring import score_all
+
+    _, _, report = score_all(_cleaned_path(work_dir), detector_name="seasonal")
+    return report["series"]
+
+
+def dashboard_prep(work_dir, config):
+    # What the dashboard does for an upload, then every user/metric series
+    from detection import series_from_daily
+    from rollups import compute_rollup, rollup_means
+    from storage import load_compact
+    from user_index import UserIndex
+
+    upload = os.path.join(work_dir, "upload.parquet")
+    if not os.path.exists(upload):
+        from storage import load_cleaned_dataset
+        load_cleaned_dataset(_cleaned_path(work_dir)).to_parquet(upload, index=False)
+
+    with open(upload, "rb") as f:
+        df = load_compact(f)
+    rollup = UserIndex(compute_rollup(df, "D"))
+    for _, user_rollup in rollup:
+        for metric in ("heart_rate", "steps", "sleep"):
+            series_from_daily(rollup_means(user_rollup, [metric]), metric)
+    return len(df)
+
+
+def peak_rss_mb():
+    # VmHWM starts over at exec; ru_maxrss would carry the parent's peak
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+def run_scenario(name, work_dir, config):
+    start = time.perf_counter()
+    rows = globals()[name](work_dir, config)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "rows": int(rows),
+        "rows_per_s": round(rows / seconds, 1) if seconds else None,
+    }
+
+
+# -------------------------------
+# Harness
+# -------------------------------
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(work_dir, config, scenarios=SCENARIOS):
+    """Generate the fleet in ``work_dir`` and run ``scenarios``; returns the report."""
+    import pandas as pd
+
+    start = time.perf_counter()
+    config["raw_rows"] = generate(work_dir, config["users"], config["days"],
+                                  config["hr_interval"], config["seed"])
+    report = {
+        "commit": _commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "config": config,
+        "generate_seconds": round(time.perf_counter() - start, 3),
+        "scenarios": {},
+    }
+
+    if not any(name.startswith("preprocess") for name in scenarios):
+        # The other scenarios read the cleaned dataset; prepared, not reported
+        _run_child("preprocess", work_dir, config)
+    for name in scenarios:
+        report["scenarios"][name] = _run_child(name, work_dir, config)
+    return report
+
+
+def _run_child(name, work_dir, config):
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--scenario", name,
+         "--work-dir", work_dir, "--config", json.dumps(config)],
+        capture_output=True, text=True,
+    )
+    if child.returncode != 0:
+        return {"error": child.stderr.strip().splitlines()[-1:]}
+    # The scenario's own output comes first; the result is the last line
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Per-scenario time and memory ratios against ``baseline``; regressions flagged."""
+    rows = []
+    for name, current in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or "seconds" not in before or "seconds" not in current:
+            continue
+        time_ratio = current["seconds"] / before["seconds"] if before["seconds"] else None
+        rss_ratio = current["peak_rss_mb"] / before["peak_rss_mb"] if before["peak_rss_mb"] else None
+        rows.append({
+            "scenario": name,
+            "seconds": current["seconds"],
+            "baseline_seconds": before["seconds"],
+            "time_ratio": round(time_ratio, 2) if time_ratio else None,
+            "rss_ratio": round(rss_ratio, 2) if rss_ratio else None,
+            "regression": bool(time_ratio and time_ratio > tolerance
+                               or rss_ratio and rss_ratio > tolerance),
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on a synthetic fleet")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--hr-interval", type=int, default=10,
+                        help="seconds between heart rate readings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prophet-users", type=int, default=5,
+                        help="users fitted in the Prophet scenario")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--work-dir", default=None, help="keep the fleet and outputs here")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+    parser.add_argument("--compare", default=None, help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--scenario", choices=SCENARIOS, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--config", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        result = run_scenario(args.scenario, args.work_dir, json.loads(args.config))
+        print(json.dumps(result))
+        sys.exit()
+
+    config = {
+        "users": args.users,
+        "days": args.days,
+        "hr_interval": args.hr_interval,
+        "seed": args.seed,
+        "prophet_users": args.prophet_users,
+        "workers": args.workers,
+    }
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        report = run(args.work_dir, config, args.scenarios)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = run(work_dir, config, args.scenarios)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            rows = compare(report, json.load(f), args.tolerance)
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['scenario']:<22} {row['seconds']:>9.3f}s  x{row['time_ratio']} time  "
+                  f"x{row['rss_ratio']} peak RSS{flag}")
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
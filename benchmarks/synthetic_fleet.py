@@ -0,0 +1,122 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Synthetic Fitbit exports for benchmarking the pipeline.
+#
+# Writes heartrate.csv, steps.csv and sleep.csv in the shape of the Fitbit
+# Fitabase exports Milestone 1 reads: heart rate every ``hr_interval``
+# seconds (with jitter) while the device is worn, a steps row for every
+# minute of the day and one sleep total per night. Each user has their own
+# resting heart rate and activity level, heart rate follows the day's
+# rhythm and the minute's steps, and each day has an unworn (charging)
+# gap. Rows are ordered by Id and time like the real exports, so the
+# streaming preprocessor accepts them. The same arguments and seed always
+# give the same files.
+
+START = "2016-04-12"
+# Users generated and written per batch, bounding memory at large sizes
+BATCH_USERS = 20
+
+
+def _time_of_day_strings():
+    # "12:00:24 AM" for every second of the day, formatted once
+    seconds = pd.to_datetime(np.arange(24 * 3600), unit="s")
+    return np.asarray(seconds.strftime("%I:%M:%S %p"), dtype=object)
+
+
+def _day_strings(days):
+    dates = pd.date_range(START, periods=days, freq="D")
+    return np.asarray(dates.strftime("%m/%d/%Y "), dtype=object)
+
+
+def _user(rng, days, hr_interval):
+    minutes = days * 24 * 60
+    minute_of_day = np.arange(minutes) % (24 * 60)
+    hour = minute_of_day // 60
+
+    # Steps: active minutes mostly in the daytime, zeros at night
+    activity = rng.uniform(0.1, 0.35)
+    daytime = (hour >= 7) & (hour < 22)
+    active = rng.random(minutes) < np.where(daytime, activity, 0.01)
+    steps = np.where(active, rng.poisson(rng.uniform(40, 90), minutes), 0)
+
+    # Worn minutes: each day loses a 1-3 hour charging gap
+    worn = np.ones(minutes, dtype=bool)
+    gap_start = rng.integers(0, 24 * 60 - 180, days)
+    gap_length = rng.integers(60, 180, days)
+    for day in range(days):
+        first = day * 24 * 60 + gap_start[day]
+        worn[first:first + gap_length[day]] = False
+
+    # Heart rate readings inside each worn minute
+    per_minute = max(1, 60 // hr_interval)
+    reading_minutes = np.repeat(np.flatnonzero(worn), per_minute)
+    offsets = np.tile(np.arange(per_minute) * hr_interval, worn.sum())
+    jitter = rng.integers(0, max(1, min(hr_interval, 60)), len(reading_minutes))
+    seconds = reading_minutes * 60 + np.minimum(offsets + jitter, 59)
+
+    resting = rng.normal(66, 6)
+    rhythm = -6 * np.cos(2 * np.pi * (minute_of_day[reading_minutes] - 4 * 60) / (24 * 60))
+    heart_rate = (resting + rhythm + 0.35 * steps[reading_minutes]
+                  + rng.normal(0, 4, len(reading_minutes)))
+
+    # Sleep: one total per logged night
+    logged = rng.random(days) < 0.85
+    sleep = np.clip(rng.normal(rng.uniform(360, 480), 50, days), 60, 900).round()
+    return seconds, np.clip(heart_rate, 40, 200).round().astype(int), steps, np.flatnonzero(logged), sleep[logged]
+
+
+def generate(out_dir, users=20, days=14, hr_interval=10, seed=0):
+    """Write the three exports for ``users`` x ``days``; returns row counts."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    user_ids = 1_000_000_000 + np.sort(rng.choice(9_000_000_000, users, replace=False))
+    tod = _time_of_day_strings()
+    day_strings = _day_strings(days)
+    minute_seconds = np.arange(days * 24 * 60) * 60
+
+    paths = {name: os.path.join(out_dir, f"{name}.csv") for name in ("heartrate", "steps", "sleep")}
+    rows = {name: 0 for name in paths}
+    for first in range(0, users, BATCH_USERS):
+        frames = {name: [] for name in paths}
+        for uid in user_ids[first:first + BATCH_USERS]:
+            seconds, heart_rate, steps, sleep_days, sleep = _user(rng, days, hr_interval)
+            frames["heartrate"].append(pd.DataFrame({
+                "Id": uid,
+                "Time": day_strings[seconds // 86400] + tod[seconds % 86400],
+                "Value": heart_rate,
+            }))
+            frames["steps"].append(pd.DataFrame({
+                "Id": uid,
+                "ActivityMinute": day_strings[minute_seconds // 86400] + tod[minute_seconds % 86400],
+                "Steps": steps,
+            }))
+            frames["sleep"].append(pd.DataFrame({
+                "Id": uid,
+                "SleepDay": day_strings[sleep_days] + tod[0],
+                "TotalMinutesAsleep": sleep.astype(int),
+            }))
+        for name, path in paths.items():
+            batch = pd.concat(frames[name], ignore_index=True)
+            batch.to_csv(path, mode="w" if first == 0 else "a", header=first == 0, index=False)
+            rows[name] += len(batch)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic Fitbit exports")
+    parser.add_argument("--out-dir", required=True, help="folder for heartrate/steps/sleep.csv")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--hr-interval", type=int, default=10,
+                        help="seconds between heart rate readings")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = generate(args.out_dir, args.users, args.days, args.hr_interval, args.seed)
+    print(f"Wrote {rows} rows to {args.out_dir} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,28 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# The milestone scripts import each other as top-level modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for milestone in ("Milestone1", "Milestone2", "Milestone3", "Milestone4", "benchmarks"):
+    sys.path.append(os.path.join(ROOT, milestone))
+
+
+@pytest.fixture(scope="session")
+def raw_fleet(tmp_path_factory):
+    """Raw heartrate/steps/sleep CSVs of a small synthetic fleet."""
+    from synthetic_fleet import generate
+
+    path = tmp_path_factory.mktemp("raw_fleet")
+    generate(str(path), users=4, days=3, hr_interval=10)
+    return path
+
+
+@pytest.fixture
+def fleet_dir(raw_fleet, tmp_path):
+    # A private copy: preprocessing writes its outputs next to the inputs
+    for name in os.listdir(raw_fleet):
+        shutil.copy(raw_fleet / name, tmp_path / name)
+    return tmp_path
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from incremental import ingest_frames, preprocess_incremental
+from preprocess import clean_heart_rate, clean_sleep, clean_steps, parse_times, preprocess_data
+from storage import COLUMNS, PARQUET_NAME, load_cleaned_dataset
+
+USER = 1503960366
+
+
+def frames(hr=(), steps=(), sleep=()):
+    # Raw export rows -> the cleaned frames ingest_frames() takes
+    return (
+        clean_heart_rate(pd.DataFrame(list(hr), columns=["Id", "Time", "Value"])),
+        clean_steps(pd.DataFrame(list(steps), columns=["Id", "ActivityMinute", "Steps"])),
+        clean_sleep(pd.DataFrame(list(sleep), columns=["Id", "SleepDay", "TotalMinutesAsleep"])),
+    )
+
+
+def stored(base_path):
+    rows = load_cleaned_dataset(os.path.join(base_path, PARQUET_NAME), columns=COLUMNS)
+    return rows.sort_values(["Id", "timestamp"], ignore_index=True)
+
+
+def minute(rows, time):
+    return rows[rows["timestamp"] == pd.Timestamp(f"2016-04-12 {time}", tz="UTC")].iloc[0]
+
+
+def test_late_heart_rate_is_weighted_by_sample_count(tmp_path):
+    ingest_frames(str(tmp_path), *frames(hr=[
+        (USER, "4/12/2016 10:00:05 AM", 60),
+        (USER, "4/12/2016 10:00:15 AM", 70),
+        (USER, "4/12/2016 10:01:00 AM", 80),
+    ]))
+    summary = ingest_frames(str(tmp_path), *frames(hr=[(USER, "4/12/2016 10:00:30 AM", 90)]))
+
+    rows = stored(tmp_path)
+    assert summary == {"appended": 0, "late_minutes": 1}
+    assert len(rows) == 2
+    # (60 + 70 + 90) / 3, not the mean of the stored mean and the late reading
+    assert minute(rows, "10:00")["heart_rate"] == pytest.approx(220 / 3)
+    assert minute(rows, "10:01")["heart_rate"] == 80
+
+
+def test_pending_steps_land_when_their_heart_rate_arrives(tmp_path):
+    ingest_frames(str(tmp_path), *frames(
+        hr=[(USER, "4/12/2016 10:00:00 AM", 70)],
+        steps=[(USER, "4/12/2016 10:00:00 AM", 5), (USER, "4/12/2016 10:05:00 AM", 42)],
+    ))
+    assert len(stored(tmp_path)) == 1
+
+    ingest_frames(str(tmp_path), *frames(hr=[(USER, "4/12/2016 10:05:10 AM", 75)]))
+    rows = stored(tmp_path)
+    assert minute(rows, "10:00")["steps"] == 5
+    assert minute(rows, "10:05")["steps"] == 42
+
+
+def _split_export(raw_dir, cutoffs, folders):
+    # Rows before cutoffs[0] go to folders[0], and so on; the rest to the last folder
+    for name, time_column in (("heartrate.csv", "Time"), ("steps.csv", "ActivityMinute"),
+                              ("sleep.csv", "SleepDay")):
+        raw = pd.read_csv(os.path.join(raw_dir, name))
+        part = np.searchsorted(np.array(cutoffs), parse_times(raw[time_column]), side="right")
+        for i, folder in enumerate(folders):
+            raw[part == i].to_csv(os.path.join(folder, name), index=False)
+
+
+@pytest.mark.parametrize("batches", [1, 2])
+def test_full_run_plus_incremental_matches_one_full_run(raw_fleet, tmp_path, batches):
+    full_dir, split_dir = tmp_path / "full", tmp_path / "split"
+    batch_dirs = [tmp_path / f"batch{i}" for i in range(batches)]
+    for folder in [full_dir, split_dir] + batch_dirs:
+        folder.mkdir()
+    for name in os.listdir(raw_fleet):
+        (full_dir / name).write_bytes((raw_fleet / name).read_bytes())
+
+    # Mid-day, so each batch appends to a day that is already stored and
+    # whose sleep log came with an earlier run
+    start = parse_times(pd.read_csv(raw_fleet / "heartrate.csv", nrows=1)["Time"]).iloc[0]
+    cutoffs = [start.floor("D") + pd.Timedelta(days=1, hours=12 + 6 * i) for i in range(batches)]
+    _split_export(raw_fleet, cutoffs, [split_dir] + batch_dirs)
+
+    preprocess_data(str(full_dir), output_format="parquet")
+    preprocess_data(str(split_dir), output_format="parquet")
+    for batch_dir in batch_dirs:
+        preprocess_incremental(str(split_dir), str(batch_dir))
+
+    expected, actual = stored(full_dir), stored(split_dir)
+    assert len(actual) == len(expected)
+    pd.testing.assert_frame_equal(actual[["Id", "timestamp"]], expected[["Id", "timestamp"]],
+                                  check_dtype=False)
+    for column in ("heart_rate", "steps", "sleep"):
+        np.testing.assert_allclose(actual[column], expected[column], err_msg=column)
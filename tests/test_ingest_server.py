@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+
+from ingest_server import IngestPipeline, ValidationError, validate
+
+
+def reading(**fields):
+    record = {"Id": 1503960366, "timestamp": "2016-04-12T00:00:00Z", "heart_rate": 70.0}
+    record.update(fields)
+    return record
+
+
+def test_validate_types_a_batch():
+    frame = validate([reading(), reading(Id=2**63 - 1, steps=12)])
+    assert frame["Id"].dtype == "int64"
+    assert frame["Id"].iloc[1] == 2**63 - 1
+
+
+@pytest.mark.parametrize("user_id", [2**63, -2**63 - 1, 10**30])
+def test_validate_rejects_ids_outside_int64(user_id):
+    with pytest.raises(ValidationError, match="reading 1: Id"):
+        validate([reading(), reading(Id=user_id)])
+
+
+def test_out_of_range_id_is_a_422(tmp_path):
+    pipeline = IngestPipeline(str(tmp_path))
+    status, body = asyncio.run(pipeline.submit([reading(Id=2**63)]))
+    assert status == 422
+    assert "Id" in body["error"]
+    assert pipeline.counters["rejected"] == 1
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from conftest import ROOT
+from preprocess import chunk_rows_for_budget, preprocess_data
+from storage import CSV_NAME
+
+PREPROCESS = os.path.join(ROOT, "Milestone1", "preprocess.py")
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_preprocess_exits_cleanly(fleet_dir, output_format):
+    # Arrow's thread pools used to abort the interpreter at exit, after
+    # the run had already reported success
+    for _ in range(5):
+        run = subprocess.run(
+            [sys.executable, PREPROCESS, "--base-path", str(fleet_dir), "--format", output_format],
+            capture_output=True, text=True,
+        )
+        assert run.returncode == 0, run.stderr[-2000:]
+        assert "Preprocessing completed successfully!" in run.stdout
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/task"), reason="needs Linux /proc")
+def test_rollup_write_starts_no_threads(fleet_dir):
+    script = f"""
+import os, sys
+sys.path.append({os.path.join(ROOT, "Milestone1")!r})
+import pandas as pd
+import pyarrow
+from preprocess import preprocess_data
+threads = lambda: len(os.listdir("/proc/self/task"))
+before = threads()
+preprocess_data({str(fleet_dir)!r})
+print(before, threads())
+"""
+    run = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    before, after = map(int, run.stdout.split()[-2:])
+    assert after == before
+
+
+def test_streaming_matches_in_memory(raw_fleet, tmp_path):
+    in_memory, streamed = tmp_path / "in_memory", tmp_path / "streamed"
+    for folder in (in_memory, streamed):
+        folder.mkdir()
+        for name in os.listdir(raw_fleet):
+            (folder / name).write_bytes((raw_fleet / name).read_bytes())
+
+    # 1 MB is 1024 raw rows per chunk; with 6 readings a minute most
+    # chunks end in the middle of a 1-minute bucket
+    assert chunk_rows_for_budget(1) == 1024
+    preprocess_data(str(in_memory))
+    preprocess_data(str(streamed), streaming=True, memory_budget_mb=1)
+
+    pd.testing.assert_frame_equal(
+        pd.read_csv(streamed / CSV_NAME), pd.read_csv(in_memory / CSV_NAME)
+    )
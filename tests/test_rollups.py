@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from rollups import build_rollups, load_rollup
+from storage import PARQUET_NAME, write_cleaned_dataset
+
+
+def fleet(users, days=2):
+    # One reading per hour for every user
+    timestamps = pd.date_range("2016-04-12", periods=days * 24, freq="h", tz="UTC")
+    ids = np.repeat(np.arange(1, users + 1), len(timestamps))
+    return pd.DataFrame({
+        "Id": ids,
+        "timestamp": np.tile(timestamps, users),
+        "heart_rate": 70.0,
+        "steps": 10.0,
+        "sleep": 0.0,
+    })
+
+
+def test_rollups_for_more_users_than_the_arrow_partition_limit(tmp_path):
+    # pyarrow refuses more than 1024 partitions per write by default
+    df = fleet(1100)
+    write_cleaned_dataset(df, os.path.join(tmp_path, PARQUET_NAME))
+    build_rollups(str(tmp_path))
+
+    daily = load_rollup(str(tmp_path), "D")
+    assert daily["Id"].nunique() == 1100
+    assert len(daily) == 1100 * 2
+    assert (daily["heart_rate_count"] == 24).all()
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from benchmark_features import synthetic_ts_data
+from feature_extraction import extract_shard
+from window_features import extract_minimal
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_native_features_match_tsfresh():
+    pytest.importorskip("tsfresh")
+    # Gapped minute heart rate of a few users, in TSFresh long format
+    ts_data = synthetic_ts_data(users=4, minutes=600)
+
+    native = extract_minimal(ts_data)
+    reference = extract_shard(ts_data)
+    reference.index = reference.index.astype(native.index.dtype)
+
+    assert sorted(native.columns) == sorted(reference.columns)
+    assert sorted(native.index) == sorted(reference.index)
+    np.testing.assert_allclose(
+        native.sort_index()[reference.columns].to_numpy(dtype="float64"),
+        reference.sort_index().to_numpy(dtype="float64"),
+        rtol=1e-9,
+    )